@@ -0,0 +1,43 @@
+# Benchmark of the generation of Ornstein-Uhlenbeck processes: the original
+# python loop (_OU_generator_python2), the AR(1) filter (OU_generator), and
+# the batched generation of many processes at once (OU_population)
+
+import time
+import numpy
+from neurotools import stgen
+
+dt, tau, sigma, y0 = 0.1, 10.0, 2.0, 5.0
+t_stop = 10000.0
+n = 100
+
+stg = stgen.StGen()
+
+# same seed: the loop and the filter must give the same trace
+stg.seed(12)
+t1 = time.time()
+y_loop, t = stg._OU_generator_python2(dt, tau, sigma, y0, 0.0, t_stop, array=True)
+t_loop = time.time()-t1
+
+stg.seed(12)
+t1 = time.time()
+y_filter, t = stg.OU_generator(dt, tau, sigma, y0, 0.0, t_stop, array=True)
+t_filter = time.time()-t1
+
+print "One process of %d samples" % len(t)
+print "  python loop     : %.4f s" % t_loop
+print "  lfilter         : %.4f s (x%.0f)" % (t_filter, t_loop/t_filter)
+print "  max difference  : %g" % numpy.max(numpy.abs(y_loop-y_filter))
+
+t1 = time.time()
+for i in xrange(n):
+    stg._OU_generator_python2(dt, tau, sigma, y0, 0.0, t_stop, array=True)
+t_loop = time.time()-t1
+
+t1 = time.time()
+y, t = stg.OU_population(dt, tau, sigma, y0, n, 0.0, t_stop, array=True)
+t_population = time.time()-t1
+
+print "%d processes of %d samples" % (n, len(t))
+print "  python loop     : %.4f s" % t_loop
+print "  OU_population   : %.4f s (x%.0f)" % (t_population, t_loop/t_population)
+print "  mean, std       : %.3f, %.3f (expected %.3f, %.3f)" % (y[:, 1000:].mean(), y[:, 1000:].std(), y0, sigma)
@@ -103,9 +103,8 @@ def get_runtime_warning(name, errmsg):
 
 def check_numpy_version():
     import numpy
-    numpy_version = numpy.__version__.split(".")[0:2]
-    numpy_version = float(".".join(numpy_version))
-    if numpy_version >= 1.2:
+    numpy_version = tuple(int(v) for v in numpy.__version__.split(".")[0:2])
+    if numpy_version >= (1, 2):
         return True
     else:
         return False
@@ -11,6 +11,7 @@ Classes
 -------
 .. autosummary::
 
+   PairwiseCCF
    TuningCurve
 
 Functions
@@ -18,6 +19,7 @@ Functions
 .. autosummary::
    :nosignatures:
 
+   bootstrap_psth
    ccf
    crosscorrelate
    make_kernel
@@ -105,11 +107,164 @@ def ccf(x, y, axis=None):
                            iFxy[0:len(iFxy) / 2]))
     return iFxy / varxy
 
+
+def _ccf_block(args):
+    """Cross-correlation functions of a block of pairs of cached spectra.
+
+    Module-level function (and not a method) so that it can be sent to the
+    workers of a multiprocessing pool.
+    """
+    Fx, Fy, varxy, npad, average = args
+    iFxy = np.fft.irfft(Fx.conj() * Fy, npad, axis=1)
+    iFxy = np.concatenate((iFxy[:, npad / 2:], iFxy[:, :npad / 2]), axis=1)
+    iFxy /= varxy[:, None]
+    if average:
+        return iFxy.sum(axis=0)
+    return iFxy
+
+
+class PairwiseCCF(object):
+    """Batched cross correlation functions between many pairs of series.
+
+    Every row of `x` and `y` is centered and Fourier transformed only once,
+    when the object is created. The cross-correlation functions of the
+    requested pairs of rows are then computed as products of the cached
+    spectra, by blocks of `block_size` pairs. For each pair, the result is
+    the same as the one of ``ccf(x[i], y[j])``.
+
+    Parameters
+    ----------
+    x : 2D array
+        The first series, one per row.
+    y : 2D array, optional
+        The second series, one per row. If `None`, the series of `x` are
+        correlated with themselves and the spectra are shared.
+    block_size : integer, optional
+        Number of pairs whose spectral products are computed at once.
+
+    Examples
+    --------
+    >>> engine = PairwiseCCF(hist)
+    >>> engine.memory_budget()
+    >>> cc = engine.correlate([(0, 1), (0, 2), (1, 2)])
+
+    See also
+    --------
+    ccf
+    """
+
+    def __init__(self, x, y=None, block_size=256):
+        x = np.atleast_2d(np.asarray(x, float))
+        if y is None:
+            self.npad = 2 * x.shape[1]
+            self.Fx, self.varx = self._spectra(x)
+            self.Fy, self.vary = self.Fx, self.varx
+        else:
+            y = np.atleast_2d(np.asarray(y, float))
+            self.npad = x.shape[1] + y.shape[1]
+            self.Fx, self.varx = self._spectra(x)
+            self.Fy, self.vary = self._spectra(y)
+        self.block_size = max(1, int(block_size))
+
+    def _spectra(self, x):
+        xanom = x - x.mean(axis=1)[:, None]
+        return np.fft.rfft(xanom, self.npad, axis=1), (xanom * xanom).sum(1)
+
+    def memory_budget(self):
+        """Return the memory needed by the engine, in bytes.
+
+        This is the size of the cached spectra plus the size of the
+        temporary arrays (spectral products and correlation functions)
+        allocated for one block of pairs.
+        """
+        spectra = self.Fx.nbytes
+        if self.Fy is not self.Fx:
+            spectra += self.Fy.nbytes
+        block = 3 * self.block_size * self.Fx.shape[1] * self.Fx.itemsize + \
+                2 * self.block_size * self.npad * 8
+        return spectra + block
+
+    def _blocks(self, pairs, average):
+        for start in xrange(0, len(pairs), self.block_size):
+            i = pairs[start:start + self.block_size, 0]
+            j = pairs[start:start + self.block_size, 1]
+            varxy = np.sqrt(self.varx[i] * self.vary[j])
+            yield self.Fx[i], self.Fy[j], varxy, self.npad, average
+
+    def correlate(self, pairs, average=False, pool=None):
+        """Return the cross correlation functions of pairs of rows.
+
+        Parameters
+        ----------
+        pairs : sequence of (i, j)
+            Row `i` of `x` is correlated with row `j` of `y`.
+        average : bool, optional
+            If True, only the average of the cross correlation functions over
+            all the pairs is returned.
+        pool : multiprocessing.Pool, optional
+            If given, the blocks of pairs are computed by the workers of the
+            pool.
+
+        Returns
+        -------
+        An array of shape (len(pairs), npad), or of shape (npad,) if
+        `average` is True, with lags increasing from -npad/2 to npad/2-1.
+        """
+        pairs = np.asarray(pairs, int).reshape(-1, 2)
+        if len(pairs) == 0:
+            if average:
+                return np.zeros(self.npad) * np.nan
+            return np.zeros((0, self.npad))
+        if pool is None:
+            results = map(_ccf_block, self._blocks(pairs, average))
+        else:
+            results = pool.map(_ccf_block, self._blocks(pairs, average))
+        if average:
+            return np.sum(results, axis=0) / len(pairs)
+        return np.concatenate(results)
+
+
 from neurotools.plotting import get_display, set_labels
 
 HAVE_PYLAB = check_dependency('pylab')
 
 
+#Number of events of the shuffled surrogates generated at once by crosscorrelate
+_PREDICTOR_BATCH = 1000000
+
+
+def _lag_differences(sua1, sua2, lag, by_event=False):
+    """Differences ``sua1[k] - sua2[j]`` of all the events of `sua2` lying
+    strictly within +/- lag of an event of `sua1`.
+
+    The events of `sua2` are sorted once, and the window of each event of
+    `sua1` is found with two binary searches, so that the cost grows with
+    the number of differences returned rather than with
+    ``sua1.size * sua2.size``. The differences are ordered by event of `sua1`,
+    then by position in `sua2`. If `by_event` is True, the index of the
+    event of `sua1` of every difference is returned as well.
+    """
+    dtype = np.result_type(sua2, 0.)
+    order = np.argsort(sua2, kind='mergesort')
+    sorted2 = sua2[order].astype(dtype)
+    #the bounds are computed as in the scalar expression sua1[k] - lag
+    lower = np.asarray(sua1, float) - lag
+    upper = np.asarray(sua1, float) + lag
+    lo = np.searchsorted(sorted2, lower.astype(dtype), 'right')
+    hi = np.searchsorted(sorted2, upper.astype(dtype), 'left')
+    counts = np.maximum(hi - lo, 0)
+    k = np.repeat(np.arange(sua1.size), counts)
+    pos = np.arange(k.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = order[lo[k] + pos]
+    if np.any(order[1:] < order[:-1]):
+        idx = np.lexsort((j, k))
+        k, j = k[idx], j[idx]
+    differences = (sua1.astype(dtype)[k] - sua2.astype(dtype)[j]).astype(float)
+    if by_event:
+        return differences, k
+    return differences
+
+
 def crosscorrelate(sua1, sua2, lag=None, n_pred=1, predictor=None,
                    display=False, kwargs={}):
     """Cross-correlation between two series of discrete events (e.g. spikes).
@@ -205,26 +360,32 @@ def crosscorrelate(sua1, sua2, lag=None, n_pred=1, predictor=None,
         sua1, sua2 = sua2, sua1
         reverse = True
 
-    #construct predictor
+    #calculate cross differences in spike times, only for the events of
+    #sua2 within +/- lag of each event of sua1
+    differences = _lag_differences(sua1, sua2, lag)
+
+    #construct predictor, by batches of shuffled surrogates of sua2
+    pred = np.array([])
     if predictor is 'shuffle':
         isi = np.diff(sua2)
-        sua2_ = np.array([])
-        for ni in xrange(1,n_pred+1):
-            idx = np.random.permutation(isi.size-1)
-            sua2_ = np.append(sua2_, np.add(np.insert(
-                (np.cumsum(isi[idx])), 0, 0), sua2.min() + (
-                np.random.exponential(isi.mean()))))
-
-    #calculate cross differences in spike times
-    differences = np.array([])
-    pred = np.array([])
-    for k in xrange(0, sua1.size):
-        differences = np.append(differences, sua1[k] - sua2[np.nonzero(
-            (sua2 > sua1[k] - lag) & (sua2 < sua1[k] + lag))])
-    if predictor == 'shuffle':
-        for k in xrange(0, sua1.size):
-            pred = np.append(pred, sua1[k] - sua2_[np.nonzero(
-                (sua2_ > sua1[k] - lag) & (sua2_ < sua1[k] + lag))])
+        batch = max(1, _PREDICTOR_BATCH // max(isi.size, 1))
+        preds = []
+        for start in xrange(0, n_pred, batch):
+            n_batch = min(batch, n_pred - start)
+            idx = np.argsort(np.random.rand(n_batch, isi.size - 1), axis=1)
+            surrogates = np.zeros((n_batch, isi.size))
+            surrogates[:, 1:] = np.cumsum(isi[idx], axis=1)
+            surrogates += sua2.min() + np.random.exponential(isi.mean(),
+                                                             (n_batch, 1))
+            preds.extend(_lag_differences(sua1, sua2_, lag, by_event=True)
+                         for sua2_ in surrogates)
+        if preds:
+            #pool the differences of all the surrogates event by event, as
+            #if they had been concatenated
+            events = np.concatenate([k for d, k in preds])
+            order = np.argsort(events, kind='mergesort')
+            pred = np.concatenate([d for d, k in preds])[order]
+
     if reverse is True:
         differences = -differences
         pred = -pred
@@ -457,6 +618,56 @@ def simple_frequency_spectrum(x):
     return spec
 
 
+def bootstrap_psth(counts, n_boot=1000, confidence=0.95, rng=None):
+    """Bootstrap confidence interval of a peri-stimulus time histogram.
+
+    The trials of a tensor of spike counts, such as the one returned by
+    SpikeList.psth_counts, are resampled with replacement. A resampling only
+    amounts to a weighted sum of the already binned counts, so that the spikes
+    are never binned again.
+
+    Parameters
+    ----------
+    counts : array_like
+        Spike counts of shape (n_trials, n_bins) or (n_cells, n_trials, n_bins).
+    n_boot : int, optional
+        Number of bootstrap resamplings.
+    confidence : float, optional
+        Level of the two-sided confidence interval.
+    rng : numpy.random.RandomState, optional
+        Random number generator drawing the resamplings (default: numpy.random).
+
+    Returns
+    -------
+    mean, lower, upper : ndarray
+        Average psth over the trials and bounds of its confidence interval,
+        with the shape of `counts` without the trial axis.
+
+    See also
+    --------
+    neurotools.signals.SpikeList.psth_counts
+
+    """
+    if rng is None:
+        rng = np.random
+    counts   = np.asarray(counts, float)
+    shape    = counts.shape[:-2] + counts.shape[-1:]
+    counts   = counts.reshape((-1,) + counts.shape[-2:])
+    n_trials = counts.shape[1]
+    # Resampled trials are drawn as multiplicities, one row per resampling
+    weights  = rng.multinomial(n_trials, np.ones(n_trials)/n_trials, size=n_boot)/float(n_trials)
+    q        = 50.*(1 - confidence)
+    lower    = np.zeros((len(counts), counts.shape[2]))
+    upper    = np.zeros((len(counts), counts.shape[2]))
+    # Blocks of cells keep the (n_boot, block, n_bins) resampled psths around 1e7 values
+    block    = max(1, int(1e7//max(1, n_boot*counts.shape[2])))
+    for start in xrange(0, len(counts), block):
+        boot = np.tensordot(weights, counts[start:start+block], axes=([1], [1]))
+        lower[start:start+block], upper[start:start+block] = np.percentile(boot, [q, 100 - q], axis=0)
+    mean     = counts.mean(axis=1)
+    return mean.reshape(shape), lower.reshape(shape), upper.reshape(shape)
+
+
 class TuningCurve(object):
     """Class to facilitate working with tuning curves."""
 
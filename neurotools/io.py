@@ -17,6 +17,10 @@ StandardPickleFile - object used to manipulate pickle representation of neurotoo
                      analog signals)
 NestFile           - object used to manipulate raw NEST file that would not have been saved by pyNN
                      (without headers)
+StandardBinaryFile - object used to manipulate binary representation of neurotools objects (spikes or
+                     analog signals), read with numpy.memmap to load only subsets of ids and times
+HDF5File           - object used to manipulate HDF5 representation of neurotools objects (spikes or
+                     analog signals), with chunked and compressed datasets. Needs PyTables
 DataHandler        - object to establish the interface between neurotools.signals and neurotools.io
 
 All those objects can be used with neurotools.signals
@@ -28,8 +32,131 @@ All those objects can be used with neurotools.signals
 
 from neurotools import check_dependency
 
-import os, logging, cPickle, numpy
+import os, logging, cPickle, numpy, itertools
 DEFAULT_BUFFER_SIZE = -1
+DEFAULT_CHUNK_SIZE  = 100000
+
+HAVE_TABLES = check_dependency('tables')
+if HAVE_TABLES:
+    import tables
+
+
+def _read_text_chunks(filename, chunksize=DEFAULT_CHUNK_SIZE, sepchar="\t", skipchar="#"):
+    """
+    Generator reading a text file of numbers by blocks of chunksize lines. Each block
+    is parsed at once by numpy and returned as a 2D array of floats, with one row per
+    line and the columns of the file. Lines starting with skipchar are ignored.
+    """
+    myfile = open(filename, "r", DEFAULT_BUFFER_SIZE)
+    ncols  = None
+    try:
+        while True:
+            lines = list(itertools.islice(myfile, chunksize))
+            if len(lines) == 0:
+                break
+            lines = [line for line in lines if line[0] != skipchar]
+            if ncols is None:
+                for line in lines:
+                    if line.strip():
+                        ncols = len(line.strip().split(sepchar))
+                        break
+                else:
+                    continue
+            text = "".join(lines)
+            if sepchar.strip():
+                text = text.replace(sepchar, " ")
+            yield numpy.fromstring(text, dtype=float, sep=" ").reshape(-1, ncols)
+    finally:
+        myfile.close()
+
+
+def _select_ids(ids, id_list):
+    """
+    Return the requested ids (sorted) and the positions, in the sorted array ids
+    of a file, of those which are present in the file.
+    """
+    if id_list is None:
+        id_list = numpy.array(ids)
+    elif isinstance(id_list, int):
+        id_list = numpy.arange(id_list)
+    id_list = numpy.unique(numpy.asarray(id_list, int))
+    pos     = numpy.searchsorted(ids, id_list)
+    present = pos < len(ids)
+    present[present] = ids[pos[present]] == id_list[present]
+    return id_list, pos[present]
+
+def _time_window(metadata, params):
+    """
+    Return the (t_start, t_stop) requested in params, defaulting to those of the file
+    """
+    t_start = params.get('t_start')
+    t_stop  = params.get('t_stop')
+    if t_start is None:
+        t_start = metadata['t_start']
+    if t_stop is None:
+        t_stop  = metadata['t_stop']
+    return t_start, t_stop
+
+def _sample_window(metadata, params):
+    """
+    Return the range of samples of an analog signal of the file covering the
+    requested time window
+    """
+    t_start, t_stop = _time_window(metadata, params)
+    dt      = metadata['dt']
+    i_start = max(0, int(round((t_start - metadata['t_start'])/dt)))
+    i_stop  = min(metadata['n_samples'], int(round((t_stop - metadata['t_start'])/dt)))
+    return i_start, i_stop
+
+def _dims(metadata, params):
+    if params.get('dims') is None:
+        return metadata['dimensions']
+    return params['dims']
+
+def _flat_arrays(object):
+    """
+    Return the metadata and the list of (name, array) describing a SpikeList or an
+    AnalogSignalList, as stored by StandardBinaryFile and HDF5File.
+    """
+    metadata = {'dimensions' : object.dimensions,
+                't_start'    : float(object.t_start),
+                't_stop'     : float(object.t_stop)}
+    if hasattr(object, 'analog_signals'):
+        # The ids of an AnalogSignalList are sorted, and the rows of its array follow them
+        ids  = numpy.asarray(object.id_list(), numpy.int64)
+        data = numpy.asarray(object._signals, numpy.float64)
+        metadata.update({'type' : 'analogs', 'dt' : float(object.dt), 'n_ids' : len(ids), 'n_samples' : object.signal_length})
+        return metadata, [('ids', ids), ('signals', data)]
+    else:
+        ids     = numpy.sort(object.id_list).astype(numpy.int64)
+        trains  = [object[id].spike_times for id in ids]
+        offsets = numpy.concatenate(([0], numpy.cumsum([len(st) for st in trains]))).astype(numpy.int64)
+        times   = numpy.concatenate([numpy.zeros(0, numpy.float32)] + trains).astype(numpy.float32)
+        metadata.update({'type' : 'spikes', 'n_ids' : len(ids), 'n_spikes' : len(times)})
+        return metadata, [('ids', ids), ('offsets', offsets), ('times', times)]
+
+def _runs(positions):
+    """
+    Return the (first, last) positions of each run of consecutive positions
+    """
+    if len(positions) == 0:
+        return []
+    breaks = numpy.where(numpy.diff(positions) != 1)[0]
+    firsts = numpy.concatenate(([0], breaks + 1))
+    lasts  = numpy.concatenate((breaks, [len(positions) - 1]))
+    return zip(positions[firsts], positions[lasts])
+
+def _analog_list(type, metadata, params, i_start, i_stop, ids, signals):
+    """
+    Return the AnalogSignalList of type `type` holding the (sorted) ids and their 
+    signals, read from the samples i_start:i_stop of a file
+    """
+    from neurotools.signals import analogs
+    dt      = metadata['dt']
+    t_start = metadata['t_start'] + i_start*dt
+    t_stop  = metadata['t_start'] + i_stop*dt
+    cls     = {"vm" : analogs.VmList, "current" : analogs.CurrentList, "conductance" : analogs.ConductanceList}[type]
+    return cls._from_array(signals, numpy.array(ids, int), dt, t_start, t_stop, _dims(metadata, params))
 
 
 class FileHandler(object):
@@ -173,25 +300,32 @@ class StandardTextFile(FileHandler):
         """
         Load data from a text file and returns an array of the data
         """
-        myfile   = open(self.filename, "r", DEFAULT_BUFFER_SIZE)
-        contents = myfile.readlines()
-        myfile.close()
-        data   = []
-        header = True
-        idx    = 0
-        while header and idx < len(contents):
-            if contents[idx][0] != skipchar:
-                header = False
-                break
-            idx += 1
-        for i in xrange(idx, len(contents)):
-            line = contents[i].strip().split(sepchar)
-            id   = [float(line[-1])]
-            id  += map(float, line[0:-1])
-            data.append(id)
+        chunks = [numpy.array(chunk, numpy.float32) for chunk in self.get_chunks(DEFAULT_CHUNK_SIZE, sepchar, skipchar)]
+        if len(chunks) == 0:
+            return numpy.zeros((0, 2), numpy.float32)
+        data = numpy.concatenate(chunks)
         logging.debug("Loaded %d lines of data from %s" % (len(data), self))
-        data = numpy.array(data, numpy.float32)
         return data
+
+    def get_chunks(self, chunksize=DEFAULT_CHUNK_SIZE, sepchar = "\t", skipchar = "#"):
+        """
+        Generator returning the data of the text file by blocks of chunksize lines,
+        with the same layout as get_data() (ids in the first column)
+        """
+        for chunk in _read_text_chunks(self.filename, chunksize, sepchar, skipchar):
+            yield numpy.concatenate((chunk[:, -1:], chunk[:, :-1]), axis=1)
+
+    def iter_spikes(self, chunksize=DEFAULT_CHUNK_SIZE):
+        """
+        Generator returning the spikes of the file as (ids, times) blocks of at most
+        chunksize spikes, without loading the whole file in memory.
+
+        Examples:
+            >> for ids, times in StandardTextFile("spikes.dat").iter_spikes(10**6):
+                   print len(ids)
+        """
+        for chunk in _read_text_chunks(self.filename, chunksize):
+            yield chunk[:, -1].astype(int), chunk[:, 0]
     
     def write(self, object):
         # can we write to the file more than once? In this case, should use seek, tell
@@ -208,6 +342,8 @@ class StandardTextFile(FileHandler):
         self.__read_metadata()
         p    = self.__check_params(params)
         from neurotools.signals import spikes
+        if p.get('chunksize'):
+            return spikes.CompactSpikeList.from_chunks(self.iter_spikes(p['chunksize']), p['id_list'], p['t_start'], p['t_stop'], p['dims'])
         data   = self.get_data()
         result = spikes.SpikeList(data, p['id_list'], p['t_start'], p['t_stop'], p['dims'])
         del data
@@ -328,28 +464,25 @@ class NestFile(FileHandler):
     
     def get_data(self, sepchar = "\t", skipchar = "#"):
         """
-        Load data from a text file and returns a list of data
+        Load data from a text file and returns an array of the data
         """
-        if HAVE_TABLEIO:
-            data = TableIO.readTableAsArray(self.filename, skipchar)
-        else:
-            myfile   = open(self.filename, "r", DEFAULT_BUFFER_SIZE)
-            contents = myfile.readlines()
-            myfile.close()
-            data = []
-            header = True
-            idx    = 0
-            while header:
-                if contents[idx][0] != skipchar:
-                    header = False
-                    break
-                idx += 1
-            for i in xrange(idx, len(contents)):
-                line = contents[i].strip().split(sepchar)
-                id   = [float(line[0])]
-                id  += map(float, line[1:])
-                data.append(id)
-        return numpy.array(data)
+        chunks = list(_read_text_chunks(self.filename, DEFAULT_CHUNK_SIZE, sepchar, skipchar))
+        if len(chunks) == 0:
+            return numpy.zeros((0, 2))
+        return numpy.concatenate(chunks)
+
+    def iter_spikes(self, chunksize=DEFAULT_CHUNK_SIZE):
+        """
+        Generator returning the spikes of the file as (ids, times) blocks of at most
+        chunksize spikes, without loading the whole file in memory. The ids are
+        shifted by the padding.
+
+        Examples:
+            >> for ids, times in NestFile("spikes.gdf", padding=1).iter_spikes(10**6):
+                   print len(ids)
+        """
+        for chunk in _read_text_chunks(self.filename, chunksize):
+            yield chunk[:, 0].astype(int) - self.padding, chunk[:, 1]
 
     def _fix_id_list(self, data, params):
         print "All gids are shifted by padding", self.padding
@@ -370,6 +503,12 @@ class NestFile(FileHandler):
         """
         p = self.__check_params(params)
         from neurotools import signals
+        if p.get('chunksize'):
+            if p['id_list'] is None:
+                # as in _fix_id_list, all the gids of the file are used, not only the ones 
+                # of the cells active between t_start and t_stop
+                p['id_list'] = reduce(numpy.union1d, (ids for ids, times in self.iter_spikes(p['chunksize'])), [])
+            return signals.CompactSpikeList.from_chunks(self.iter_spikes(p['chunksize']), p['id_list'], p['t_start'], p['t_stop'], p['dims'])
         data      = self.get_data()
         data, p   = self._fix_id_list(data, p)
         return signals.SpikeList(data, p['id_list'], p['t_start'], p['t_stop'], p['dims'])
@@ -418,6 +557,229 @@ class PyNNNumpyBinaryFile(FileHandler):
     
 
 
+class StandardBinaryFile(FileHandler):
+    """
+    StandardBinaryFile(filename)
+    
+    Object used to manipulate a binary representation of neurotools objects (spikes or
+    analog signals). The data are read through numpy.memmap, so that loading a subset 
+    of the ids or a time window only reads the corresponding bytes from the disk.
+    
+    The file starts with a text header of HEADER_SIZE bytes, made of "# key = value" lines
+    (as for StandardTextFile), followed by the raw arrays:
+        SpikeList        - the sorted ids (int64), the offsets (int64, one more than the ids)
+                           and the spike times (float32), sorted by id and then by time. The
+                           spikes of ids[i] are times[offsets[i]:offsets[i+1]]
+        AnalogSignalList - the sorted ids (int64) and a (len(ids), n_samples) float64 matrix
+                           with one signal per row
+    
+    Inputs:
+        filename - the file name for reading/writing data
+    
+    When analog signals are read with mmap=True, the returned AnalogSignalList keeps a
+    view on the file instead of a copy in memory, provided the requested ids are 
+    consecutive in the file.
+    
+    Examples:
+        >> spklist.save(StandardBinaryFile("spikes.bin"))
+        >> spklist = load_spikelist(StandardBinaryFile("spikes.bin"), id_list=range(100), t_start=0, t_stop=500)
+        >> vmlist  = load_vmlist(StandardBinaryFile("vm.bin"), mmap=True)
+    """
+    HEADER_SIZE = 1024
+    MAGIC       = "# neurotools binary file"
+    
+    def __init__(self, filename):
+        FileHandler.__init__(self, filename)
+        self.metadata = {}
+    
+    def __read_metadata(self):
+        """
+        Read the header of the file and fill self.metadata
+        """
+        fileobj = open(self.filename, 'rb')
+        header  = fileobj.read(self.HEADER_SIZE)
+        fileobj.close()
+        lines   = header.rstrip().split("\n")
+        if lines[0] != self.MAGIC:
+            raise Exception("%s is not a neurotools binary file" %self.filename)
+        self.metadata = {}
+        cmd = ";".join([line[1:].strip() for line in lines[1:]])
+        exec cmd in None, self.metadata
+    
+    def __map(self, dtype, shape, offset):
+        """
+        Return a read-only memmap of an array of the file, starting at offset bytes
+        """
+        if numpy.prod(shape) == 0:
+            return numpy.zeros(shape, dtype)
+        return numpy.memmap(self.filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+    
+    def write(self, object):
+        metadata, arrays = _flat_arrays(object)
+        header = "\n".join([self.MAGIC] + ["# %s = %r" % item for item in sorted(metadata.items())]) + "\n"
+        if len(header) > self.HEADER_SIZE:
+            raise Exception("The metadata of the object are too long to be saved in %s" %self.filename)
+        fileobj = open(self.filename, 'wb')
+        fileobj.write(header.ljust(self.HEADER_SIZE))
+        for name, array in arrays:
+            array.tofile(fileobj)
+        fileobj.close()
+    
+    def read_spikes(self, params):
+        self.__read_metadata()
+        m = self.metadata
+        if m['type'] != 'spikes':
+            raise Exception("%s does not contain spikes" %self.filename)
+        from neurotools.signals import spikes
+        n_ids, n_spikes = m['n_ids'], m['n_spikes']
+        ids     = self.__map(numpy.int64, (n_ids,), self.HEADER_SIZE)
+        offsets = self.__map(numpy.int64, (n_ids+1,), self.HEADER_SIZE + 8*n_ids)
+        times   = self.__map(numpy.float32, (n_spikes,), self.HEADER_SIZE + 8*(2*n_ids+1))
+        
+        id_list, pos    = _select_ids(numpy.array(ids), params.get('id_list'))
+        t_start, t_stop = _time_window(m, params)
+        starts, stops   = offsets[pos].astype(int), offsets[pos+1].astype(int)
+        if t_start > m['t_start'] or t_stop < m['t_stop']:
+            # The spikes of each id are sorted, so a binary search on each segment
+            # gives the time window without reading the whole segment
+            for idx in xrange(len(starts)):
+                segment     = times[starts[idx]:stops[idx]]
+                lo          = numpy.searchsorted(segment, t_start, 'left')
+                hi          = numpy.searchsorted(segment, t_stop, 'right')
+                stops[idx]  = starts[idx] + hi
+                starts[idx] = starts[idx] + lo
+        data    = numpy.array(times[spikes._segment_indices(starts, stops)], numpy.float32)
+        offsets = numpy.concatenate(([0], numpy.cumsum(stops - starts)))
+        result  = spikes.CompactSpikeList._from_arrays(data, numpy.array(ids[pos], int), offsets, t_start, t_stop, _dims(m, params))
+        result.complete(id_list)
+        del ids, times
+        return result
+    
+    def read_analogs(self, type, params):
+        if not type in ["vm", "current", "conductance"]:
+            raise Exception("The type %s is not available for the Analogs Signals" %type)
+        self.__read_metadata()
+        m = self.metadata
+        if m['type'] != 'analogs':
+            raise Exception("%s does not contain analog signals" %self.filename)
+        n_ids, n_samples = m['n_ids'], m['n_samples']
+        ids  = self.__map(numpy.int64, (n_ids,), self.HEADER_SIZE)
+        data = self.__map(numpy.float64, (n_ids, n_samples), self.HEADER_SIZE + 8*n_ids)
+        
+        id_list, pos     = _select_ids(numpy.array(ids), params.get('id_list'))
+        i_start, i_stop  = _sample_window(m, params)
+        runs             = _runs(pos)
+        if params.get('mmap') and isinstance(data, numpy.memmap) and len(runs) == 1:
+            # Consecutive ids are kept as a view on the file, read only when needed
+            signals = data[runs[0][0]:runs[0][1]+1, i_start:i_stop]
+        else:
+            signals = numpy.array(data[pos, i_start:i_stop])
+        result = _analog_list(type, m, params, i_start, i_stop, ids[pos], signals)
+        del ids, data
+        return result
+
+
+class HDF5File(FileHandler):
+    """
+    HDF5File(filename, complevel=5, complib='zlib')
+    
+    Object used to manipulate an HDF5 representation of neurotools objects (spikes or
+    analog signals), using PyTables. The arrays are stored as chunked and compressed
+    datasets, with the same layout as StandardBinaryFile:
+        SpikeList        - /ids, /offsets and /times, the spikes being sorted by id and
+                           then by time. The spikes of ids[i] are times[offsets[i]:offsets[i+1]]
+        AnalogSignalList - /ids and /signals, a (len(ids), n_samples) matrix
+    The metadata (t_start, t_stop, dt, dimensions, ...) are attributes of the root group.
+    
+    When reading, only the hyperslabs of the requested ids (and of the requested time
+    window, for analog signals) are read from the file.
+    
+    Inputs:
+        filename  - the file name for reading/writing data
+        complevel - the compression level, between 0 (no compression) and 9
+        complib   - the compression library ('zlib', 'lzo', 'bzip2' or 'blosc')
+    
+    Examples:
+        >> vmlist.save(HDF5File("vm.h5"))
+        >> vmlist = load_vmlist(HDF5File("vm.h5"), id_list=range(10), t_start=0, t_stop=100)
+    """
+    def __init__(self, filename, complevel=5, complib='zlib'):
+        if not HAVE_TABLES:
+            raise Exception("The PyTables package is needed to read/write HDF5 files")
+        FileHandler.__init__(self, filename)
+        self.filters  = tables.Filters(complevel=complevel, complib=complib)
+        self.metadata = {}
+    
+    def __read_metadata(self, h5file):
+        attrs = h5file.root._v_attrs
+        self.metadata = dict([(name, getattr(attrs, name)) for name in attrs._v_attrnamesuser])
+        return self.metadata
+    
+    def write(self, object):
+        metadata, arrays = _flat_arrays(object)
+        h5file = tables.open_file(self.filename, mode='w')
+        try:
+            for key, value in metadata.items():
+                setattr(h5file.root._v_attrs, key, value)
+            for name, array in arrays:
+                chunkshape = None
+                if array.ndim == 2:
+                    # one chunk holds a piece of the signal of a single id, so that
+                    # reading a few ids or a time window only decompresses what is needed
+                    chunkshape = (1, max(1, min(array.shape[1], 8192)))
+                node = h5file.create_earray(h5file.root, name, tables.Atom.from_dtype(array.dtype),
+                                            (0,) + array.shape[1:], filters=self.filters,
+                                            expectedrows=max(1, len(array)), chunkshape=chunkshape)
+                if len(array) > 0:
+                    node.append(array)
+        finally:
+            h5file.close()
+    
+    def read_spikes(self, params):
+        from neurotools.signals import spikes
+        h5file = tables.open_file(self.filename, mode='r')
+        try:
+            m = self.__read_metadata(h5file)
+            if m['type'] != 'spikes':
+                raise Exception("%s does not contain spikes" %self.filename)
+            ids             = h5file.root.ids[:]
+            offsets         = h5file.root.offsets[:]
+            id_list, pos    = _select_ids(ids, params.get('id_list'))
+            t_start, t_stop = _time_window(m, params)
+            chunks = [numpy.zeros(0, numpy.float32)]
+            for first, last in _runs(pos):
+                chunks.append(h5file.root.times[offsets[first]:offsets[last+1]])
+        finally:
+            h5file.close()
+        times   = numpy.concatenate(chunks)
+        counts  = offsets[pos+1] - offsets[pos]
+        mask    = (times >= t_start) & (times <= t_stop)
+        kept    = numpy.concatenate(([0], numpy.cumsum(mask)))
+        offsets = kept[numpy.concatenate(([0], numpy.cumsum(counts)))]
+        result  = spikes.CompactSpikeList._from_arrays(times[mask], numpy.array(ids[pos], int), offsets, t_start, t_stop, _dims(m, params))
+        result.complete(id_list)
+        return result
+    
+    def read_analogs(self, type, params):
+        if not type in ["vm", "current", "conductance"]:
+            raise Exception("The type %s is not available for the Analogs Signals" %type)
+        h5file = tables.open_file(self.filename, mode='r')
+        try:
+            m = self.__read_metadata(h5file)
+            if m['type'] != 'analogs':
+                raise Exception("%s does not contain analog signals" %self.filename)
+            ids              = h5file.root.ids[:]
+            id_list, pos     = _select_ids(ids, params.get('id_list'))
+            i_start, i_stop  = _sample_window(m, params)
+            blocks = [numpy.zeros((0, i_stop - i_start))]
+            for first, last in _runs(pos):
+                blocks.append(h5file.root.signals[first:last+1, i_start:i_stop])
+            result = _analog_list(type, m, params, i_start, i_stop, ids[pos], numpy.concatenate(blocks))
+        finally:
+            h5file.close()
+        return result
+
+
 class DataHandler(object):
     """
     Class to establish the interface for loading/saving objects in neurotools
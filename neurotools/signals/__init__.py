@@ -14,6 +14,7 @@ AnalogSignalList - list of AnalogSignal objects, again with methods such as mean
 VmList           - AnalogSignalList object used for Vm traces
 ConductanceList  - AnalogSignalList object used for conductance traces
 CurrentList      - AnalogSignalList object used for current traces
+SignalStatistics - streaming accumulator of the mean, variance, min and max of signals
 
 Functions
 ---------
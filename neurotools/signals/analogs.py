@@ -14,6 +14,7 @@ AnalogSignalList - list of AnalogSignal objects, again with methods such as mean
 VmList           - AnalogSignalList object used for Vm traces
 ConductanceList  - AnalogSignalList object used for conductance traces
 CurrentList      - AnalogSignalList object used for current traces
+SignalStatistics - streaming accumulator of the mean, variance, min and max of signals
 
 Functions
 ---------
@@ -31,6 +32,7 @@ See also neurotools.signals.spikes
 """
 
 import os, re, numpy
+from numpy.lib.stride_tricks import as_strided
 from neurotools import check_dependency, check_numpy_version
 from neurotools.io import *
 from neurotools.plotting import get_display, set_axis_limits, set_labels, SimpleMultiplot
@@ -52,7 +54,7 @@ if not HAVE_MATPLOTLIB:
 
 
 newnum = check_numpy_version()
-from spikes import SpikeList, SpikeTrain
+from spikes import SpikeList, SpikeTrain, CompactSpikeList
 from pairs import *
 from intervals import *
 
@@ -207,7 +209,6 @@ class AnalogSignal(object):
         assert t_stop <= self.t_stop
         assert t_stop > t_start
         
-        t = self.time_axis()
         i_start = int(round((t_start-self.t_start)/self.dt))
         i_stop = int(round((t_stop-self.t_start)/self.dt))
         signal = self.signal[i_start:i_stop]
@@ -233,43 +234,41 @@ class AnalogSignal(object):
             result.append(self.signal[intv[0]/self.dt:intv[1]/self.dt])
 
 
-    def threshold_detection(self, threshold=None, format=None,sign='above'):
+    def threshold_detection(self, threshold=None, format=None,sign='above', refractory=0, interpolate=False):
         """
         Returns the times when the analog signal crosses a threshold.
         The times can be returned as a numpy.array or a SpikeTrain object
         (default)
 
         Inputs:
-             threshold - Threshold
-             format    - when 'raw' the raw events array is returned, 
-                         otherwise this is a SpikeTrain object by default
-             sign      - 'above' detects when the signal gets above the threshodl, 'below when it gets below the threshold'
+             threshold   - Threshold
+             format      - when 'raw' the raw events array is returned, 
+                           otherwise this is a SpikeTrain object by default
+             sign        - 'above' detects when the signal gets above the threshodl, 'below when it gets below the threshold'
+             refractory  - dead time after an event, in ms, during which no other event is detected
+             interpolate - if True, the crossing times are linearly interpolated between the
+                           two samples around the threshold
                 
         Examples:
             >> aslist.threshold_detection(-55, 'raw')
                 [54.3, 197.4, 206]
+        
+        See also
+            AnalogSignalList.threshold_detection
         """
         
         assert threshold is not None, "threshold must be provided"
 
-        if sign is 'above':
-            cutout = numpy.where(self.signal > threshold)[0]
-        elif sign in 'below':
-            cutout = numpy.where(self.signal < threshold)[0]
-            
-        if len(cutout) <= 0:
-            events = numpy.zeros(0)
-        else:
-            take = numpy.where(numpy.diff(cutout)>1)[0]+1
-            take = numpy.append(0,take)
-            
-            time = self.time_axis()
-            events = time[cutout][take]
+        signals       = self.signal[None,:]
+        rows, indices = _threshold_crossings(signals, threshold, sign)
+        events        = _crossing_times(signals, rows, indices, threshold, self.dt, self.t_start, interpolate)
+        if refractory > 0:
+            events    = events[_dead_time(rows, events, refractory)]
 
         if format is 'raw':
             return events
         else:
-            return SpikeTrain(events,t_start=self.t_start,t_stop=self.t_stop)
+            return SpikeTrain.from_sorted(events,t_start=self.t_start,t_stop=self.t_stop)
             
                     
     def event_triggered_average(self, events, average = True, t_min = 0, t_max = 100, display = False, with_time = False, kwargs={}):
@@ -302,37 +301,16 @@ class AnalogSignal(object):
         else:
             assert numpy.iterable(events), "events should be a SpikeTrain object or an iterable object"
             ylabel = "Event Triggered Average"
-        assert (t_min >= 0) and (t_max >= 0), "t_min and t_max should be greater than 0"
         assert len(events) > 0, "events should not be empty and should contained at least one element"
-        time_axis = numpy.linspace(-t_min, t_max, (t_min+t_max)/self.dt)
-        N         = len(time_axis)
-        Nspikes   = 0.
-        subplot   = get_display(display)
-        if average:
-            result = numpy.zeros(N, float)
-        else:
-            result = []
+        starts, length = _event_starts(events, self.dt, self.t_start, len(self.signal), t_min, t_max)
+        time_axis      = self.dt*(numpy.arange(length) - numpy.floor(t_min/self.dt))
+        windows        = _signal_windows(self.signal, length)
+        subplot        = get_display(display)
         
-        # recalculate everything into timesteps, is more stable against rounding errors
-        # and subsequent cutouts with different sizes
-        events = numpy.floor(numpy.array(events)/self.dt)
-        t_min_l = numpy.floor(t_min/self.dt)
-        t_max_l = numpy.floor(t_max/self.dt)
-        t_start = numpy.floor(self.t_start/self.dt)
-        t_stop = numpy.floor(self.t_stop/self.dt)
-        
-        for spike in events:
-            if ((spike-t_min_l) >= t_start) and ((spike+t_max_l) < t_stop):
-                spike = spike - t_start
-                if average:
-                    result += self.signal[(spike-t_min_l):(spike+t_max_l)]
-                else:
-                    result.append(self.signal[(spike-t_min_l):(spike+t_max_l)])
-                Nspikes += 1
         if average:
-            result = result/Nspikes
+            result = _windows_moments(windows, starts)[0]
         else:
-            result = numpy.array(result)
+            result = windows[starts]
             
         if not subplot or not HAVE_PYLAB:
             if with_time:
@@ -348,13 +326,42 @@ class AnalogSignal(object):
                 for idx in xrange(len(result)):
                     subplot.plot(time_axis, result[idx,:], c='0.5', **kwargs)
                     subplot.hold(1)
-                result = numpy.sum(result, axis=0)/Nspikes
+                result = numpy.mean(result, axis=0)
                 subplot.plot(time_axis, result, c='k', **kwargs)
             xmin, xmax, ymin, ymax = subplot.axis()
                         
             subplot.plot([0,0],[ymin, ymax], c='r')
             set_axis_limits(subplot, -t_min, t_max, ymin, ymax)
             pylab.draw()
+            return result
+
+    def event_triggered_moments(self, events, t_min=0, t_max=100, block_size=1000):
+        """
+        Return the mean and the variance of the waveforms of the analog signal around 
+        the selected events, on a time window t_spikes - tmin, t_spikes + tmax, together 
+        with the number of events that were used. The waveforms are accumulated over
+        blocks of block_size events, so that they are never all stored at once.
+        
+        Inputs:
+            events     - Can be a SpikeTrain object (and events will be the spikes) or just a list 
+                         of times
+            t_min      - Time (>0) to average the signal before an event, in ms (default 0)
+            t_max      - Time (>0) to average the signal after an event, in ms  (default 100)
+            block_size - Number of waveforms gathered at once
+        
+        Examples:
+            >> mean, var, count = vm.event_triggered_moments(spktrain, t_min=50, t_max=150)
+        
+        See also
+            event_triggered_average
+        """
+        if isinstance(events, SpikeTrain):
+            events = events.spike_times
+        else:
+            assert numpy.iterable(events), "events should be a SpikeTrain object or an iterable object"
+        starts, length = _event_starts(events, self.dt, self.t_start, len(self.signal), t_min, t_max)
+        mean, var, count = _windows_moments(_signal_windows(self.signal, length), starts, block_size)
+        return mean, var, count
 
     def slice_by_events(self,events,t_min=100,t_max=100):
         """
@@ -370,6 +377,9 @@ class AnalogSignal(object):
             >> res = aslist.slice_by_events([100,200,300], t_min=0, t_max =100)
             >> print len(res)
                 3
+
+        See also
+            event_windows
         """
         if isinstance(events, SpikeTrain):
             events = events.spike_times
@@ -404,6 +414,9 @@ class AnalogSignal(object):
             >> print len(res)
                 4
 
+        See also
+            event_mask
+
         Author: Eilif Muller
         """
         if isinstance(events, SpikeTrain):
@@ -434,6 +447,70 @@ class AnalogSignal(object):
         if t_last<self.t_stop:
             yield self.time_slice(t_last, self.t_stop)
 
+    def event_windows(self, events, t_min=100, t_max=100):
+        """
+        Returns a 2D array whose rows are the windows of the signal [t_event - t_min, 
+        t_event + t_max[ around every event fitting in the signal. The rows are gathered 
+        from a strided view on the signal, without creating one AnalogSignal per event.
+        As in time_slice, a window starts at the sample nearest to t_event - t_min, and
+        all the windows have round((t_min + t_max)/dt) samples.
+        
+        Inputs:
+            events  - Can be a SpikeTrain object (and events will be the spikes) or just a list 
+                      of times
+            t_min   - Time (>0) to cut the signal before an event, in ms (default 100)
+            t_max   - Time (>0) to cut the signal after an event, in ms  (default 100)
+        
+        Examples:
+            >> windows = signal.event_windows([100,200,300], t_min=0, t_max=10)
+            >> windows.shape
+                (3, 100)
+            >> windows.max(axis=1)
+        
+        See also
+            slice_by_events, event_triggered_average, event_mask
+        """
+        if isinstance(events, SpikeTrain):
+            events = events.spike_times
+        else:
+            assert numpy.iterable(events), "events should be a SpikeTrain object or an iterable object"
+        assert (t_min >= 0) and (t_max >= 0), "t_min and t_max should be greater than 0"
+        length = int(round((t_min + t_max)/self.dt))
+        starts = _time_index(numpy.asarray(events, float) - t_min, self.dt, self.t_start)
+        starts = starts[(starts >= 0) & (starts + length <= len(self.signal))]
+        return _signal_windows(self.signal, length)[starts]
+
+    def event_mask(self, events, t_min=100, t_max=100):
+        """
+        Returns a boolean array, of the length of the signal, which is True for the 
+        samples within [t_event - t_min, t_event + t_max[ of any event. signal[~mask] 
+        is then the signal with all the events cut out (useful for removing spikes).
+        
+        Inputs:
+            events  - Can be a SpikeTrain object (and events will be the spikes) or just a list 
+                      of times
+            t_min   - Time (>0) to cut the signal before an event, in ms (default 100)
+            t_max   - Time (>0) to cut the signal after an event, in ms  (default 100)
+        
+        Examples:
+            >> mask = signal.event_mask(spikes, t_min=1, t_max=5)
+            >> signal.signal[~mask].mean()
+        
+        See also
+            slice_exclude_events, event_windows
+        """
+        if isinstance(events, SpikeTrain):
+            events = events.spike_times
+        else:
+            assert numpy.iterable(events), "events should be a SpikeTrain object or an iterable object"
+        assert (t_min >= 0) and (t_max >= 0), "t_min and t_max should be greater than 0"
+        nb_samples = len(self.signal)
+        events     = numpy.asarray(events, float)
+        i_start    = numpy.clip(_time_index(events - t_min, self.dt, self.t_start), 0, nb_samples)
+        i_stop     = numpy.clip(_time_index(events + t_max, self.dt, self.t_start), 0, nb_samples)
+        depth      = numpy.bincount(i_start, minlength=nb_samples+1) - numpy.bincount(i_stop, minlength=nb_samples+1)
+        return numpy.cumsum(depth[:-1]) > 0
+
     def cov(self,signal):
         """
 
@@ -487,9 +564,18 @@ class AnalogSignalList(object):
     
     dt, t_start and t_stop are shared for all SpikeTrains object within the SpikeList
     
+    All the signals are stored in a single (n_ids, n_samples) array, and the AnalogSignal
+    objects returned by aslist[id] or aslist.analog_signals are views on its rows. This
+    array can be a numpy.memmap (see load_vmlist), in which case time_slice and id_slice 
+    return views on the file whenever possible, and mean and std read it by blocks of 
+    at most block_size values.
+    
     See also
         load_currentlist load_vmlist, load_conductancelist
     """
+    # Number of values read at once by the reductions over the ids (mean, std)
+    block_size = 1048576
+    
     def __init__(self, signals, id_list, dt, t_start=0, t_stop=None, dims=None):
         #logging.debug("Creating an AnalogSignalList. len(signals)=%d, min(id_list)=%d, max(id_list)=%d, dt=%g, t_start=%g, t_stop=%s, dims=%s" % \
         #                 (len(signals), min(id_list), max(id_list), dt, t_start, t_stop, dims))
@@ -500,49 +586,108 @@ class AnalogSignalList(object):
         self.t_stop         = t_stop
         self.dt             = float(dt)
         self.dimensions     = dims
-        self.analog_signals = {}
-        
-        signals = numpy.array(signals)
-        for id in id_list:
-            signal = numpy.transpose(signals[signals[:,0] == id, 1:])[0]
-            if len(signal) > 0:
-                self.analog_signals[id] = AnalogSignal(signal, self.dt, self.t_start, self.t_stop)
-        
-        if id_list:
-            signals = self.analog_signals.values()
-            self.signal_length = len(signals[0])
-            for signal in signals[1:]:
-                if len(signal) != self.signal_length:
-                    raise Exception("Signals must all be the same length %d != %d" % (self.signal_length, len(signal)))
+        
+        # All the signals are stored in a single (len(ids), signal_length) array, whose rows 
+        # follow the sorted ids. The values of each id are gathered with one stable sort.
+        id_list = numpy.unique(numpy.asarray(id_list))
+        signals = numpy.array(signals, float)
+        if len(signals) > 0 and len(id_list) > 0:
+            signals = signals[numpy.in1d(signals[:,0], id_list)]
+            order   = numpy.argsort(signals[:,0], kind="mergesort")
+            values  = signals[order,1]
+            ids, counts = numpy.unique(signals[order,0], return_counts=True)
         else:
+            values, ids, counts = numpy.zeros(0), numpy.zeros(0), numpy.zeros(0, int)
+        if len(counts) > 0 and numpy.any(counts != counts[0]):
+            length = counts[numpy.argmax(counts != counts[0])]
+            raise Exception("Signals must all be the same length %d != %d" % (counts[0], length))
+        self._ids     = id_list[numpy.searchsorted(id_list, ids)]
+        self._signals = values.reshape(len(ids), len(counts) and counts[0])
+        
+        if len(id_list) == 0:
             logging.warning("id_list is empty")
-            self.signal_length = 0
         
         if t_stop is None:
             self.t_stop = self.t_start + self.signal_length*self.dt
+        elif len(self) > 0 and abs(self.t_stop-self.t_start - self.dt*self.signal_length) > 0.1*self.dt:
+            raise Exception("Inconsistent arguments: t_start=%g, t_stop=%g, dt=%g implies %d elements, actually %d" % (
+                                self.t_start, self.t_stop, self.dt, int(round((self.t_stop-self.t_start)/self.dt)), self.signal_length))
+        if len(self) > 0 and self.t_start >= self.t_stop:
+            raise Exception("Incompatible time interval for the creation of the AnalogSignal. t_start=%s, t_stop=%s" % (self.t_start, self.t_stop))
+
+    @classmethod
+    def _from_array(cls, signals, ids, dt, t_start, t_stop, dims=None):
+        """
+        Build an AnalogSignalList directly from a (len(ids), n_samples) array of signals,
+        ids being sorted. Nothing is copied nor checked.
+        """
+        aslist            = cls.__new__(cls)
+        aslist.t_start    = float(t_start)
+        aslist.t_stop     = float(t_stop)
+        aslist.dt         = float(dt)
+        aslist.dimensions = dims
+        aslist._ids       = numpy.asarray(ids)
+        aslist._signals   = signals
+        return aslist
+
+    def __setstate__(self, state):
+        # AnalogSignalLists pickled before the signals were stored as a single array
+        if 'analog_signals' in state:
+            signals = state.pop('analog_signals')
+            state.pop('signal_length', None)
+            ids     = numpy.sort(signals.keys())
+            state['_ids']     = ids
+            state['_signals'] = numpy.array([signals[id].signal for id in ids], float).reshape(len(ids), -1)
+        self.__dict__.update(state)
+
+    @property
+    def analog_signals(self):
+        """
+        Dictionary-like access to the AnalogSignals of the AnalogSignalList, created
+        on request as views on the rows of the signals array.
+        """
+        return _AnalogSignalViews(self)
+
+    @property
+    def signal_length(self):
+        return self._signals.shape[1]
+
+    def _index(self, id):
+        """
+        Return the row of id in the signals array, or None if id is not present
+        """
+        idx = numpy.searchsorted(self._ids, id)
+        if idx < len(self._ids) and self._ids[idx] == id:
+            return idx
+        return None
+
+    def _signal(self, idx):
+        signal         = AnalogSignal.__new__(AnalogSignal)
+        signal.signal  = self._signals[idx]
+        signal.dt      = self.dt
+        signal.t_start = self.t_start
+        signal.t_stop  = self.t_stop
+        return signal
 
     def id_list(self):
         """ 
         Return the list of all the cells ids contained in the
         SpikeList object
         """
-        return numpy.array(self.analog_signals.keys())
+        return self._ids.copy()
 
     def copy(self):
         """
         Return a copy of the AnalogSignalList object
         """
-        # Maybe not optimal, should be optimized
-        aslist = AnalogSignalList([], [], self.dt, self.t_start, self.t_stop, self.dimensions)
-        for id in self.id_list():
-            aslist.append(id, self.analog_signals[id])
-        return aslist
+        return AnalogSignalList._from_array(self._signals.copy(), self._ids.copy(), self.dt, 
+                                            self.t_start, self.t_stop, self.dimensions)
     
     def __getitem__(self, id):
-        if id in self.id_list():
-            return self.analog_signals[id]
-        else:
+        idx = self._index(id)
+        if idx is None:
             raise Exception("id %d is not present in the AnalogSignal. See id_list()" %id)
+        return self._signal(idx)
 
     def __setitem__(self, i, val):
         assert isinstance(val, AnalogSignal), "An AnalogSignalList object can only contain AnalogSignal objects"
@@ -559,13 +704,26 @@ class AnalogSignalList(object):
             if errmsgs:
                 raise Exception("AnalogSignal being added does not match the existing signals: "+", ".join(errmsgs))
         else:
-            self.signal_length = len(val)
+            self._signals = numpy.zeros((0, len(val)))
             self.t_start = val.t_start
             self.t_stop = val.t_stop
-        self.analog_signals[i] = val
+        idx = self._index(i)
+        if idx is None:
+            idx           = numpy.searchsorted(self._ids, i)
+            self._ids     = numpy.insert(self._ids, idx, i)
+            self._signals = numpy.insert(self._signals, idx, val.signal, axis=0)
+        else:
+            self._signals[idx] = val.signal
+
+    def __delitem__(self, id):
+        idx = self._index(id)
+        if idx is None:
+            raise KeyError(id)
+        self._ids     = numpy.delete(self._ids, idx)
+        self._signals = numpy.delete(self._signals, idx, axis=0)
 
     def __len__(self):
-        return len(self.analog_signals)
+        return len(self._ids)
     
     def __iter__(self):
         return self.analog_signals.itervalues()
@@ -593,7 +751,7 @@ class AnalogSignalList(object):
             __setitem__
         """
         assert isinstance(signal, AnalogSignal), "An AnalogSignalList object can only contain AnalogSignal objects"
-        if id in self.id_list():
+        if self._index(id) is not None:
             raise Exception("Id already present in AnalogSignalList. Use setitem instead()")
         else:
             self[id] = signal
@@ -619,12 +777,7 @@ class AnalogSignalList(object):
             >> as.id_list()
                 [10,11,12,13,14]
         """
-        id_list = numpy.sort(self.id_list())
-        N       = len(id_list)
-        for idx in xrange(1,len(id_list)+1):
-            id  = id_list[N-idx]
-            spk = self.analog_signals.pop(id)
-            self.analog_signals[id + offset] = spk
+        self._ids = self._ids + offset
 
     def id_slice(self, id_list):
         """
@@ -639,14 +792,19 @@ class AnalogSignalList(object):
         See also
             time_slice
         """
-        new_AnalogSignalList = AnalogSignalList([], [], self.dt, self.t_start, self.t_stop, self.dimensions)
-        id_list = self.__sub_id_list(id_list)
-        for id in id_list:
-            try:
-                new_AnalogSignalList.append(id, self.analog_signals[id])
-            except Exception:
+        id_list = numpy.unique(numpy.asarray(self.__sub_id_list(id_list)))
+        rows    = [self._index(id) for id in id_list]
+        for id, idx in zip(id_list, rows):
+            if idx is None:
                 print "id %d is not in the source AnalogSignalList" %id
-        return new_AnalogSignalList
+        rows    = numpy.array([idx for idx in rows if idx is not None], int)
+        if isinstance(self._signals, numpy.memmap) and len(rows) > 0 and numpy.all(numpy.diff(rows) == 1):
+            # Consecutive rows of a file can be kept as a view on the file
+            signals = self._signals[rows[0]:rows[-1]+1]
+        else:
+            signals = self._signals[rows]
+        return AnalogSignalList._from_array(signals, self._ids[rows], self.dt, 
+                                            self.t_start, self.t_stop, self.dimensions)
 
     def time_slice(self, t_start, t_stop):
         """
@@ -659,10 +817,14 @@ class AnalogSignalList(object):
         See also
             id_slice
         """
-        new_AnalogSignalList = AnalogSignalList([], [], self.dt, t_start, t_stop, self.dimensions)
-        for id in self.id_list():
-            new_AnalogSignalList.append(id, self.analog_signals[id].time_slice(t_start, t_stop))
-        return new_AnalogSignalList
+        assert t_start >= self.t_start
+        assert t_stop <= self.t_stop
+        assert t_stop > t_start
+        
+        i_start = int(round((t_start-self.t_start)/self.dt))
+        i_stop  = int(round((t_stop-self.t_start)/self.dt))
+        return AnalogSignalList._from_array(self._signals[:, i_start:i_stop], self._ids.copy(), self.dt, 
+                                            t_start, t_stop, self.dimensions)
 
     def select_ids(self, criteria=None):
         """
@@ -702,8 +864,8 @@ class AnalogSignalList(object):
         """
         is_values = re.compile("values")
         is_ids   = re.compile("ids")
-        values = numpy.concatenate([st.signal for st in self.analog_signals.itervalues()])
-        ids    = numpy.concatenate([id*numpy.ones(len(st.signal), int) for id,st in self.analog_signals.iteritems()])
+        values = self._signals.ravel()
+        ids    = numpy.repeat(self._ids, self.signal_length)
         if is_values.search(format):
             if is_ids.search(format):
                 return eval(format)
@@ -756,10 +918,21 @@ class AnalogSignalList(object):
         as_loader = DataHandler(user_file, self)
         as_loader.save()
 
+    def _row_blocks(self):
+        """
+        Iterate over the signals array by blocks of rows holding at most block_size 
+        values (but at least one row)
+        """
+        nb_rows = max(1, self.block_size // max(1, self.signal_length))
+        for start in xrange(0, len(self), nb_rows):
+            yield numpy.asarray(self._signals[start:start+nb_rows], float)
+
     def mean(self):
         """
         Return the mean AnalogSignal after having performed the average of all the signals
-        present in the AnalogSignalList
+        present in the AnalogSignalList. The signals are summed block by block, so only
+        block_size values are read at once when the AnalogSignalList is backed by a file.
+        The result may differ from numpy.mean by rounding errors.
         
         Examples:
             >> a.mean()
@@ -767,9 +940,9 @@ class AnalogSignalList(object):
         See also:
             std
         """
-        result = numpy.zeros(int((self.t_stop - self.t_start)/self.dt),float)
-        for id in self.id_list():
-             result += self.analog_signals[id].signal
+        result = numpy.zeros(self.signal_length, float)
+        for block in self._row_blocks():
+            result += block.sum(axis=0)
         return result/len(self)
     
     def std(self):
@@ -780,18 +953,81 @@ class AnalogSignalList(object):
         Examples:
             >> a.std()
                numpy.array([0.01, 0.2404, ...., 0.234, 0.234]
+        
+        The signals are read twice, block by block: once for the mean and once for
+        the squared deviations.
                
         See also:
             mean
         """
-        result = numpy.zeros((len(self), int(round((self.t_stop - self.t_start)/self.dt))), float)
-        for count, id in enumerate(self.id_list()):
-            try:
-                result[count,:] = self.analog_signals[id].signal
-            except ValueError:
-                print result[count,:].shape, self.analog_signals[id].signal.shape
-                raise
-        return numpy.std(result, axis=0)
+        mean   = self.mean()
+        result = numpy.zeros(self.signal_length, float)
+        for block in self._row_blocks():
+            deviation = block - mean
+            result   += (deviation*deviation).sum(axis=0)
+        return numpy.sqrt(result/len(self))
+
+    def threshold_detection(self, threshold=None, sign='above', refractory=0, interpolate=False):
+        """
+        Return a CompactSpikeList with, for every id, the times when its signal crosses
+        a threshold. All the signals are processed at once, by blocks of at most 
+        block_size values when the AnalogSignalList is backed by a file.
+        
+        Inputs:
+            threshold   - Threshold, either a single value or one value per id (in the 
+                          order of id_list())
+            sign        - 'above' detects when the signal gets above the threshold, 'below' 
+                          when it gets below the threshold
+            refractory  - dead time after a spike, in ms, during which no other spike is
+                          detected
+            interpolate - if True, the crossing times are linearly interpolated between the
+                          two samples around the threshold
+        
+        Examples:
+            >> spikes = vmlist.threshold_detection(-55, refractory=2, interpolate=True)
+            >> spikes.mean_rate()
+        
+        See also
+            AnalogSignal.threshold_detection
+        """
+        assert threshold is not None, "threshold must be provided"
+        threshold   = numpy.asarray(threshold, float)
+        times, rows = [numpy.zeros(0)], [numpy.zeros(0, int)]
+        start       = 0
+        for block in self._row_blocks():
+            level = threshold
+            if threshold.ndim > 0:
+                level = threshold[start:start+len(block)]
+            r, indices = _threshold_crossings(block, level, sign)
+            times.append(_crossing_times(block, r, indices, level, self.dt, self.t_start, interpolate))
+            rows.append(r + start)
+            start += len(block)
+        times, rows = numpy.concatenate(times), numpy.concatenate(rows)
+        if refractory > 0:
+            keep        = _dead_time(rows, times, refractory)
+            times, rows = times[keep], rows[keep]
+        offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(rows, minlength=len(self)))))
+        return CompactSpikeList._from_arrays(numpy.asarray(times, numpy.float32), numpy.array(self._ids, int), 
+                                             offsets, self.t_start, self.t_stop, self.dimensions)
+
+    def statistics(self):
+        """
+        Return a SignalStatistics object accumulated over all the signals of the 
+        AnalogSignalList, in a single pass over blocks of at most block_size values.
+        Contrary to mean and std, which read the signals twice, the variance is 
+        obtained with the streaming update of SignalStatistics.
+        
+        Examples:
+            >> stats = a.statistics()
+            >> stats.std(), stats.min(), stats.max()
+        
+        See also:
+            mean, std, SignalStatistics
+        """
+        stats = SignalStatistics(self.signal_length)
+        for block in self._row_blocks():
+            stats.update(block)
+        return stats
 
     def event_triggered_average(self, eventdict, events_ids = None, analogsignal_ids = None, average = True, t_min = 0, t_max = 100, ylim = None, display = False, mode = 'same', kwargs={}):
         """
@@ -845,11 +1081,15 @@ class AnalogSignalList(object):
             if mode is 'same':
                 
                 if self.analog_signals.has_key(id) and id in analogsignal_ids:
-                    sp = pylab.subplot(x,y,subplotcount)
+                    sp = figure and pylab.subplot(x,y,subplotcount)
                     results[id] = self.analog_signals[id].event_triggered_average(events,average=average,t_min=t_min,t_max=t_max,display=sp,kwargs=kwargs)
-                    pylab.ylim(ylim)
-                    pylab.title('Event: %g; Signal: %g'%(id,id))
+                    if figure:
+                        pylab.ylim(ylim)
+                        pylab.title('Event: %g; Signal: %g'%(id,id))
                     subplotcount += 1
+            elif mode is 'all' and not figure:
+                rows, waveforms = self._event_waveforms(analogsignal_ids, events, t_min, t_max, average)
+                results[id]     = dict(zip(self._ids[rows], waveforms))
             elif mode is 'all':
                 if first_done:
                     figure   = get_display(display)
@@ -858,15 +1098,37 @@ class AnalogSignalList(object):
                 results[id] = {}
                 for id_analog in analogsignal_ids:
                     analog_signal = self.analog_signals[id_analog]
-                    sp = pylab.subplot(x,y,subplotcount_all)
+                    sp = figure and pylab.subplot(x,y,subplotcount_all)
                     results[id][id_analog] = analog_signal.event_triggered_average(events,average=average,t_min=t_min,t_max=t_max,display=sp,kwargs=kwargs)
-                    pylab.ylim(ylim)
-                    pylab.title('Event: %g; Signal: %g'%(id,id_analog))
+                    if figure:
+                        pylab.ylim(ylim)
+                        pylab.title('Event: %g; Signal: %g'%(id,id_analog))
                     subplotcount_all += 1
 
         if not figure or not HAVE_PYLAB:
             return results
 
+    def _event_waveforms(self, id_list, events, t_min, t_max, average=True, block_size=1000):
+        """
+        Return the rows of the signals of id_list, and their waveforms around all the 
+        events, as an array of shape (len(rows), nb_events, window) or, if average is 
+        True, (len(rows), window). The average is accumulated over blocks of block_size
+        events. Only the samples of the windows are read, so memmap-backed signals are
+        not loaded in memory.
+        """
+        if isinstance(events, SpikeTrain):
+            events = events.spike_times
+        rows           = numpy.array([idx for idx in map(self._index, id_list) if idx is not None], int)
+        starts, length = _event_starts(events, self.dt, self.t_start, self.signal_length, t_min, t_max)
+        offsets        = numpy.arange(length)
+        # the windows are indexed directly, so only their samples are read from the signals
+        if not average:
+            return rows, self._signals[rows[:,None,None], starts[None,:,None] + offsets]
+        result = numpy.zeros((len(rows), length))
+        for idx in xrange(0, len(starts), block_size):
+            result += self._signals[rows[:,None,None], starts[None,idx:idx+block_size,None] + offsets].sum(axis=1)
+        return rows, result/len(starts)
+
 
 class VmList(AnalogSignalList):
 
@@ -974,7 +1236,267 @@ class ConductanceList(AnalogSignalList):
 
 
 
-def load_conductancelist(user_file, id_list=None, dt=None, t_start=None, t_stop=None, dims=None):
+class SignalStatistics(object):
+    """
+    SignalStatistics(n_samples)
+    
+    Streaming accumulator of the mean, variance, minimum and maximum, point by point, 
+    of a population of signals of n_samples points. Signals can be added one by one or 
+    by chunks, as they come from a file reader or a running simulation, and a chunk can
+    cover only some of the points. The memory used is O(n_samples), whatever the number
+    of signals. The chunks are merged with the pairwise update of Chan et al., which 
+    generalizes Welford's algorithm.
+    
+    Inputs:
+        n_samples - the number of points of the signals
+    
+    Examples:
+        >> stats = SignalStatistics(vmlist.signal_length)
+        >> for chunk in chunks:
+        >>     stats.update(chunk)
+        >> stats.mean(), stats.std()
+        >> stats = SignalStatistics(10000)
+        >> stats.update(simulation_output, offset=5000)
+    
+    See also
+        AnalogSignalList.statistics
+    """
+    def __init__(self, n_samples):
+        self.count = numpy.zeros(n_samples, int)
+        self._mean = numpy.zeros(n_samples, float)
+        self._m2   = numpy.zeros(n_samples, float)
+        self._min  = numpy.inf*numpy.ones(n_samples)
+        self._max  = -numpy.inf*numpy.ones(n_samples)
+
+    def __len__(self):
+        return len(self.count)
+
+    def update(self, signals, offset=0):
+        """
+        Add signals to the statistics, and return the SignalStatistics object.
+        
+        Inputs:
+            signals - an AnalogSignal, an AnalogSignalList, a signal or a 2D array with 
+                      one signal per row.
+            offset  - the index of the point at which the signals start, if they only 
+                      cover a part of the n_samples points
+        """
+        if isinstance(signals, AnalogSignalList):
+            for block in signals._row_blocks():
+                self.update(block, offset)
+            return self
+        if isinstance(signals, AnalogSignal):
+            signals = signals.signal
+        signals = numpy.atleast_2d(numpy.asarray(signals, float))
+        if len(signals) > 0:
+            mean = signals.mean(axis=0)
+            m2   = ((signals - mean)**2).sum(axis=0)
+            self.__combine(slice(offset, offset + signals.shape[1]), len(signals), mean, m2, 
+                           signals.min(axis=0), signals.max(axis=0))
+        return self
+
+    def merge(self, stats, offset=0):
+        """
+        Add the signals accumulated by another SignalStatistics object, whose points start
+        at offset, and return the SignalStatistics object.
+        """
+        self.__combine(slice(offset, offset + len(stats)), stats.count, stats._mean, stats._m2, 
+                       stats._min, stats._max)
+        return self
+
+    def __combine(self, points, count, mean, m2, lowest, highest):
+        total = self.count[points] + count
+        ratio = count/numpy.maximum(total, 1).astype(float)
+        delta = mean - self._mean[points]
+        self._mean[points] += delta*ratio
+        self._m2[points]   += m2 + delta**2*self.count[points]*ratio
+        self._min[points]   = numpy.minimum(self._min[points], lowest)
+        self._max[points]   = numpy.maximum(self._max[points], highest)
+        self.count[points]  = total
+
+    def __empty(self, values):
+        return numpy.where(self.count > 0, values, numpy.nan)
+
+    def mean(self):
+        """
+        Return the mean of the signals, point by point (nan where there is no signal)
+        """
+        return self.__empty(self._mean)
+
+    def var(self, ddof=0):
+        """
+        Return the variance of the signals, point by point. The divisor is count - ddof.
+        """
+        return self.__empty(self._m2/numpy.maximum(self.count - ddof, 1))
+
+    def std(self, ddof=0):
+        """
+        Return the standard deviation of the signals, point by point
+        """
+        return numpy.sqrt(self.var(ddof))
+
+    def min(self):
+        return self.__empty(self._min)
+
+    def max(self):
+        return self.__empty(self._max)
+
+
+class _AnalogSignalViews(object):
+    """
+    Dictionary-like access to the AnalogSignals of an AnalogSignalList. The AnalogSignal
+    objects are only created when requested, as views on the rows of the shared array
+    of signals, so modifying their signal in place modifies the AnalogSignalList.
+    """
+    def __init__(self, aslist):
+        self._aslist = aslist
+
+    def __len__(self):
+        return len(self._aslist)
+
+    def __contains__(self, id):
+        return self._aslist._index(id) is not None
+
+    has_key = __contains__
+
+    def __getitem__(self, id):
+        idx = self._aslist._index(id)
+        if idx is None:
+            raise KeyError(id)
+        return self._aslist._signal(idx)
+
+    def __setitem__(self, id, signal):
+        self._aslist[id] = signal
+
+    def __delitem__(self, id):
+        del self._aslist[id]
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def pop(self, id):
+        signal = self[id].copy()
+        del self[id]
+        return signal
+
+    def keys(self):
+        return list(self._aslist._ids)
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def iterkeys(self):
+        return iter(self._aslist._ids)
+
+    def itervalues(self):
+        for idx in xrange(len(self._aslist)):
+            yield self._aslist._signal(idx)
+
+    def iteritems(self):
+        for idx, id in enumerate(self._aslist._ids):
+            yield id, self._aslist._signal(idx)
+
+
+def _threshold_crossings(signals, threshold, sign='above'):
+    """
+    Return the rows and the indices of the first sample of every run of samples of the
+    2D array signals that are above (or below) threshold. threshold is either a single
+    value or one value per row. The crossings are sorted by row, and then by index.
+    """
+    threshold = numpy.asarray(threshold, float)
+    if threshold.ndim > 0:
+        threshold = threshold[:,None]
+    if sign == 'above':
+        inside = signals > threshold
+    elif sign == 'below':
+        inside = signals < threshold
+    else:
+        raise ValueError("sign should be 'above' or 'below', not %s" %sign)
+    onsets = inside.copy()
+    onsets[:,1:] &= ~inside[:,:-1]
+    return numpy.nonzero(onsets)
+
+def _crossing_times(signals, rows, indices, threshold, dt, t_start, interpolate=False):
+    """
+    Return the times of the threshold crossings (rows, indices) of signals, either at 
+    the first sample past the threshold or, if interpolate is True, linearly interpolated
+    between this sample and the previous one.
+    """
+    times = t_start + indices*dt
+    if interpolate:
+        inner     = indices > 0
+        rows, idx = rows[inner], indices[inner]
+        level     = numpy.asarray(threshold, float)
+        if level.ndim > 0:
+            level = level[rows]
+        after     = signals[rows, idx]
+        before    = signals[rows, idx-1]
+        times[inner] -= dt*(after - level)/(after - before)
+    return times
+
+def _dead_time(rows, times, refractory):
+    """
+    Return the mask of the events (sorted by row and time) kept when every kept event 
+    is followed by a dead time of refractory ms in its row. Within a row, the next kept
+    event is found with a binary search from the last one, so the cost only grows with
+    the number of kept events.
+    """
+    kept   = numpy.zeros(len(times), bool)
+    bounds = numpy.concatenate(([0], numpy.nonzero(numpy.diff(rows))[0] + 1, [len(rows)]))
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        row_times = times[start:stop]
+        idx       = 0
+        while idx < len(row_times):
+            kept[start + idx] = True
+            idx = numpy.searchsorted(row_times, row_times[idx] + refractory)
+    return kept
+
+def _time_index(times, dt, t_start):
+    """
+    Return the indices of the samples at times, computed as in AnalogSignal.time_slice:
+    halves are rounded away from zero, like round() does.
+    """
+    steps = (times - t_start)/dt
+    return (numpy.sign(steps)*numpy.floor(numpy.abs(steps) + 0.5)).astype(int)
+
+def _event_starts(events, dt, t_start, nb_samples, t_min, t_max):
+    """
+    Return the index of the first sample of the window [t_event - t_min, t_event + t_max[
+    of every event fitting in a signal of nb_samples points starting at t_start, and 
+    the number of samples of these windows. Times are converted into time steps first,
+    so that all the windows have the same length.
+    """
+    assert (t_min >= 0) and (t_max >= 0), "t_min and t_max should be greater than 0"
+    t_min_l = int(numpy.floor(t_min/dt))
+    length  = t_min_l + int(numpy.floor(t_max/dt))
+    starts  = numpy.floor(numpy.asarray(events, float)/dt) - numpy.floor(t_start/dt) - t_min_l
+    starts  = starts[(starts >= 0) & (starts + length < nb_samples)]
+    return starts.astype(int), length
+
+def _signal_windows(signal, length):
+    """
+    Return a read-only (len(signal)-length+1, length) view on signal, whose row i is 
+    the window of length samples starting at sample i. No data is copied.
+    """
+    stride = signal.strides[0]
+    return as_strided(signal, shape=(max(len(signal) - length + 1, 0), length), 
+                      strides=(stride, stride), writeable=False)
+
+def _windows_moments(windows, starts, block_size=1000):
+    """
+    Return the mean and the variance of the rows starts of windows, and their number. 
+    Rows are gathered block_size at a time into a SignalStatistics object.
+    """
+    stats = SignalStatistics(windows.shape[1])
+    for idx in xrange(0, len(starts), block_size):
+        stats.update(windows[starts[idx:idx+block_size]])
+    return stats.mean(), stats.var(), len(starts)
+
+
+def load_conductancelist(user_file, id_list=None, dt=None, t_start=None, t_stop=None, dims=None, mmap=False):
     """
     Returns TWO ConductanceList objects from a file. One for the excitatory and the other for
     the inhibitory conductance.
@@ -993,6 +1515,8 @@ def load_conductancelist(user_file, id_list=None, dt=None, t_start=None, t_stop=
         dt       - the discretization step, in ms
         t_start  - begining of the simulation, in ms.
         t_stop   - end of the simulation, in ms
+        mmap     - if True and the file is a StandardBinaryFile, the signals are not loaded
+                   in memory but read from the file when needed (see AnalogSignalList)
 
     If dims, dt, t_start, t_stop or id_list are None, they will be infered from either 
     the data or from the header. All times are in milliseconds. 
@@ -1002,10 +1526,10 @@ def load_conductancelist(user_file, id_list=None, dt=None, t_start=None, t_stop=
         >> gexc, ginh = load_conductancelist("mydata.dat")
     """
     analog_loader = DataHandler(user_file)
-    return analog_loader.load_analogs(type="conductance", id_list=id_list, dt=dt, t_start=t_start, t_stop=t_stop, dims=dims)
+    return analog_loader.load_analogs(type="conductance", id_list=id_list, dt=dt, t_start=t_start, t_stop=t_stop, dims=dims, mmap=mmap)
 
 
-def load_vmlist(user_file, id_list=None, dt=None, t_start=0, t_stop=None, dims=None):
+def load_vmlist(user_file, id_list=None, dt=None, t_start=0, t_stop=None, dims=None, mmap=False):
     """
     Returns a VmList object from a file. If the file has been generated by PyNN, 
     a header should be found with following parameters:
@@ -1022,16 +1546,18 @@ def load_vmlist(user_file, id_list=None, dt=None, t_start=0, t_stop=None, dims=N
         dt       - the discretization step, in ms
         t_start  - begining of the simulation, in ms.
         t_stop   - end of the simulation, in ms
+        mmap     - if True and the file is a StandardBinaryFile, the signals are not loaded
+                   in memory but read from the file when needed (see AnalogSignalList)
 
     If dims, dt, t_start, t_stop or id_list are None, they will be infered from either 
     the data or from the header. All times are in milliseconds. 
     The format of the file (text, pickle or hdf5) will be inferred automatically
     """
     analog_loader = DataHandler(user_file)
-    return analog_loader.load_analogs(type="vm", id_list=id_list, dt=dt, t_start=t_start, t_stop=t_stop, dims=dims)
+    return analog_loader.load_analogs(type="vm", id_list=id_list, dt=dt, t_start=t_start, t_stop=t_stop, dims=dims, mmap=mmap)
 
 
-def load_currentlist(user_file, id_list=None, dt=None, t_start=None, t_stop=None, dims=None):
+def load_currentlist(user_file, id_list=None, dt=None, t_start=None, t_stop=None, dims=None, mmap=False):
     """
     Returns a CurrentList object from a file. If the file has been generated by PyNN, 
     a header should be found with following parameters:
@@ -1048,12 +1574,14 @@ def load_currentlist(user_file, id_list=None, dt=None, t_start=None, t_stop=None
         dt       - the discretization step, in ms
         t_start  - begining of the simulation, in ms.
         t_stop   - end of the simulation, in ms
+        mmap     - if True and the file is a StandardBinaryFile, the signals are not loaded
+                   in memory but read from the file when needed (see AnalogSignalList)
 
     If dims, dt, t_start, t_stop or id_list are None, they will be infered from either 
     the data or from the header. All times are in milliseconds. 
     The format of the file (text, pickle or hdf5) will be inferred automatically
     """
     analog_loader = DataHandler(user_file)
-    return analog_loader.load_analogs(type="current", id_list=id_list, dt=dt, t_start=t_start, t_stop=t_stop, dims=dims)
+    return analog_loader.load_analogs(type="current", id_list=id_list, dt=dt, t_start=t_start, t_stop=t_stop, dims=dims, mmap=mmap)
 
 
@@ -13,6 +13,8 @@ SpikeTrain       - object representing a spike train, for one cell. Useful for p
 SpikeList        - object representing the activity of a population of neurons. Functions as a
                    dictionary of SpikeTrain objects, with methods to compute firing rate,
                    ISI, CV, cross-correlations, and so on.
+CompactSpikeList - a SpikeList storing all the spikes in flat arrays (times sorted by
+                   id, and offsets for each id), much lighter for large populations.
 
 Functions
 ---------
@@ -25,8 +27,9 @@ load                 - a generic loader for all the previous load methods.
 See also neurotools.signals.analogs
 """
 
-import os, re, numpy
+import os, re, numpy, multiprocessing
 import scipy.signal
+import scipy.sparse
 import logging
 from neurotools import check_dependency, check_numpy_version
 from neurotools import analysis
@@ -145,6 +148,52 @@ class SpikeTrain(object):
         if numpy.any(self.spike_times < 0):
             raise ValueError("Spike times must not be negative")
 
+    @classmethod
+    def from_sorted(cls, spike_times, t_start=None, t_stop=None, copy=False):
+        """
+        Build a SpikeTrain from spike times that are already sorted and lie between
+        t_start and t_stop. This is a trusted path: contrary to the constructor, no
+        filtering, sorting nor checking is performed. If t_start or t_stop are not
+        given, they are infered as in the constructor.
+        
+        Inputs:
+            spike_times - a sorted list/numpy array of spike times (in milliseconds)
+            t_start     - beginning of the SpikeTrain (if not, this is infered)
+            t_stop      - end of the SpikeTrain (if not, this is infered)
+            copy        - if False and spike_times is already a float32 array, it is
+                          used as is (and thus shared) by the new SpikeTrain
+        
+        Examples:
+            >> st = SpikeTrain.from_sorted(numpy.arange(0,100,10), 0, 100)
+            >> st.spike_times
+                [  0.,  10.,  20.,  30.,  40.,  50.,  60.,  70.,  80.,  90.]
+        
+        See also
+            SpikeTrain, copy
+        """
+        if copy:
+            spike_times = numpy.array(spike_times, numpy.float32)
+        else:
+            spike_times = numpy.asarray(spike_times, numpy.float32)
+        size = len(spike_times)
+        if t_start is None:
+            if size == 0:
+                t_start = 0
+            else:
+                t_start = spike_times[0]
+        if t_stop is None:
+            if size == 0:
+                t_stop = 0.1
+            elif size == 1:
+                t_stop = spike_times[0] + 0.1
+            else:
+                t_stop = spike_times[-1]
+        spktrain             = cls.__new__(cls)
+        spktrain.spike_times = spike_times
+        spktrain.t_start     = t_start
+        spktrain.t_stop      = t_stop
+        return spktrain
+
     def __str__(self):
         return str(self.spike_times)
 
@@ -184,7 +233,7 @@ class SpikeTrain(object):
         """
         Return a copy of the SpikeTrain object
         """
-        return SpikeTrain(self.spike_times, self.t_start, self.t_stop)
+        return SpikeTrain.from_sorted(self.spike_times, self.t_start, self.t_stop, copy=True)
 
 
     def duration(self):
@@ -475,7 +524,8 @@ class SpikeTrain(object):
         """
         self.t_start += offset
         self.t_stop  += offset
-        self.spike_times += offset
+        # Not in place: spike_times may be a view shared with the SpikeTrain it was sliced from
+        self.spike_times = self.spike_times + offset
 
     def time_slice(self, t_start, t_stop):
         """ 
@@ -483,6 +533,10 @@ class SpikeTrain(object):
         where t_start and t_stop may either be single values or sequences of
         start and stop times.
         
+        For single values, the spike times of the new SpikeTrain are a view on the
+        ones of the current object, found by binary search, and no data is copied.
+        Use copy() to get an independent SpikeTrain.
+        
         Inputs:
             t_start - begining of the new SpikeTrain, in ms.
             t_stop  - end of the new SpikeTrain, in ms.
@@ -509,15 +563,31 @@ class SpikeTrain(object):
                 mask = mask | ((self.spike_times >= t0) & (self.spike_times <= t1))
             t_start = t_start[0]
             t_stop = t_stop[-1]
-        else:
+        elif t_start is None or t_stop is None:
             mask = (self.spike_times >= t_start) & (self.spike_times <= t_stop)
+        else:
+            return self.__view(t_start, t_stop)
         spikes = numpy.extract(mask, self.spike_times)
         return SpikeTrain(spikes, t_start, t_stop)
 
+    def __view(self, t_start, t_stop):
+        """
+        Return a SpikeTrain whose spike times are the ones of the current object
+        between t_start and t_stop, as a view found by binary search.
+        """
+        if t_start >= t_stop:
+            raise ValueError("Incompatible time interval : t_start = %s, t_stop = %s" % (t_start, t_stop))
+        # Bounds are cast to the dtype of spike_times, as the comparisons of a mask would be
+        bound = self.spike_times.dtype.type
+        i     = numpy.searchsorted(self.spike_times, bound(t_start), 'left')
+        j     = numpy.searchsorted(self.spike_times, bound(t_stop), 'right')
+        return SpikeTrain.from_sorted(self.spike_times[i:j], t_start, t_stop)
+
     def interval_slice(self, interval):
         """ 
         Return a new SpikeTrain obtained by slicing with an Interval. The new 
-        t_start and t_stop values of the returned SpikeTrain are the extrema of the Interval
+        t_start and t_stop values of the returned SpikeTrain are the extrema of the Interval.
+        As for time_slice, the spike times are a view on the ones of the current object.
         
         Inputs:
             interval - The interval from which spikes should be extracted
@@ -529,9 +599,7 @@ class SpikeTrain(object):
             >> spk.t_stop
                 100
         """
-        times           = interval.slice_times(self.spike_times)
-        t_start, t_stop = interval.time_parameters()
-        return SpikeTrain(times, t_start, t_stop)
+        return self.time_slice(interval.t_start(), interval.t_stop())
         
 
     def time_histogram(self, time_bin=10, normalized=True, binary=False):
@@ -614,44 +682,14 @@ class SpikeTrain(object):
         if m_idx is None:
             m_idx = kernel.size / 2
         
-        time_vector = numpy.zeros((t_stop - t_start)/resolution + 1)
-        
         spikes_slice = self.spike_times[(self.spike_times >= t_start) & (
             self.spike_times <= t_stop)]
         
-        for spike in spikes_slice:
-            index = (spike - t_start) / resolution
-            time_vector[index] = 1
+        indices = numpy.unique(((spikes_slice.astype(float) - t_start) / resolution).astype(int))
+        size    = int(round((t_stop - t_start)/resolution)) + 1
         
-        r = norm * scipy.signal.fftconvolve(time_vector, kernel, 'full')
-
-        if acausal is True:
-            if trim is False:
-                r = r[m_idx:-(kernel.size - m_idx)]
-                t_axis = numpy.linspace(t_start, t_stop, r.size)
-                return t_axis, r
-            
-            elif trim is True:
-                r = r[2 * m_idx:-2*(kernel.size - m_idx)]
-                t_start = t_start + m_idx * resolution
-                t_stop = t_stop - ((kernel.size) - m_idx) * resolution
-                t_axis = numpy.linspace(t_start, t_stop, r.size)
-                return t_axis, r
-            
-        if acausal is False:
-            if trim is False:
-                r = r[m_idx:-(kernel.size - m_idx)]
-                t_axis = (numpy.linspace(t_start, t_stop, r.size) +
-                          m_idx * resolution)
-                return t_axis, r
-            
-            elif trim is True:
-                r = r[2 * m_idx:-2*(kernel.size - m_idx)]
-                t_start = t_start + m_idx * resolution
-                t_stop = t_stop - ((kernel.size) - m_idx) * resolution
-                t_axis = (numpy.linspace(t_start, t_stop, r.size) +
-                          m_idx * resolution)
-                return t_axis, r
+        r = norm * _convolve_events(indices, numpy.ones(len(indices)), size, kernel)
+        return _kernel_rate_output(r, kernel, m_idx, t_start, t_stop, resolution, acausal, trim)
     
     def relative_times(self):
         """
@@ -661,7 +699,7 @@ class SpikeTrain(object):
         is subtracted from spike_times, t_start and t_stop
         """
         if self.t_start != 0:
-            self.spike_times -= self.t_start
+            self.spike_times  = self.spike_times - self.t_start
             self.t_stop      -= self.t_start
             self.t_start      = 0.0
 
@@ -676,6 +714,15 @@ class SpikeTrain(object):
         Inputs:
             spktrain - the other SpikeTrain
             cost     - The cost parameter. See the paper for more information
+        
+        The dynamic programming table is computed one row at a time, and only the
+        last row is kept in memory (its length is set by the shortest train). Within
+        a row, scr[i,j] = min(scr[i,j-1]+1, c[j]), where c[j] only depends on the previous
+        row, has the closed form scr[i,j] = j + min_{k<=j}(c[k]-k), so that each row is
+        obtained with a few vectorized operations.
+        
+        See also
+            distance_kreuz, SpikeList.distance_matrix
         """
         nspk_1      = len(self)
         nspk_2      = len(spktrain)
@@ -683,16 +730,20 @@ class SpikeTrain(object):
             return abs(nspk_1-nspk_2)
         elif cost > 1e9 :
             return nspk_1+nspk_2
-        scr = numpy.zeros((nspk_1+1,nspk_2+1))
-        scr[:,0] = numpy.arange(0,nspk_1+1)
-        scr[0,:] = numpy.arange(0,nspk_2+1)
-            
-        if nspk_1 > 0 and nspk_2 > 0:
-            for i in xrange(1, nspk_1+1):
-                for j in xrange(1, nspk_2+1):
-                    scr[i,j] = min(scr[i-1,j]+1,scr[i,j-1]+1)
-                    scr[i,j] = min(scr[i,j],scr[i-1,j-1]+cost*abs(self.spike_times[i-1]-spktrain.spike_times[j-1]))
-        return scr[nspk_1,nspk_2]
+        if nspk_1 == 0 or nspk_2 == 0:
+            return float(nspk_1+nspk_2)
+        times_1, times_2 = self.spike_times, spktrain.spike_times
+        if nspk_1 < nspk_2:
+            times_1, times_2 = times_2, times_1
+            nspk_1, nspk_2   = nspk_2, nspk_1
+        k   = numpy.arange(nspk_2+1)
+        row = k.astype(float)
+        c   = numpy.zeros(nspk_2+1, float)
+        for i in xrange(1, nspk_1+1):
+            c[0]  = i
+            c[1:] = numpy.minimum(row[1:]+1, row[:-1]+cost*numpy.abs(times_1[i-1]-times_2).astype(float))
+            row   = k + numpy.minimum.accumulate(c - k)
+        return row[nspk_2]
 
 
     def distance_kreuz(self, spktrain, dt=0.1):
@@ -704,41 +755,109 @@ class SpikeTrain(object):
 
         Inputs:
             spktrain - the other SpikeTrain
-            dt       - the bin width used to discretize the spike times
+            dt       - not used anymore, the distance being computed exactly. Kept 
+                       for compatibility
+        
+        Examples:
+            >> spktrain.distance_kreuz(spktrain2)
+        
+        See also
+            distance_isi, distance_spike, distance_victorpurpura
+        """
+        return self.distance_isi(spktrain)
+
+    def __kreuz_grid(self, spktrain):
+        """
+        Return the spike times of both trains, with auxiliary spikes at the common
+        t_start and t_stop, and the merged grid of all those times.
+        """
+        t_start = min(self.t_start, spktrain.t_start)
+        t_stop  = max(self.t_stop, spktrain.t_stop)
+        grids   = []
+        for times in self.spike_times, spktrain.spike_times:
+            times = numpy.asarray(times, float)
+            times = times[(times > t_start) & (times < t_stop)]
+            grids.append(numpy.unique(numpy.concatenate(([t_start], times, [t_stop]))))
+        return grids[0], grids[1], numpy.union1d(grids[0], grids[1])
+
+    def distance_isi(self, spktrain):
+        """
+        Function to calculate the ISI-distance between two spike trains, i.e. the time
+        average of |I(t)|, where I(t) = x_isi(t)/y_isi(t) - 1 if x_isi(t) <= y_isi(t) and 
+        -(y_isi(t)/x_isi(t) - 1) otherwise, x_isi and y_isi being the current interspike 
+        intervals of the two trains. See
+            Kreuz, T.; Haas, J.S.; Morelli, A.; Abarbanel, H.D.I. & Politi, A. 
+            Measuring spike train synchrony. 
+            J Neurosci Methods, 165:151-161, 2007
+        
+        I(t) is constant between two spikes of the merged trains, so the integral is 
+        computed exactly on the merged spike times, without any discretization of time. 
+        Auxiliary spikes are added at t_start and t_stop.
+
+        Inputs:
+            spktrain - the other SpikeTrain
+        
+        Examples:
+            >> spktrain.distance_isi(spktrain2)
+        
+        See also
+            distance_spike, distance_kreuz, SpikeList.distance_matrix
+        """
+        s1, s2, grid = self.__kreuz_grid(spktrain)
+        left         = grid[:-1]
+        i1           = numpy.searchsorted(s1, left, 'right') - 1
+        i2           = numpy.searchsorted(s2, left, 'right') - 1
+        x_isi        = s1[i1+1] - s1[i1]
+        y_isi        = s2[i2+1] - s2[i2]
+        ratio        = numpy.minimum(x_isi, y_isi)/numpy.maximum(x_isi, y_isi)
+        return numpy.sum((1 - ratio)*numpy.diff(grid))/(grid[-1] - grid[0])
+
+    def distance_spike(self, spktrain):
+        """
+        Function to calculate the SPIKE-distance between two spike trains. See
+            Kreuz, T.; Chicharro, D.; Houghton, C.; Andrzejak, R.G. & Mormann, F.
+            Monitoring spike train synchrony.
+            J Neurophysiol, 109:1457-1472, 2013
+        
+        The dissimilarity profile S(t) is linear between two spikes of the merged 
+        trains, so the integral is computed exactly on the merged spike times, without
+        any discretization of time. Auxiliary spikes are added at t_start and t_stop.
+
+        Inputs:
+            spktrain - the other SpikeTrain
         
         Examples:
-            >> spktrain.KreuzDistance(spktrain2)
+            >> spktrain.distance_spike(spktrain2)
         
         See also
-            VictorPurpuraDistance
-        """
-        N              = (self.t_stop-self.t_start)/dt
-        vec_1          = numpy.zeros(N, numpy.float32)
-        vec_2          = numpy.zeros(N, numpy.float32)
-        result         = numpy.zeros(N, float)
-        idx_spikes     = numpy.array(self.spike_times/dt,int)
-        previous_spike = 0
-        if len(idx_spikes) > 0:
-            for spike in idx_spikes[1:]:
-                vec_1[previous_spike:spike] = (spike-previous_spike)
-                previous_spike = spike
-        idx_spikes     = numpy.array(spktrain.spike_times/dt,int)
-        previous_spike = 0
-        if len(idx_spikes) > 0:
-            for spike in idx_spikes[1:]:
-                vec_2[previous_spike:spike] = (spike-previous_spike)
-                previous_spike = spike
-        idx = numpy.where(vec_1 < vec_2)[0]
-        result[idx] = vec_1[idx]/vec_2[idx] - 1
-        idx = numpy.where(vec_1 > vec_2)[0]
-        result[idx] = -vec_2[idx]/vec_1[idx] + 1
-        return numpy.sum(numpy.abs(result))/len(result)
+            distance_isi, distance_kreuz, SpikeList.distance_matrix
+        """
+        s1, s2, grid = self.__kreuz_grid(spktrain)
+        left, right  = grid[:-1], grid[1:]
+        profiles     = []
+        for s, other in (s1, s2), (s2, s1):
+            # distance of each spike to the nearest spike of the other train
+            idx     = numpy.searchsorted(other, s)
+            before  = numpy.abs(s - other[numpy.maximum(idx-1, 0)])
+            after   = numpy.abs(other[numpy.minimum(idx, len(other)-1)] - s)
+            nearest = numpy.minimum(before, after)
+            i       = numpy.searchsorted(s, left, 'right') - 1
+            t_p, t_f = s[i], s[i+1]
+            isi      = t_f - t_p
+            s_left   = (nearest[i]*(t_f - left) + nearest[i+1]*(left - t_p))/isi
+            s_right  = (nearest[i]*(t_f - right) + nearest[i+1]*(right - t_p))/isi
+            profiles.append((isi, s_left, s_right))
+        (x_isi, s1_left, s1_right), (y_isi, s2_left, s2_right) = profiles
+        norm    = 2*((x_isi + y_isi)/2.)**2
+        s_left  = (s1_left*y_isi + s2_left*x_isi)/norm
+        s_right = (s1_right*y_isi + s2_right*x_isi)/norm
+        return numpy.sum((s_left + s_right)/2.*(right - left))/(grid[-1] - grid[0])
     
     
     def psth(self, events, time_bin=2, t_min=50, t_max=50, display = False, kwargs={}, average=True):
         """
         Return the psth of the spike times contained in the SpikeTrain according to selected events, 
-        on a time window t_spikes - tmin, t_spikes + tmax
+        on a time window t_spikes - tmin, t_spikes + tmax, as firing rates in Hz
         
         Inputs:
             events  - Can be a SpikeTrain object (and events will be the spikes) or just a list 
@@ -749,6 +868,9 @@ class SpikeTrain(object):
             display - if True, a new figure is created. Could also be a subplot.
             kwargs  - dictionary contening extra parameters that will be sent to the plot 
                       function
+            average - If True, return a vector of nb_bins values, the psth averaged over 
+                      the events. If False, return an array of shape (nb_events, nb_bins)
+                      with the psth of every event.
             
         Examples:
             >> spk.psth(spktrain, t_min = 50, t_max = 150)
@@ -756,40 +878,22 @@ class SpikeTrain(object):
             >> spk.psth(range(0,1000,10), display=True)
             
         See also
-            SpikeTrain.spike_histogram
-        """
-        
-        if isinstance(events, SpikeTrain):
-            events = events.spike_times
-        assert (t_min >= 0) and (t_max >= 0), "t_min and t_max should be greater than 0"
-        assert len(events) > 0, "events should not be empty and should contained at least one element"
-
-        spk_hist = self.time_histogram(time_bin)
-        subplot  = get_display(display)
-        count    = 0
-        t_min_l  = numpy.floor(t_min/time_bin)
-        t_max_l  = numpy.floor(t_max/time_bin)
-        result   = numpy.zeros((t_min_l+t_max_l), numpy.float32)
-        t_start  = numpy.floor(self.t_start/time_bin)
-        t_stop   = numpy.floor(self.t_stop/time_bin)
-        result   = []
-        for ev in events:
-           ev = numpy.floor(ev/time_bin)
-           if ((ev - t_min_l )> t_start) and (ev + t_max_l ) < t_stop:
-               count  += 1
-               result += [spk_hist[(ev-t_min_l):ev+t_max_l]]
-        result = numpy.array(result)    
-        if average:        
-            result /= count
+            SpikeTrain.spike_histogram, SpikeList.psth_counts
+        """
+        events, edges = _psth_windows(events, time_bin, t_min, t_max, self.t_start, self.t_stop)
+        subplot = get_display(display)
+        result  = _event_counts([self.spike_times], events, edges)[0]*1000./time_bin
+        if average:
+            result = numpy.mean(result, 0)
         
         if not subplot or not HAVE_PYLAB:
             return result
         else:
             xlabel = "Time (ms)"
             ylabel = "PSTH"
-            time   = numpy.linspace(-t_min, t_max, (t_min+t_max)/time_bin)
+            time   = edges[:-1]
             set_labels(subplot, xlabel, ylabel)
-            subplot.plot(time, result, c='k', **kwargs)
+            subplot.plot(time, numpy.atleast_2d(result).T, c='k', **kwargs)
             xmin, xmax, ymin, ymax = subplot.axis()
             subplot.plot([0,0],[ymin, ymax], c='r')
             set_axis_limits(subplot, -t_min, t_max, ymin, ymax)
@@ -926,6 +1030,13 @@ class SpikeList(object):
         self.spiketrains = {}
         id_list          = numpy.sort(id_list)
         
+        # The SpikeTrains are built with from_sorted, so the checks of the SpikeTrain 
+        # constructor are done here, once for all of them
+        if self.t_start is not None and self.t_start < 0:
+            raise ValueError("t_start must not be negative")
+        if self.t_start is not None and self.t_stop is not None and self.t_start >= self.t_stop:
+            raise Exception("Incompatible time interval : t_start = %s, t_stop = %s" % (self.t_start, self.t_stop))
+        
         ##### Implementaion base on pure Numpy arrays, that seems to be faster for
         ## large spike files. Still not very efficient in memory, because we are not
         ## using a generator to build the SpikeList...
@@ -935,17 +1046,28 @@ class SpikeList(object):
         N = len(spikes)
         
         if N > 0:
-            idx    = numpy.argsort(spikes[:,0])
-            spikes = spikes[idx]
-            logging.debug("sorted spikes[:10,:] = %s" % str(spikes[:10,:]))
-        
-            break_points = numpy.where(numpy.diff(spikes[:, 0]) > 0)[0] + 1
+            # A single sort by (id, time) lets every SpikeTrain be a sorted segment of times,
+            # built without going through the checks of the SpikeTrain constructor
+            times  = numpy.asarray(spikes[:, 1], numpy.float32)
+            idx    = numpy.lexsort((times, spikes[:, 0]))
+            ids    = spikes[idx, 0]
+            times  = times[idx]
+            logging.debug("sorted spikes[:10,:] = %s" % str(spikes[idx[:10],:]))
+        
+            break_points = numpy.where(numpy.diff(ids) > 0)[0] + 1
             break_points = numpy.concatenate(([0], break_points))
             break_points = numpy.concatenate((break_points, [N]))
             for idx in xrange(len(break_points)-1):
-                id = spikes[break_points[idx], 0]
+                id = ids[break_points[idx]]
                 if id in id_list:
-                    self.spiketrains[id] = SpikeTrain(spikes[break_points[idx]:break_points[idx+1], 1], self.t_start, self.t_stop)
+                    train = times[break_points[idx]:break_points[idx+1]]
+                    if self.t_start is not None:
+                        train = train[train.searchsorted(numpy.float32(self.t_start), 'left'):]
+                    if self.t_stop is not None:
+                        train = train[:train.searchsorted(numpy.float32(self.t_stop), 'right')]
+                    if len(train) > 0 and train[0] < 0:
+                        raise ValueError("Spike times must not be negative")
+                    self.spiketrains[id] = SpikeTrain.from_sorted(train, self.t_start, self.t_stop)
         
         self.complete(id_list)
         
@@ -954,10 +1076,6 @@ class SpikeList(object):
         
         del spikes
 
-    def __del__(self):
-        for id in self.id_list:
-            del self.spiketrains[id]
-
     @property
     def id_list(self):
         """ 
@@ -972,11 +1090,12 @@ class SpikeList(object):
 
     def copy(self):
         """
-        Return a copy of the SpikeList object
+        Return a copy of the SpikeList object. Contrary to the slicing methods,
+        the spike times of all the SpikeTrains are copied.
         """
         spklist = SpikeList([], [], self.t_start, self.t_stop, self.dimensions)
         for id in self.id_list:
-            spklist.append(id, self.spiketrains[id])
+            spklist.spiketrains[id] = self.spiketrains[id].time_slice(self.t_start, self.t_stop).copy()
         return spklist
 
     def __calc_startstop(self):
@@ -1156,7 +1275,7 @@ class SpikeList(object):
             concatenate, append, __setitem__
         """
         for id, spiketrain in spikelist.spiketrains.items():
-            if id in self.id_list:
+            if id in self.spiketrains:
                 self.spiketrains[id].merge(spiketrain, relative)
             else:
                 if relative:
@@ -1193,7 +1312,8 @@ class SpikeList(object):
             id_list - Can be an integer (and then N random cells will be selected)
                       or a sublist of the current ids
         
-        The new SpikeList inherits the time parameters (t_start, t_stop)
+        The new SpikeList inherits the time parameters (t_start, t_stop). Its
+        SpikeTrains are views on the ones of the current object (see SpikeTrain.time_slice)
         
         Examples:
             >> spklist.id_list
@@ -1208,15 +1328,17 @@ class SpikeList(object):
         new_SpkList = SpikeList([], [], self.t_start, self.t_stop, self.dimensions)
         id_list = self.__sub_id_list(id_list)
         for id in id_list:
-            try:
-                new_SpkList.append(id, self.spiketrains[id])
-            except Exception:
-                logging.debug("id %d is not in the source SpikeList or already in the new one" %id)
+            if id in self.spiketrains:
+                new_SpkList.spiketrains[id] = self.spiketrains[id].time_slice(self.t_start, self.t_stop)
+            else:
+                logging.debug("id %d is not in the source SpikeList" %id)
         return new_SpkList
 
     def time_slice(self, t_start, t_stop):
         """
-        Return a new SpikeList obtained by slicing between t_start and t_stop
+        Return a new SpikeList obtained by slicing between t_start and t_stop.
+        The SpikeTrains of the new SpikeList are views on the ones of the current
+        object (see SpikeTrain.time_slice)
         
         Inputs:
             t_start - begining of the new SpikeTrain, in ms.
@@ -1227,7 +1349,7 @@ class SpikeList(object):
         """
         new_SpkList = SpikeList([], [], t_start, t_stop, self.dimensions)
         for id in self.id_list:
-            new_SpkList.append(id, self.spiketrains[id].time_slice(t_start, t_stop))
+            new_SpkList.spiketrains[id] = self.spiketrains[id].time_slice(t_start, t_stop)
         new_SpkList.__calc_startstop()
         return new_SpkList
         
@@ -1242,11 +1364,7 @@ class SpikeList(object):
         See also
             id_slice, time_slice
         """
-        t_start, t_stop = interval.time_parameters()
-        new_SpkList = SpikeList([], [], t_start, t_stop, self.dimensions)
-        for id in self.id_list:
-            new_SpkList.append(id, self.spiketrains[id].interval_slice(interval))
-        return new_SpkList
+        return self.time_slice(interval.t_start(), interval.t_stop())
     
     def time_offset(self, offset):
         """
@@ -1557,7 +1675,7 @@ class SpikeList(object):
             subplot.plot(xaxis, values, **kwargs)
             pylab.draw()
 
-    def cv_local(self, t_start=None, t_stop=None, length=12, step=6):
+    def cv_local(self, t_start=None, t_stop=None, length=12, step=6, time_course=False):
         """
         Provides a modified version of the coefficient of variation, a measure
         that describes the regularity of spiking neurons/networks.
@@ -1568,16 +1686,24 @@ class SpikeList(object):
         to an exceptionally high CV.
         
         Inputs:
-            t_start  - The time to start the averaging 
-            t_stop   - The time to stop the averaging 
-            length   - A factor to determine the window length for the average, 
-                       The window considered will be (t_stop-t_start)/length.
-                       12 by default
-            time_bin -  factor to determin the step size
-        for its shifting.
+            t_start     - The time to start the averaging 
+            t_stop      - The time to stop the averaging 
+            length      - A factor to determine the window length for the average, 
+                          The window considered will be (t_stop-t_start)/length.
+                          12 by default
+            step        - factor to determine the step size (windowLength/step)
+                          for its shifting.
+            time_course - if True, the start times of the windows and the local CV 
+                          averaged in each of them (nan if a window is empty) are 
+                          returned as well.
+        
+        The local variation terms of all the consecutive pairs of isi of all the cells 
+        (with more than 15 spikes) are computed at once, and accumulated in the windows
+        containing them with cumulative sums.
         
         Examples:
             >> spklist.cv_local(0, 1000, 12, 10)
+            >> cv, t_axis, cv_windows = spklist.cv_local(time_course=True)
         
         See also
             cv_isi, cv_isi_hist, cv_kl
@@ -1588,27 +1714,34 @@ class SpikeList(object):
             t_stop  = self.t_stop
         windowLength = (t_stop-t_start)/length
         stepSize = windowLength/step
-        maxBin   = int((t_stop-t_start-windowLength)/stepSize)
-        #print 'wL=',windowLength,' sSize=',stepSize,' maxBin=',maxBin
-        vLocCV   = numpy.zeros(maxBin)
-        vCnt     = numpy.zeros(maxBin)
-        N = len(self.id_list)
-        for i in xrange(N):
-            if len(self.spiketrains[i])>15 :
-                for j in xrange(2,len(self.spiketrains[i]),1) :
-                    diff1=self.spiketrains[i].spike_times[j]-self.spiketrains[i].spike_times[j-1]
-                    diff0=self.spiketrains[i].spike_times[j-1]-self.spiketrains[i].spike_times[j-2]
-                    tmp=2*numpy.abs(diff1-diff0)/(diff1+diff0)
-                    for b in range(maxBin) :
-                        if self.spiketrains[i].spike_times[j-2]>b*stepSize+t_start and self.spiketrains[i].spike_times[j]<=b*stepSize+t_start+windowLength :
-                            vLocCV[b] = vLocCV[b] + tmp
-                            vCnt[b]  = vCnt[b]+1
-                        
-        locCV= 0.0
-        for b in range(maxBin) :
-            if vCnt[b] > 0 :
-                locCV =  vLocCV[b]/vCnt[b]
-    
+        maxBin   = max(0, int((t_stop-t_start-windowLength)/stepSize))
+        lowers   = numpy.arange(maxBin)*stepSize + t_start
+        uppers   = lowers + windowLength
+        
+        times, rows = self._flat_rows()
+        counts = numpy.bincount(rows, minlength=len(self))
+        # Triplets of consecutive spikes (j-2, j-1, j) of the cells with more than 15 spikes
+        j      = numpy.arange(2, len(times))
+        j      = j[(rows[j] == rows[j-2]) & (counts[rows[j]] > 15)]
+        diff1  = times[j] - times[j-1]
+        diff0  = times[j-1] - times[j-2]
+        tmp    = 2*numpy.abs(diff1-diff0)/(diff1+diff0)
+        # A term is counted in window b if times[j-2] > lowers[b] and times[j] <= uppers[b]
+        b_lo   = numpy.searchsorted(uppers, times[j], 'left')
+        b_hi   = numpy.searchsorted(lowers, times[j-2], 'left')
+        valid  = b_lo < b_hi
+        b_lo, b_hi, tmp = b_lo[valid], b_hi[valid], tmp[valid].astype(float)
+        vLocCV = numpy.cumsum(numpy.bincount(b_lo, tmp, maxBin+1) - numpy.bincount(b_hi, tmp, maxBin+1))[:maxBin]
+        vCnt   = numpy.cumsum(numpy.bincount(b_lo, minlength=maxBin+1) - numpy.bincount(b_hi, minlength=maxBin+1))[:maxBin]
+        
+        cv_windows = numpy.zeros(maxBin)*numpy.nan
+        filled     = vCnt > 0
+        cv_windows[filled] = vLocCV[filled]/vCnt[filled]
+        locCV = 0.0
+        if numpy.any(filled):
+            locCV = cv_windows[filled][-1]
+        if time_course:
+            return locCV, lowers, cv_windows
         return locCV
             
 
@@ -1708,7 +1841,7 @@ class SpikeList(object):
             
 
 
-    def spike_histogram(self, time_bin, normalized=False, binary=False, display=False, kwargs={}):
+    def spike_histogram(self, time_bin, normalized=False, binary=False, display=False, kwargs={}, sparse=False):
         """
         Generate an array with all the spike_histograms of all the SpikeTrains
         objects within the SpikeList.
@@ -1722,35 +1855,26 @@ class SpikeList(object):
             binary     - if True, a binary matrix of 0/1 is returned
             kwargs     - dictionary contening extra parameters that will be sent to the plot 
                          function
+            sparse     - if True, a scipy.sparse.csr_matrix is returned instead of a dense
+                         array. Useful for small time bins and large populations.
+        
+        All the spikes of the population are binned in a single pass, so the cost does
+        not depend on the number of cells.
+        
+        Examples:
+            >> spklist.spike_histogram(1., sparse=True)
+                <10000x10000 sparse matrix of type '<type 'numpy.float32'>'
+                    with 98765 stored elements in Compressed Sparse Row format>
         
         See also
             firing_rate, time_axis
         """
-        nbins      = self.time_axis(time_bin)
-        N          = len(self)
-        M          = len(nbins)
-        if newnum:
-            M -= 1
-        if binary:
-            spike_hist = numpy.zeros((N, M), numpy.int)
-        else:
-            spike_hist = numpy.zeros((N, M), numpy.float32)
+        spike_hist = self._spike_counts(self.time_axis(time_bin), sparse)
         subplot    = get_display(display)
-
-        for idx,id in enumerate(self.id_list):
-            if newnum:
-                if not hist_new:
-                    hist, edges = numpy.histogram(self.spiketrains[id].spike_times, nbins)
-                else:
-                    hist, edges = numpy.histogram(self.spiketrains[id].spike_times, nbins, new=newnum)
-            else:
-                hist, edges = numpy.histogram(self.spike_times, bins)
-            hist = hist.astype(float)
-            if normalized: # what about normalization if time_bin is a sequence?
-                hist *= 1000.0/float(time_bin)
-            if binary:
-                hist = hist.astype(bool)
-            spike_hist[idx,:] = hist
+        if normalized: # what about normalization if time_bin is a sequence?
+            spike_hist = spike_hist * (1000.0/float(time_bin))
+        if binary:
+            spike_hist = spike_hist.astype(bool).astype(numpy.int)
         if not subplot or not HAVE_PYLAB:
             return spike_hist
         else:
@@ -1763,11 +1887,60 @@ class SpikeList(object):
             axis = self.time_axis(time_bin)
             if newnum:
                 axis = axis[:len(axis)-1]
-            subplot.plot(axis,numpy.mean(spike_hist, axis=0),**kwargs)
+            subplot.plot(axis,numpy.asarray(spike_hist.mean(axis=0)).ravel(),**kwargs)
             pylab.draw()
-            
 
-    def firing_rate(self, time_bin, display=False, average=False, binary=False, kwargs={}):
+    def _id_histograms(self, ids, time_bin):
+        """
+        Return the spike histograms of the distinct cells found in ids, each of them
+        being binned only once, and for every element of ids the row of its histogram.
+        """
+        unique_ids, rows = numpy.unique(ids, return_inverse=True)
+        sub_list = self.id_slice(list(unique_ids))
+        hist     = sub_list.spike_histogram(time_bin)
+        return hist[numpy.argsort(sub_list.id_list)], rows
+
+    def _flat_rows(self):
+        """
+        Return two arrays (times, rows) with all the spikes of the SpikeList,
+        rows being the position of the cell in id_list.
+        """
+        trains = [self.spiketrains[id].spike_times for id in self.id_list]
+        if len(trains) == 0:
+            return numpy.zeros(0, numpy.float32), numpy.zeros(0, int)
+        times  = numpy.concatenate(trains)
+        rows   = numpy.repeat(numpy.arange(len(trains)), [len(st) for st in trains])
+        return times, rows
+
+    def _spike_counts(self, bins, sparse=False):
+        """
+        Return a (len(self), len(bins)-1) float32 array with the number of spikes
+        of every cell (in the order of id_list) falling into each of the bins. All 
+        the spikes are digitized at once and scatter-added in the matrix. If sparse 
+        is True, a scipy.sparse.csr_matrix is returned.
+
+        See also
+            spike_histogram
+        """
+        times, rows = self._flat_rows()
+        times       = numpy.asarray(times, float)
+        N           = len(self)
+        if not newnum:
+            # old numpy semantic: bins are the left edges, the last bin is unbounded
+            bins = numpy.concatenate((bins, [numpy.inf]))
+        M           = len(bins) - 1
+        cols        = numpy.searchsorted(bins, times, 'right') - 1
+        cols[times == bins[-1]] = M - 1
+        valid       = (cols >= 0) & (cols < M)
+        rows, cols  = rows[valid], cols[valid]
+        if sparse:
+            data = numpy.ones(len(rows), numpy.float32)
+            return scipy.sparse.coo_matrix((data, (rows, cols)), shape=(N, M)).tocsr()
+        counts = numpy.bincount(rows*M + cols, minlength=N*M)
+        return counts.reshape(N, M).astype(numpy.float32)
+
+
+    def firing_rate(self, time_bin, display=False, average=False, binary=False, kwargs={}, sparse=False):
         """
         Generate an array with all the instantaneous firing rates along time (in Hz) 
         of all the SpikeTrains objects within the SpikeList. If average is True, it gives the
@@ -1781,13 +1954,14 @@ class SpikeList(object):
             binary     - If True, a binary matrix with 0/1 is returned. 
             kwargs     - dictionary contening extra parameters that will be sent to the plot 
                          function
+            sparse     - if True, a scipy.sparse.csr_matrix is returned (see spike_histogram)
         
         See also
             spike_histogram, time_axis
         """
-        result = self.spike_histogram(time_bin, normalized=True, binary=False, display=display, kwargs=kwargs)
+        result = self.spike_histogram(time_bin, normalized=True, binary=False, display=display, kwargs=kwargs, sparse=sparse)
         if average:
-            return numpy.mean(result, axis=0)
+            return numpy.asarray(result.mean(axis=0)).ravel()
         else:
             return result
 
@@ -1836,49 +2010,19 @@ class SpikeList(object):
         if m_idx is None:
             m_idx = kernel.size / 2
             
-        spikes_slice = []
-        for i in self:
-            train_slice = i.spike_times[(i.spike_times >= t_start) & (
-            i.spike_times <= t_stop)]
-            spikes_slice += train_slice.tolist()
-        
-        time_vector = numpy.zeros((t_stop - t_start)/resolution + 1)
-        
-        for spike in spikes_slice:
-            index = (spike - t_start) / resolution
-            time_vector[index] += 1.
-            
-        avg_time_vector = time_vector / float(self.id_list.size)
-        
-        r = norm * scipy.signal.fftconvolve(avg_time_vector, kernel, 'full')
-
-        if acausal is True:
-            if trim is False:
-                r = r[m_idx:-(kernel.size - m_idx)]
-                t_axis = numpy.linspace(t_start, t_stop, r.size)
-                return t_axis, r
-            
-            elif trim is True:
-                r = r[2 * m_idx:-2*(kernel.size - m_idx)]
-                t_start = t_start + m_idx * resolution
-                t_stop = t_stop - ((kernel.size) - m_idx) * resolution
-                t_axis = numpy.linspace(t_start, t_stop, r.size)
-                return t_axis, r
-            
-        if acausal is False:
-            if trim is False:
-                r = r[m_idx:-(kernel.size - m_idx)]
-                t_axis = (numpy.linspace(t_start, t_stop, r.size) +
-                          m_idx * resolution)
-                return t_axis, r
-            
-            elif trim is True:
-                r = r[2 * m_idx:-2*(kernel.size - m_idx)]
-                t_start = t_start + m_idx * resolution
-                t_stop = t_stop - ((kernel.size) - m_idx) * resolution
-                t_axis = (numpy.linspace(t_start, t_stop, r.size) +
-                          m_idx * resolution)
-                return t_axis, r
+        # all the spikes of the population are binned at once, and the summed
+        # counts are convolved with the kernel a single time
+        times, rows  = self._flat_rows()
+        spikes_slice = numpy.asarray(times, float)
+        spikes_slice = spikes_slice[(spikes_slice >= t_start) & (spikes_slice <= t_stop)]
+        indices      = ((spikes_slice - t_start) / resolution).astype(int)
+        size         = int(round((t_stop - t_start)/resolution)) + 1
+        counts       = numpy.bincount(indices, minlength=size)
+        indices      = numpy.where(counts > 0)[0]
+        values       = counts[indices] / float(len(self))
+        
+        r = norm * _convolve_events(indices, values, size, kernel)
+        return _kernel_rate_output(r, kernel, m_idx, t_start, t_stop, resolution, acausal, trim)
     
     def fano_factor(self, time_bin):
         """
@@ -2040,7 +2184,7 @@ class SpikeList(object):
                 pylab.draw()
 
 
-    def pairwise_cc(self, nb_pairs, pairs_generator=None, time_bin=1., average=True, display=False, kwargs={}):
+    def pairwise_cc(self, nb_pairs, pairs_generator=None, time_bin=1., average=True, display=False, kwargs={}, pool=None):
         """
         Function to generate an array of cross correlations computed
         between pairs of cells within the SpikeTrains.
@@ -2055,6 +2199,12 @@ class SpikeList(object):
                               spike_histogram over the whole population is then plotted
             kwargs          - dictionary contening extra parameters that will be sent to the plot 
                               function
+            pool            - an optional multiprocessing.Pool used to compute the correlations of the
+                              blocks of pairs in parallel
+        
+        Each cell involved in the pairs is binned only once, and the spectrum of its histogram
+        is cached: the cross correlations are then computed as batched spectral products by
+        an analysis.PairwiseCCF engine (whose memory needs are logged).
         
         Examples
             >> a.pairwise_cc(500, time_bin=1, averaged=True)
@@ -2062,7 +2212,8 @@ class SpikeList(object):
             >> a.pairwise_cc(100, CustomPairs(a,a,[(i,i+1) for i in xrange(100)]), time_bin=5)
         
         See also
-            pairwise_pearson_corrcoeff, pairwise_cc_zero, RandomPairs, AutoPairs, CustomPairs
+            pairwise_pearson_corrcoeff, pairwise_cc_zero, RandomPairs, AutoPairs, CustomPairs,
+            analysis.PairwiseCCF
         """
         subplot = get_display(display)
         
@@ -2073,34 +2224,23 @@ class SpikeList(object):
         # Then we select the pairs of cells
         pairs  = pairs_generator.get_pairs(nb_pairs)
         N      = len(pairs)
-        if newnum:
-            length = 2*(len(pairs_generator.spk1.time_axis(time_bin))-1)
-        else:
-            length = 2*len(pairs_generator.spk1.time_axis(time_bin))
-        if not average:
-            results = numpy.zeros((N,length), float)
+        spk1   = pairs_generator.spk1
+        spk2   = pairs_generator.spk2
+        if spk1 is spk2:
+            hist, rows = spk1._id_histograms(pairs.ravel(), time_bin)
+            engine     = analysis.PairwiseCCF(hist)
+            rows       = rows.reshape(pairs.shape)
         else:
-            results = numpy.zeros(length, float)
-        for idx in xrange(N):
-            # We need to avoid empty spike histogram, otherwise the ccf function
-            # will give a nan vector
-            hist_1 = pairs_generator.spk1[pairs[idx,0]].time_histogram(time_bin)
-            hist_2 = pairs_generator.spk2[pairs[idx,1]].time_histogram(time_bin)
-            if not average:
-                from neurotools import analysis
-                results[idx,:] = analysis.ccf(hist_1,hist_2)
-            else:
-                from neurotools import analysis
-                results += analysis.ccf(hist_1,hist_2)
+            hist_1, rows_1 = spk1._id_histograms(pairs[:,0], time_bin)
+            hist_2, rows_2 = spk2._id_histograms(pairs[:,1], time_bin)
+            engine = analysis.PairwiseCCF(hist_1, hist_2)
+            rows   = numpy.column_stack((rows_1, rows_2))
+        logging.debug("pairwise_cc: %d pairs, memory budget of %d bytes" %(N, engine.memory_budget()))
+        results = engine.correlate(rows, average, pool)
         if not subplot or not HAVE_PYLAB:
-            if not average:
-                return results
-            else:
-                return results/N
+            return results
         else:
-            if average:
-                results = results/N
-            else:
+            if not average:
                 results = numpy.sum(results, axis=0)/N
             xaxis   = time_bin*numpy.arange(-len(results)/2, len(results)/2)
             xlabel  = "Time (ms)"
@@ -2244,10 +2384,10 @@ class SpikeList(object):
             nb_pairs        - int specifying the number of pairs
             pairs_generator - The generator that will be used to draw the pairs. If None, a default one is
                               created as RandomPairs(spk, spk, no_silent=False, no_auto=True)
-            dt              - The time bin used to discretized the spike times
+            dt              - not used anymore, the distance being computed exactly
         
         See also
-            RandomPairs, AutoPairs, CustomPairs
+            RandomPairs, AutoPairs, CustomPairs, distance_matrix
         """
         if pairs_generator is None:
             pairs_generator = RandomPairs(self, self, False, True)
@@ -2262,6 +2402,60 @@ class SpikeList(object):
             distance += pairs_generator.spk1[idx_1].distance_kreuz(pairs_generator.spk2[idx_2], dt)
         return distance/N
 
+    def distance_matrix(self, metric='victorpurpura', id_list=None, processes=1, **kwargs):
+        """
+        Return the matrix of the distances between all the pairs of SpikeTrains of the
+        SpikeList, the rows and columns being in the order of id_list. The pairs are 
+        split in blocks that can be computed in parallel by several processes.
+        
+        Inputs:
+            metric    - the name of the distance, i.e. a method SpikeTrain.distance_<metric>:
+                        'victorpurpura', 'isi' (or 'kreuz') or 'spike'
+            id_list   - the ids of the cells to use. Can be an int (and then N random cells 
+                        will be selected) or a list. If None, all the cells are used
+            processes - the number of processes used to compute the distances. If None, 
+                        one process per CPU is used
+            kwargs    - the extra parameters of the distance (cost, ...)
+        
+        Examples:
+            >> spklist.distance_matrix('victorpurpura', cost=0.2, processes=4)
+            >> spklist.distance_matrix('isi', id_list=range(10))
+        
+        See also
+            SpikeTrain.distance_victorpurpura, SpikeTrain.distance_isi, SpikeTrain.distance_spike
+        """
+        if not hasattr(SpikeTrain, "distance_%s" %metric):
+            raise Exception("The distance %s is not defined for SpikeTrains" %metric)
+        id_list    = self.__sub_id_list(id_list)
+        trains     = [self.spiketrains[id] for id in id_list]
+        N          = len(trains)
+        rows, cols = numpy.triu_indices(N, 1)
+        pairs      = zip(rows, cols)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        block  = max(1, int(numpy.ceil(len(pairs)/(4.*processes))))
+        tasks  = [(metric, pairs[i:i+block], kwargs) for i in xrange(0, len(pairs), block)]
+        if processes > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(processes, _init_distance_worker, (trains,))
+            try:
+                results = pool.map(_distance_block, tasks)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            _init_distance_worker(trains)
+            try:
+                results = map(_distance_block, tasks)
+            finally:
+                _init_distance_worker(None)
+        matrix = numpy.zeros((N, N))
+        if len(pairs) > 0:
+            matrix[rows, cols] = numpy.concatenate(results)
+        return matrix + matrix.T
+
     def mean_rate_variance(self, time_bin):
         """
         Return the standard deviation of the firing rate along time,
@@ -2353,14 +2547,14 @@ class SpikeList(object):
         """
         Return the psth of the cells contained in the SpikeList according to selected events, 
         on a time window t_spikes - tmin, t_spikes + tmax
-        Can return either the averaged psth (average = True), or an array of all the
-        psth triggered by all the spikes.
+        Without display, returns an array with the psth of every cell, averaged over the
+        events. When displayed, returns the psth averaged over the cells.
             
         Inputs:
             events  - Can be a SpikeTrain object (and events will be the spikes) or just a list 
                       of times
-            average - If True, return a single vector of the averaged waveform. If False, 
-                      return an array of all the waveforms.
+            average - Only used for the display. If True, plot the averaged psth with its
+                      standard deviation. If False, plot the psth of every cell.
             time_bin- The time bin (in ms) used to gather the spike for the psth
             t_min   - Time (>0) to average the signal before an event, in ms (default 0)
             t_max   - Time (>0) to average the signal after an event, in ms  (default 100)
@@ -2374,54 +2568,60 @@ class SpikeList(object):
             >> vm.psth(range(0,1000,10), average=False, display=True)
             
         See also
-            SpikeTrain.spike_histogram
-        """
-        
-        if isinstance(events, SpikeTrain):
-            events = events.spike_times
-        assert (t_min >= 0) and (t_max >= 0), "t_min and t_max should be greater than 0"
-        assert len(events) > 0, "events should not be empty and should contained at least one element"
-
-        spk_hist = self.spike_histogram(time_bin)
-        subplot  = get_display(display)
-        count    = 0
-        t_min_l  = numpy.floor(t_min/time_bin)
-        t_max_l  = numpy.floor(t_max/time_bin)
-        result   = numpy.zeros((len(self), t_min_l+t_max_l), numpy.float32)
-        t_start  = numpy.floor(self.t_start/time_bin)
-        t_stop   = numpy.floor(self.t_stop/time_bin)
-
-        for ev in events:
-           ev = numpy.floor(ev/time_bin)
-           if ((ev - t_min_l )> t_start) and (ev + t_max_l ) < t_stop:               
-               count  += 1
-               result += spk_hist[:,(ev-t_start-t_min_l):ev-t_start+t_max_l]
-        result /= count
+            SpikeTrain.spike_histogram, psth_counts
+        """
+        counts, events = self.psth_counts(events, time_bin, t_min, t_max)
+        subplot = get_display(display)
+        result  = numpy.mean(counts, 1)
             
         if not subplot or not HAVE_PYLAB:
             return result
         else:
             xlabel = "Time (ms)"
             ylabel = "PSTH"
-            time   = numpy.linspace(-t_min, t_max, (t_min+t_max)/time_bin)
+            time   = time_bin*numpy.arange(-numpy.floor(t_min/time_bin), numpy.floor(t_max/time_bin))
             set_labels(subplot, xlabel, ylabel)
             if average:
-                subplot.plot(time, result, **kwargs)
-                subplot.errorbar(times, mean(result, 0), yerr=std(result, 0))
+                subplot.errorbar(time, numpy.mean(result, 0), yerr=numpy.std(result, 0), **kwargs)
             else:
                 for idx in xrange(len(result)):
                     subplot.plot(time, result[idx,:], c='0.5', **kwargs)
                     subplot.hold(1)
-                result = numpy.mean(result, 0)
-                subplot.plot(time, result, c='k', **kwargs)
+                subplot.plot(time, numpy.mean(result, 0), c='k', **kwargs)
             xmin, xmax, ymin, ymax = subplot.axis()
             subplot.plot([0,0],[ymin, ymax], c='r')
             set_axis_limits(subplot, -t_min, t_max, ymin, ymax)
             pylab.draw()
-        if average:
-            result = numpy.mean(result, 0)
-        return result
+        return numpy.mean(result, 0)
 
+    def psth_counts(self, events, time_bin=2, t_min=50, t_max=50):
+        """
+        Return the spike counts of every cell around every event, as a tensor of shape
+        (len(self), nb_events, nb_bins), together with the times of the events that
+        were kept. Events whose window [t_event - t_min, t_event + t_max] does not fit
+        between t_start and t_stop are discarded. The windows of all the events are 
+        found with a single binary search per cell, and all the spike times relative 
+        to the events are binned at once.
+        
+        Inputs:
+            events  - Can be a SpikeTrain object (and events will be the spikes) or just a list 
+                      of times
+            time_bin- The time bin (in ms) used to gather the spike for the psth
+            t_min   - Time (>0) before an event, in ms. Rounded down to a multiple of time_bin
+            t_max   - Time (>0) after an event, in ms. Rounded down to a multiple of time_bin
+        
+        Examples:
+            >> counts, events = spklist.psth_counts(range(100,1000,100), time_bin=5)
+            >> counts.shape
+                (len(spklist), 9, 20)
+            >> mean, lower, upper = analysis.bootstrap_psth(counts)
+        
+        See also
+            psth, neurotools.analysis.bootstrap_psth
+        """
+        events, edges = _psth_windows(events, time_bin, t_min, t_max, self.t_start, self.t_stop)
+        trains        = [self.spiketrains[id].spike_times for id in self.id_list]
+        return _event_counts(trains, events, edges), events
 
 
     def activity_movie(self, time_bin=10, t_start=None, t_stop=None, float_positions=None, output="animation.mpg", bounds=(0,5), fps=10, display=True, kwargs={}):
@@ -2630,12 +2830,7 @@ class SpikeList(object):
         """
         is_times = re.compile("times")
         is_ids   = re.compile("ids")
-        if len(self) > 0:
-            times  = numpy.concatenate([st.format(relative, quantized) for st in self.spiketrains.itervalues()])
-            ids    = numpy.concatenate([id*numpy.ones(len(st.spike_times), int) for id,st in self.spiketrains.iteritems()])
-        else:
-            times = []
-            ids   = []
+        times, ids = self._flat_spikes(relative, quantized)
         if is_times.search(format):
             if is_ids.search(format):
                 return eval(format)
@@ -2652,6 +2847,18 @@ class SpikeList(object):
                 raise Exception("You must have a format with [times, ids] or [time, id]")
             return result
 
+    def _flat_spikes(self, relative=False, quantized=False):
+        """
+        Return two arrays (times, ids) with all the spikes of the SpikeList,
+        formatted as in SpikeTrain.format(). Used by convert()
+        """
+        if len(self) > 0:
+            times  = numpy.concatenate([st.format(relative, quantized) for st in self.spiketrains.itervalues()])
+            ids    = numpy.concatenate([id*numpy.ones(len(st.spike_times), int) for id,st in self.spiketrains.iteritems()])
+        else:
+            times = []
+            ids   = []
+        return times, ids
 
     def raw_data(self):
         """
@@ -2674,13 +2881,628 @@ class SpikeList(object):
 
 
 
+#############################################################
+## Kernel convolution of sparse events, used by the 
+## instantaneous rate estimators
+#############################################################
+
+def _convolve_events(indices, values, size, kernel):
+    """
+    Return the full convolution (of length size + len(kernel) - 1) between the kernel
+    and a vector of length size which is zero everywhere except at the given indices,
+    where it equals values.
+    
+    When the events are sparse, the kernel is directly scatter-added at each event
+    (by blocks, to bound the memory), otherwise the dense vector is built and 
+    convolved with an FFT. The costs of both methods are compared to choose.
+    """
+    K      = len(kernel)
+    n_full = size + K - 1
+    if len(indices)*K > 4*n_full*numpy.log2(max(n_full, 2)):
+        vector = numpy.zeros(size)
+        vector[indices] = values
+        return scipy.signal.fftconvolve(vector, kernel, 'full')
+    result = numpy.zeros(n_full)
+    block  = max(1, 2**20 // K)
+    offset = numpy.arange(K)
+    for i in xrange(0, len(indices), block):
+        idx     = indices[i:i+block]
+        weights = numpy.outer(values[i:i+block], kernel)
+        result += numpy.bincount((idx[:, None] + offset).ravel(), weights.ravel(), minlength=n_full)
+    return result
+
+def _kernel_rate_output(r, kernel, m_idx, t_start, t_stop, resolution, acausal, trim):
+    """
+    Align the full convolution r on the time axis, as described in 
+    SpikeTrain.instantaneous_rate, and return (t_axis, rate)
+    """
+    if acausal is True:
+        if trim is False:
+            r = r[m_idx:-(kernel.size - m_idx)]
+            t_axis = numpy.linspace(t_start, t_stop, r.size)
+            return t_axis, r
+        
+        elif trim is True:
+            r = r[2 * m_idx:-2*(kernel.size - m_idx)]
+            t_start = t_start + m_idx * resolution
+            t_stop = t_stop - ((kernel.size) - m_idx) * resolution
+            t_axis = numpy.linspace(t_start, t_stop, r.size)
+            return t_axis, r
+        
+    if acausal is False:
+        if trim is False:
+            r = r[m_idx:-(kernel.size - m_idx)]
+            t_axis = (numpy.linspace(t_start, t_stop, r.size) +
+                      m_idx * resolution)
+            return t_axis, r
+        
+        elif trim is True:
+            r = r[2 * m_idx:-2*(kernel.size - m_idx)]
+            t_start = t_start + m_idx * resolution
+            t_stop = t_stop - ((kernel.size) - m_idx) * resolution
+            t_axis = (numpy.linspace(t_start, t_stop, r.size) +
+                      m_idx * resolution)
+            return t_axis, r
+
+
+#############################################################
+## Workers used by SpikeList.distance_matrix, to compute the
+## distances of blocks of pairs in separate processes
+#############################################################
+
+_distance_trains = None
+
+def _init_distance_worker(trains):
+    global _distance_trains
+    _distance_trains = trains
+
+def _distance_block(args):
+    metric, pairs, kwargs = args
+    distance = getattr(SpikeTrain, "distance_%s" %metric)
+    return [distance(_distance_trains[i], _distance_trains[j], **kwargs) for i, j in pairs]
+
+
+#############################################################
+## Columnar storage of a SpikeList. All the spikes are kept
+## in a single array, sorted by id and then by time
+#############################################################
+
+def _segment_indices(starts, stops):
+    """
+    Return the concatenation of the ranges [starts[i], stops[i]) as a single
+    array of indices.
+    """
+    starts  = numpy.asarray(starts, int)
+    lengths = numpy.asarray(stops, int) - starts
+    shifts  = numpy.cumsum(lengths) - lengths
+    return numpy.repeat(starts - shifts, lengths) + numpy.arange(lengths.sum())
+
+
+def _psth_windows(events, time_bin, t_min, t_max, t_start, t_stop):
+    """
+    Return the events whose window [t_event - t_min, t_event + t_max] fits between 
+    t_start and t_stop, and the edges of the psth bins relative to the events. t_min
+    and t_max are rounded down to a multiple of time_bin.
+    """
+    if isinstance(events, SpikeTrain):
+        events = events.spike_times
+    assert (t_min >= 0) and (t_max >= 0), "t_min and t_max should be greater than 0"
+    assert len(events) > 0, "events should not be empty and should contained at least one element"
+    edges  = time_bin*numpy.arange(-numpy.floor(t_min/time_bin), numpy.floor(t_max/time_bin)+1)
+    events = numpy.asarray(events, float)
+    valid  = (events + edges[0] >= t_start) & (events + edges[-1] <= t_stop)
+    return events[valid], edges
+
+def _event_counts(trains, events, edges):
+    """
+    Return a (len(trains), len(events), len(edges)-1) array with the number of spikes
+    of every sorted train in each bin of edges, taken relatively to every event. The
+    windows are found with one binary search per train, and all the relative times
+    are then binned and counted at once.
+    """
+    nb_events, nb_bins = len(events), len(edges) - 1
+    if len(trains) == 0 or nb_events == 0 or nb_bins <= 0:
+        return numpy.zeros((len(trains), nb_events, max(nb_bins, 0)), int)
+    bounds  = numpy.concatenate((events + edges[0], events + edges[-1]))
+    rel, keys = [], []
+    for row, train in enumerate(trains):
+        starts, stops = numpy.split(numpy.searchsorted(train, bounds, 'left'), 2)
+        trial   = numpy.repeat(numpy.arange(nb_events), stops - starts)
+        rel.append(train[_segment_indices(starts, stops)] - events[trial])
+        keys.append(row*nb_events + trial)
+    rel     = numpy.concatenate(rel)
+    bins    = numpy.clip(numpy.searchsorted(edges, rel, 'right') - 1, 0, nb_bins - 1)
+    keys    = numpy.concatenate(keys)*nb_bins + bins
+    counts  = numpy.bincount(keys, minlength=len(trains)*nb_events*nb_bins)
+    return counts.reshape(len(trains), nb_events, nb_bins)
+
+
+class _SpikeTrainViews(object):
+    """
+    Dictionary-like access to the SpikeTrains of a CompactSpikeList. The SpikeTrain
+    objects are only created when requested, as views on the shared array of spike
+    times, so modifying their spike times in place modifies the CompactSpikeList.
+    """
+    def __init__(self, spklist):
+        self._spklist = spklist
+
+    def __len__(self):
+        return len(self._spklist)
+
+    def __contains__(self, id):
+        return self._spklist._index(id) is not None
+
+    has_key = __contains__
+
+    def __getitem__(self, id):
+        idx = self._spklist._index(id)
+        if idx is None:
+            raise KeyError(id)
+        return self._spklist._train(idx)
+
+    def __setitem__(self, id, spktrain):
+        self._spklist._set_spike_times(id, spktrain.spike_times)
+
+    def __delitem__(self, id):
+        if self._spklist._index(id) is None:
+            raise KeyError(id)
+        self._spklist._remove(id)
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def pop(self, id):
+        spktrain = self[id].copy()
+        del self[id]
+        return spktrain
+
+    def keys(self):
+        return list(self._spklist._ids)
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def iterkeys(self):
+        return iter(self._spklist._ids.copy())
+
+    def itervalues(self):
+        for idx in xrange(len(self._spklist._ids)):
+            yield self._spklist._train(idx)
+
+    def iteritems(self):
+        for idx, id in enumerate(self._spklist._ids.copy()):
+            yield id, self._spklist._train(idx)
+
+
+class CompactSpikeList(SpikeList):
+    """
+    CompactSpikeList(spikes, id_list, t_start=None, t_stop=None, dims=None)
+    
+    Return a SpikeList object storing all its spikes in flat arrays, instead of
+    one SpikeTrain object per cell: a single array of spike times (sorted by id,
+    then by time), the sorted array of ids and an array of offsets such that the 
+    spikes of the i-th cell are times[offsets[i]:offsets[i+1]].
+    
+    It has the same interface as a SpikeList, but is much lighter in memory for
+    large populations, and the population methods (mean_rates, spike_histogram,
+    isi, id_slice, time_slice, convert, ...) work directly on the flat arrays. 
+    SpikeTrain objects are created on demand, and share their spike times with 
+    the CompactSpikeList.
+
+    Inputs:
+        spikes  - a list or an array of (id,time) tuples (id being in id_list)
+        id_list - the list of the ids of all recorded cells (needed for silent cells)
+        t_start - begining of the SpikeList, in ms. If None, will be infered from the data
+        t_stop  - end of the SpikeList, in ms. If None, will be infered from the data
+        dims    - dimensions of the recorded population, if not 1D population
+    
+    Examples:
+        >> sl = CompactSpikeList([(0, 0.1), (1, 0.1), (0, 0.2)], range(2))
+        >> sl[0].spike_times
+            [ 0.1, 0.2]
+        >> sl.mean_rates()
+    
+    See also
+        SpikeList, load_spikelist
+    """
+    def __init__(self, spikes, id_list, t_start=None, t_stop=None, dims=None):
+        """
+        Constructor of the CompactSpikeList object
+
+        See also
+            CompactSpikeList, SpikeList
+        """
+        self.t_start    = t_start
+        self.t_stop     = t_stop
+        self.dimensions = dims
+        id_list         = numpy.unique(numpy.asarray(id_list, int))
+        
+        if not isinstance(spikes, numpy.ndarray):
+            spikes = numpy.array(spikes, float)
+        if len(spikes) > 0:
+            ids, times = self.__select(spikes[:, 0], spikes[:, 1], id_list)
+        else:
+            ids, times = numpy.zeros(0, int), numpy.zeros(0, numpy.float32)
+        self.__build(ids, times, id_list)
+    
+    @classmethod
+    def from_chunks(cls, chunks, id_list=None, t_start=None, t_stop=None, dims=None):
+        """
+        Build a CompactSpikeList from an iterable of (ids, times) blocks, for example
+        the generator returned by StandardTextFile.iter_spikes(). Each block is filtered
+        as soon as it is read, so that only the selected spikes are kept in memory.
+        
+        Inputs:
+            chunks  - an iterable of (ids, times) arrays
+            id_list - the list of the ids of all recorded cells. If None, the ids 
+                      of the active cells are used
+            t_start - begining of the SpikeList, in ms. If None, will be infered from the data
+            t_stop  - end of the SpikeList, in ms. If None, will be infered from the data
+            dims    - dimensions of the recorded population, if not 1D population
+        
+        Examples:
+            >> chunks = StandardTextFile("spikes.dat").iter_spikes(10**6)
+            >> spklist = CompactSpikeList.from_chunks(chunks, range(1000), 0, 5000)
+        
+        See also
+            load_spikelist
+        """
+        spklist            = cls.__new__(cls)
+        spklist.t_start    = t_start
+        spklist.t_stop     = t_stop
+        spklist.dimensions = dims
+        if id_list is not None:
+            id_list = numpy.unique(numpy.asarray(id_list, int))
+        all_ids, all_times = [numpy.zeros(0, int)], [numpy.zeros(0, numpy.float32)]
+        for ids, times in chunks:
+            ids, times = spklist.__select(ids, times, id_list, sort=False)
+            all_ids.append(ids)
+            all_times.append(times)
+        ids, times = numpy.concatenate(all_ids), numpy.concatenate(all_times)
+        del all_ids, all_times
+        if id_list is None:
+            id_list = numpy.unique(ids)
+        order = numpy.lexsort((times, ids))
+        spklist.__build(ids[order], times[order], id_list)
+        return spklist
+    
+    def __select(self, ids, times, id_list, sort=True):
+        """
+        Keep only the spikes whose id is in id_list (if not None) and within the
+        [t_start, t_stop] window, and return them sorted by id and time.
+        """
+        ids   = numpy.asarray(ids).astype(int)
+        times = numpy.asarray(times).astype(numpy.float32)
+        mask  = numpy.ones(len(ids), bool)
+        if id_list is not None:
+            mask[:] = False
+            if len(id_list) > 0:
+                pos  = numpy.minimum(numpy.searchsorted(id_list, ids), len(id_list)-1)
+                mask = id_list[pos] == ids
+        if self.t_start is not None:
+            mask &= (times >= self.t_start)
+        if self.t_stop is not None:
+            mask &= (times <= self.t_stop)
+        ids, times = ids[mask], times[mask]
+        if sort:
+            order      = numpy.lexsort((times, ids))
+            ids, times = ids[order], times[order]
+        return ids, times
+    
+    def __build(self, ids, times, id_list):
+        """
+        Set the flat arrays from spikes sorted by id and time, and infer the time 
+        parameters if needed
+        """
+        self._times   = times
+        self._ids     = id_list
+        self._offsets = numpy.concatenate((numpy.searchsorted(ids, id_list), [len(ids)]))
+        if len(self) > 0:
+            self.__calc_startstop()
+    
+    @classmethod
+    def _from_arrays(cls, times, ids, offsets, t_start, t_stop, dims=None):
+        """
+        Build a CompactSpikeList directly from its flat arrays, without any check
+        """
+        spklist            = cls.__new__(cls)
+        spklist.t_start    = t_start
+        spklist.t_stop     = t_stop
+        spklist.dimensions = dims
+        spklist._times     = times
+        spklist._ids       = ids
+        spklist._offsets   = offsets
+        return spklist
+    
+    def __calc_startstop(self):
+        """
+        Infer t_start and t_stop from the data, if needed, following the same rules 
+        as a SpikeList made of independant SpikeTrains. Then check the spike times.
+        """
+        counts   = numpy.diff(self._offsets)
+        nonempty = counts > 0
+        if self.t_start is None:
+            starts           = numpy.zeros(len(counts), numpy.float32)
+            starts[nonempty] = self._times[self._offsets[:-1][nonempty]]
+            self.t_start     = numpy.min(starts)
+            logging.debug("Warning, t_start is infered from the data : %f" %self.t_start)
+        if self.t_stop is None:
+            stops           = 0.1*numpy.ones(len(counts), numpy.float32)
+            stops[nonempty] = self._times[self._offsets[1:][nonempty]-1]
+            stops[counts == 1] += 0.1
+            self.t_stop     = numpy.max(stops)
+            logging.debug("Warning, t_stop  is infered from the data : %f" %self.t_stop)
+        if len(self._times) > 0 and self._times.min() < 0:
+            raise ValueError("Spike times must not be negative")
+        if self.t_start >= self.t_stop:
+            raise Exception("Incompatible time interval : t_start = %s, t_stop = %s" % (self.t_start, self.t_stop))
+    
+    def _index(self, id):
+        """
+        Return the position of id in the sorted id_list, or None if absent
+        """
+        idx = numpy.searchsorted(self._ids, id)
+        if idx < len(self._ids) and self._ids[idx] == id:
+            return idx
+        return None
+    
+    def _train(self, idx):
+        """
+        Return the SpikeTrain of the cell at position idx, as a view
+        """
+        spikes = self._times[self._offsets[idx]:self._offsets[idx+1]]
+        return SpikeTrain.from_sorted(spikes, self.t_start, self.t_stop)
+    
+    def _set_spike_times(self, id, spike_times):
+        """
+        Replace (or add, if id is not present) the spike times of a cell
+        """
+        spike_times = numpy.sort(numpy.asarray(spike_times, numpy.float32))
+        idx         = self._index(id)
+        if idx is None:
+            idx         = numpy.searchsorted(self._ids, id)
+            self._ids   = numpy.insert(self._ids, idx, id)
+            start       = self._offsets[idx]
+            self._offsets = numpy.insert(self._offsets, idx, start)
+            stop        = start
+        else:
+            start, stop = self._offsets[idx], self._offsets[idx+1]
+        self._times = numpy.concatenate((self._times[:start], spike_times, self._times[stop:]))
+        self._offsets[idx+1:] += len(spike_times) - (stop - start)
+    
+    def _remove(self, id):
+        idx           = self._index(id)
+        start, stop   = self._offsets[idx], self._offsets[idx+1]
+        self._times   = numpy.concatenate((self._times[:start], self._times[stop:]))
+        self._ids     = numpy.delete(self._ids, idx)
+        self._offsets = numpy.delete(self._offsets, idx+1)
+        self._offsets[idx+1:] -= stop - start
+    
+    @property
+    def spiketrains(self):
+        """
+        Dictionary-like object giving access to the SpikeTrains, by id
+        """
+        return _SpikeTrainViews(self)
+    
+    @property
+    def id_list(self):
+        """ 
+        Return the sorted list of all the cells ids contained in the
+        CompactSpikeList object
+        """
+        return self._ids.copy()
+    
+    def copy(self):
+        """
+        Return a copy of the CompactSpikeList object
+        """
+        return self._from_arrays(self._times.copy(), self._ids.copy(), self._offsets.copy(),
+                                 self.t_start, self.t_stop, self.dimensions)
+    
+    def __getitem__(self, id):
+        idx = self._index(id)
+        if idx is None:
+            raise Exception("id %d is not present in the SpikeList. See id_list" %id)
+        return self._train(idx)
+    
+    def __setitem__(self, id, spktrain):
+        assert isinstance(spktrain, SpikeTrain), "A SpikeList object can only contain SpikeTrain objects"
+        self._set_spike_times(id, spktrain.spike_times)
+    
+    def __iter__(self):
+        return self.spiketrains.itervalues()
+    
+    def __len__(self):
+        return len(self._ids)
+    
+    def append(self, id, spktrain):
+        """
+        Add a SpikeTrain object to the CompactSpikeList. The spike times are copied
+        and sliced according to the t_start and t_stop times of the CompactSpikeList
+        
+        See also
+            SpikeList.append
+        """
+        assert isinstance(spktrain, SpikeTrain), "A SpikeList object can only contain SpikeTrain objects"
+        if self._index(id) is not None:
+            raise Exception("id %d already present in SpikeList. Use __setitem__ (spk[id]=...) instead()" %id)
+        spikes = spktrain.spike_times
+        if self.t_start is not None:
+            spikes = spikes[spikes >= self.t_start]
+        if self.t_stop is not None:
+            spikes = spikes[spikes <= self.t_stop]
+        self._set_spike_times(id, spikes)
+    
+    def merge(self, spikelist, relative=False):
+        """
+        For each cell id in spikelist that matches an id in this CompactSpikeList,
+        merge the two SpikeTrains. SpikeTrains with other ids are appended.
+        
+        See also
+            SpikeList.merge
+        """
+        for id, spiketrain in spikelist.spiketrains.items():
+            idx = self._index(id)
+            if idx is not None:
+                spktrain = self._train(idx).copy()
+                spktrain.merge(spiketrain, relative)
+                self._set_spike_times(id, spktrain.spike_times)
+            else:
+                if relative:
+                    spiketrain.relative_times()
+                self.append(id, spiketrain)
+    
+    def complete(self, id_list):
+        """
+        Complete the CompactSpikeList by adding empty SpikeTrains for all the ids 
+        of id_list that are not already in the CompactSpikeList
+        
+        See also
+            SpikeList.complete
+        """
+        ids           = numpy.union1d(self._ids, numpy.asarray(id_list, int))
+        counts        = numpy.zeros(len(ids), int)
+        counts[numpy.searchsorted(ids, self._ids)] = numpy.diff(self._offsets)
+        self._ids     = ids
+        self._offsets = numpy.concatenate(([0], numpy.cumsum(counts)))
+    
+    def id_slice(self, id_list):
+        """
+        Return a new CompactSpikeList obtained by selecting particular ids
+        
+        Inputs:
+            id_list - Can be an integer (and then N random cells will be selected)
+                      or a sublist of the current ids
+        
+        See also
+            SpikeList.id_slice, time_slice
+        """
+        id_list = numpy.unique(numpy.asarray(self._SpikeList__sub_id_list(id_list), int))
+        pos     = numpy.searchsorted(self._ids, id_list)
+        valid   = pos < len(self._ids)
+        valid[valid] = self._ids[pos[valid]] == id_list[valid]
+        if not valid.all():
+            logging.debug("ids %s are not in the source SpikeList" %id_list[~valid])
+        pos     = pos[valid]
+        starts, stops = self._offsets[pos], self._offsets[pos+1]
+        times   = self._times[_segment_indices(starts, stops)]
+        offsets = numpy.concatenate(([0], numpy.cumsum(stops - starts)))
+        return self._from_arrays(times, self._ids[pos], offsets, self.t_start, self.t_stop, self.dimensions)
+    
+    def time_slice(self, t_start, t_stop):
+        """
+        Return a new CompactSpikeList obtained by slicing between t_start and t_stop
+        
+        See also
+            SpikeList.time_slice, id_slice
+        """
+        if t_start >= t_stop:
+            raise ValueError("Incompatible time interval : t_start = %s, t_stop = %s" % (t_start, t_stop))
+        mask    = (self._times >= t_start) & (self._times <= t_stop)
+        kept    = numpy.concatenate(([0], numpy.cumsum(mask)))
+        return self._from_arrays(self._times[mask], self._ids.copy(), kept[self._offsets], 
+                                 t_start, t_stop, self.dimensions)
+    
+    def time_offset(self, offset):
+        """
+        Add an offset to the whole CompactSpikeList object. t_start and t_stop are
+        shifted from offset, so does all the spike times. The spike times are 
+        rebuilt, so the SpikeTrains previously returned are not modified.
+        """
+        self.t_start += offset
+        self.t_stop  += offset
+        self._times   = self._times + offset
+    
+    def id_offset(self, offset):
+        """
+        Add an offset to the whole CompactSpikeList object. All the id are shifted
+        according to an offset value.
+        """
+        self._ids = self._ids + offset
+    
+    def first_spike_time(self):
+        """
+        Get the time of the first real spike in the CompactSpikeList
+        """
+        counts = numpy.diff(self._offsets)
+        if len(self._times) == 0:
+            return self.t_start
+        return self._times[self._offsets[:-1][counts > 0]].min()
+    
+    def last_spike_time(self):
+        """
+        Get the time of the last real spike in the CompactSpikeList
+        """
+        counts = numpy.diff(self._offsets)
+        if len(self._times) == 0:
+            return self.t_stop
+        return self._times[self._offsets[1:][counts > 0]-1].max()
+    
+    def isi(self):
+        """
+        Return the list of all the isi vectors for all the cells within the
+        CompactSpikeList, in the order of id_list.
+        """
+        keep         = numpy.ones(max(len(self._times)-1, 0), bool)
+        boundaries   = self._offsets[1:-1] - 1
+        boundaries   = boundaries[(boundaries >= 0) & (boundaries < len(keep))]
+        keep[boundaries] = False
+        isis         = numpy.diff(self._times)[keep]
+        sizes        = numpy.maximum(numpy.diff(self._offsets) - 1, 0)
+        return numpy.split(isis, numpy.cumsum(sizes)[:-1])
+    
+    def mean_rates(self, t_start=None, t_stop=None):
+        """ 
+        Returns a vector of the size of id_list giving the mean firing rate for each neuron
+
+        Inputs:
+            t_start - begining of the selected area, in ms
+            t_stop  - end of the selected area, in ms
+        
+        See also
+            SpikeList.mean_rates
+        """
+        if t_start is None and t_stop is None:
+            t_start, t_stop = self.t_start, self.t_stop
+            counts = numpy.diff(self._offsets)
+        else:
+            if t_start is None:
+                t_start = self.t_start
+            if t_stop is None:
+                t_stop  = self.t_stop
+            t_start = max(t_start, self.t_start)
+            t_stop  = min(t_stop, self.t_stop)
+            inside  = (self._times >= t_start) & (self._times <= t_stop)
+            counts  = numpy.diff(numpy.concatenate(([0], numpy.cumsum(inside)))[self._offsets])
+        return 1000.*counts/(t_stop - t_start)
+    
+    def _flat_rows(self):
+        return self._times, numpy.repeat(numpy.arange(len(self)), numpy.diff(self._offsets))
+    
+    def _flat_spikes(self, relative=False, quantized=False):
+        times = self._times.copy()
+        if relative and len(times) > 0:
+            first        = numpy.zeros(len(times), bool)
+            first[self._offsets[:-1][numpy.diff(self._offsets) > 0]] = True
+            times[1:]    = numpy.where(first[1:], times[1:], times[1:] - times[:-1])
+        if quantized:
+            assert quantized > 0, "quantized must either be False or a positive number"
+            times = (times/quantized).round().astype('int')
+        ids = numpy.repeat(self._ids, numpy.diff(self._offsets))
+        return times, ids
+
+
 #############################################################
 ## Object Loaders. Functions used to create neurotools
 ## objects from data generated by pyNN (the most simple form
 ## supported right now)
 #############################################################
 
-def load_spikelist(user_file, id_list=None, t_start=None, t_stop=None, dims=None):
+def load_spikelist(user_file, id_list=None, t_start=None, t_stop=None, dims=None, chunksize=None):
     """
     Returns a SpikeList object from a file. If the file has been generated by PyNN, 
     a header should be found with following parameters:
@@ -2696,13 +3518,19 @@ def load_spikelist(user_file, id_list=None, t_start=None, t_stop=None, dims=None
         dims     - if the cells were aranged on a 2/3D grid, a tuple with the dimensions
         t_start  - begining of the simulation, in ms.
         t_stop   - end of the simulation, in ms
+        chunksize - for text files, if not None, the file is read by blocks of chunksize
+                   spikes and a CompactSpikeList is built incrementally, to keep the memory
+                   usage close to the size of the final object
 
     If dims, t_start, t_stop or id_list are None, they will be infered from either 
     the data or from the header. All times are in milliseconds. 
     The format of the file (text, pickle) will be inferred automatically
+    
+    Examples:
+        >> load_spikelist("spikes.gdf", chunksize=10**6)
     """
     spike_loader = DataHandler(user_file)
-    return spike_loader.load_spikes(id_list=id_list, t_start=t_start, t_stop=t_stop, dims=dims)
+    return spike_loader.load_spikes(id_list=id_list, t_start=t_start, t_stop=t_stop, dims=dims, chunksize=chunksize)
 
 
 def load(user_file, datatype):
@@ -86,18 +86,16 @@ class Channel(numpy.ndarray):
             print 'please give a threhold'
             return 0
         
-        above = numpy.where(self > threshold)[0]
-        take = (numpy.diff(above))>1.
-        take[0] = True
+        rows, onsets = signals.analogs._threshold_crossings(numpy.asarray(self)[None,:], threshold)
         
         time = self.time(timeunits=timeunits)
-        self.events = time[above][take]
+        self.events = time[onsets]
         if return_events:
             return self.events
         if return_SpikeTrain:
             if timeunits is not 'milliseconds':
                 time = self.time(timeunits='milliseconds')
-                events = time[above][take]
+                events = time[onsets]
                 return signals.SpikeTrain(events)
             else:
                 return signals.SpikeTrain(self.events)
@@ -17,14 +17,17 @@ Functions
 
 shotnoise_fromspikes - Convolves the provided spike train with shot decaying exponential.
 
+shotnoise_fromspikelist - Same for all the spike trains of a SpikeList, returned as a ConductanceList.
+
 gamma_hazard - Compute the hazard function for a gamma process with parameters a,b.
 """
 
 
 from neurotools import check_dependency
-from signals import SpikeTrain, AnalogSignal
+from signals import SpikeTrain, AnalogSignal, AnalogSignalList, CompactSpikeList, ConductanceList
 from numpy import array, log
-import numpy
+import numpy, multiprocessing
+import scipy.signal
 
 
 def gamma_hazard_scipy(x, a, b, dt=1e-4):
@@ -119,6 +122,79 @@ def gamma_hazard(x, a, b, dt=1e-4):
 
     
 
+def _gamma_hazard_array(x, a, b):
+    """
+    Vectorized hazard function of gamma processes with parameters a,b (see
+    gamma_hazard), computed as the ratio of the PDF and of the survival function
+    in log space, without RPy. Where the survival function underflows, the hazard
+    has reached its asymptotic value 1/b.
+
+    Inputs:
+        x   - in units of seconds
+        a   - dimensionless
+        b   - in units of seconds
+    """
+    from scipy.special import gammaincc, gammaln, xlogy
+    logpdf = xlogy(a-1, x) - x/b - gammaln(a) - a*numpy.log(b)
+    sf     = gammaincc(a, x/b)
+    old    = numpy.seterr(divide='ignore', invalid='ignore', over='ignore')
+    try:
+        val = numpy.exp(logpdf - numpy.log(sf))
+    finally:
+        numpy.seterr(**old)
+    return numpy.where(sf > 0, val, 1.0/b)
+
+
+def _ou_filter(gauss, y0, mfac):
+    """
+    Return the solution of y[i] = y[i-1]*mfac + gauss[i-1] with y[0] = y0, along the
+    last axis of gauss (with one more sample), computed as an AR(1) filter.
+    """
+    y0 = numpy.asarray(y0, float)
+    zi = (mfac*y0)[..., None]
+    y  = numpy.empty(gauss.shape[:-1]+(gauss.shape[-1]+1,))
+    y[..., 0] = y0
+    y[..., 1:], zf = scipy.signal.lfilter([1.0], [1.0, -mfac], gauss, axis=-1, zi=zi)
+    return y
+
+
+def _population_size(t, n, *params):
+    """
+    Check the shapes of the parameters of inhomogeneous processes, either shared 
+    by all the processes (same shape as t) or given for each of them (one row per 
+    process), and return the number of processes.
+    """
+    n_rows = set()
+    for values in params:
+        values = numpy.asarray(values)
+        if values.ndim > 2 or values.shape[-1:] != numpy.shape(t):
+            raise ValueError('shape mismatch: t and the parameters must be of the same shape')
+        if values.ndim == 2:
+            n_rows.add(len(values))
+    if n is None:
+        n = n_rows and n_rows.pop() or 1
+    if len(n_rows) > 1 or (n_rows and n not in n_rows):
+        raise ValueError('shape mismatch: the parameters must have one row per process')
+    return n
+
+
+def _process_values(values, rows, idx):
+    """
+    Values of the parameter of the processes rows in the time bins idx, for
+    parameters shared by all the processes (1D) or given for each of them (2D)
+    """
+    if values.ndim == 1:
+        return values[idx]
+    return values[rows, idx]
+
+
+def _process_max(values, n):
+    """Maximal value of a parameter for each of the n processes"""
+    if values.ndim == 1:
+        return values.max()*numpy.ones(n)
+    return values.max(axis=1)
+
+
 class StGen:
 
     def __init__(self, rng=None, seed=None):
@@ -158,10 +234,22 @@ class StGen:
         inh_2Dadaptingmarkov_generator - inhomogeneous adapting and 
         refractory markov process (time varying)
 
+        Populations of spiking point processes:
+        ---------------------------------------
+
+        poisson_population - independent homogeneous Poisson processes
+        gamma_population - independent homogeneous Gamma processes
+        inh_poisson_population - independent inhomogeneous Poisson processes
+        inh_gamma_population - independent inhomogeneous Gamma processes
+        inh_adaptingmarkov_population - independent inhomogeneous adapting markov processes
+        inh_2Dadaptingmarkov_population - independent inhomogeneous adapting and
+        refractory markov processes
+
         Continuous time processes:
         --------------------------
 
         OU_generator - Ohrnstein-Uhlenbeck process
+        OU_population - independent Ohrnstein-Uhlenbeck processes
         
 
         See also:
@@ -176,7 +264,6 @@ class StGen:
 
         if seed != None:
             self.rng.seed(seed)
-        self.rpy_checked = False
 
     def seed(self,seed):
         """ seed the gsl rng with a given seed """
@@ -246,7 +333,7 @@ class StGen:
             spikes = numpy.resize(spikes,(i,))
 
         if not array:
-            spikes = SpikeTrain(spikes, t_start=t_start,t_stop=t_stop)
+            spikes = SpikeTrain.from_sorted(spikes, t_start=t_start,t_stop=t_stop)
 
 
         if debug:
@@ -318,7 +405,7 @@ class StGen:
             spikes = numpy.resize(spikes,(i,))
 
         if not array:
-            spikes = SpikeTrain(spikes, t_start=t_start,t_stop=t_stop)
+            spikes = SpikeTrain.from_sorted(spikes, t_start=t_start,t_stop=t_stop)
 
 
         if debug:
@@ -372,7 +459,7 @@ class StGen:
             if array:
                 return numpy.array([])
             else:
-                return SpikeTrain(numpy.array([]), t_start=t[0],t_stop=t_stop)
+                return SpikeTrain.from_sorted(numpy.array([]), t_start=t[0],t_stop=t_stop)
         
         # gen uniform rand on 0,1 for each spike
         rn = numpy.array(self.rng.uniform(0, 1, len(ps)))
@@ -388,9 +475,269 @@ class StGen:
         if array:
             return spike_train
 
-        return SpikeTrain(spike_train, t_start=t[0],t_stop=t_stop)
+        return SpikeTrain.from_sorted(spike_train, t_start=t[0],t_stop=t_stop)
+
+
+
+    def _renewal_population(self, draw, rates, t_start, t_stop):
+        """
+        Draw the spikes of len(rates) independent renewal processes, and return them
+        as (times, rows) arrays sorted by row, then by time. rates (in Hz) are only
+        used to size the buffers of isi: draw(rows) must return one isi (in ms) for
+        each element of rows, in a single call to the rng.
+
+        The isi of all the processes are drawn at once, and turned into spike times
+        with one cumulative sum. Processes which did not reach t_stop draw a new
+        buffer, as in poisson_generator.
+        """
+        n        = (t_stop-t_start)/1000.0*rates
+        number   = numpy.ceil(n+3*numpy.sqrt(n))
+        small    = number < 100
+        number[small] = numpy.minimum(5+numpy.ceil(2*n[small]), 100)
+        number[rates <= 0] = 0
+        number   = number.astype(int)
+
+        active   = numpy.nonzero(number > 0)[0]
+        last     = t_start*numpy.ones(len(rates))
+        times, rows = [], []
+        while len(active) > 0:
+            counts = number[active]
+            ends   = numpy.cumsum(counts)
+            block  = numpy.repeat(active, counts)
+            isi    = draw(block)
+            # the cumulative sum restarts for each process
+            isi[ends[:-1]] -= numpy.add.reduceat(isi, ends-counts)[:-1]
+            spikes = numpy.add.accumulate(isi) + last[block]
+            times.append(spikes)
+            rows.append(block)
+            last[active] = spikes[ends-1]
+            active = active[last[active] < t_stop]
+
+        if len(times) == 0:
+            return numpy.zeros(0), numpy.zeros(0, int)
+        times, rows = numpy.concatenate(times), numpy.concatenate(rows)
+        if len(rows) > len(block):
+            order       = numpy.argsort(rows, kind='mergesort')
+            times, rows = times[order], rows[order]
+        keep = times < t_stop
+        return times[keep], rows[keep]
+
+    def _exponential_isi(self, rates):
+        """
+        Return the draw function of _renewal_population for Poisson processes at the 
+        given rates (in Hz)
+        """
+        scale = 1000.0/numpy.where(rates > 0, rates, 1.0)
+        return lambda rows: self.rng.exponential(1.0, len(rows))*scale[rows]
+
+    def _population(self, times, rows, n, t_start, t_stop):
+        """
+        Return a CompactSpikeList with ids 0..n-1 from spikes sorted by row and time
+        """
+        offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(rows, minlength=n))))
+        return CompactSpikeList._from_arrays(times.astype(numpy.float32), numpy.arange(n), 
+                                             offsets, t_start, t_stop)
+
+    def poisson_population(self, rates, n=None, t_start=0.0, t_stop=1000.0):
+        """
+        Returns a CompactSpikeList of n independent realizations of Poisson processes, 
+        with ids 0..n-1. This is much faster than n calls to poisson_generator: all 
+        the isi are drawn in a single call to the rng, and the spikes are stored in the
+        flat arrays of a CompactSpikeList without creating any SpikeTrain.
+
+        Inputs:
+            rates   - the rate of the discharge (in Hz), either a single value or one 
+                      per process
+            n       - the number of processes. If None, the length of rates
+            t_start - the beginning of the SpikeTrains (in ms)
+            t_stop  - the end of the SpikeTrains (in ms)
+
+        Examples:
+            >> gen.poisson_population(10, 50000, 0, 1000)
+            >> gen.poisson_population(numpy.random.uniform(5, 20, 1000), t_stop=5000)
+         
+        See also:
+            poisson_generator, gamma_population, inh_poisson_population
+        """
+        if n is None:
+            n = len(rates)
+        rates = numpy.ones(n)*rates
+        times, rows = self._renewal_population(self._exponential_isi(rates), rates, t_start, t_stop)
+        return self._population(times, rows, n, t_start, t_stop)
+
+    def gamma_population(self, a, b, n=None, t_start=0.0, t_stop=1000.0):
+        """
+        Returns a CompactSpikeList of n independent realizations of gamma processes
+        with the shapes a and scales b (in s), with ids 0..n-1. All the isi are drawn 
+        in a single call to the rng.
+
+        Inputs:
+            a,b     - the parameters of the gamma processes, either single values or
+                      one per process
+            n       - the number of processes. If None, the length of a
+            t_start - the beginning of the SpikeTrains (in ms)
+            t_stop  - the end of the SpikeTrains (in ms)
+
+        Examples:
+            >> gen.gamma_population(10, 1/100., 10000, 0, 1000)
+         
+        See also:
+            gamma_generator, poisson_population
+        """
+        if n is None:
+            n = len(a)
+        a    = numpy.ones(n)*a
+        b    = numpy.ones(n)*b
+        draw = lambda rows: self.rng.gamma(a[rows], b[rows])*1000.0
+        times, rows = self._renewal_population(draw, 1.0/(a*b), t_start, t_stop)
+        return self._population(times, rows, n, t_start, t_stop)
+
+    def inh_poisson_population(self, rate, t, t_stop, n=None):
+        """
+        Returns a CompactSpikeList of n independent realizations of inhomogeneous 
+        poisson processes (dynamic rate), with ids 0..n-1. As in inh_poisson_generator,
+        a homogeneous population at the maximal rate of each process is thinned, with
+        all the uniform random numbers drawn at once.
+
+        Inputs:
+            rate   - an array of the rates (Hz) where rate[i] is active on interval 
+                     [t[i],t[i+1]], shared by all the processes, or a 2D array with 
+                     the rates of each process in its rows
+            t      - an array specifying the time bins (in milliseconds) at which to 
+                     specify the rate
+            t_stop - length of time to simulate process (in ms)
+            n      - the number of processes. If None, the number of rows of rate
+
+        Note:
+            t_start=t[0]
+
+        Examples:
+            >> time = arange(0,1000)
+            >> stgen.inh_poisson_population(10*(1+sin(time/100.)), time, 1000, 5000)
+
+        See also:
+            inh_poisson_generator, poisson_population
+        """
+        rate = numpy.asarray(rate, float)
+        if rate.shape[-1] != numpy.shape(t)[-1] or rate.ndim > 2:
+            raise ValueError('shape mismatch: t,rate must be of the same shape')
+        if n is None:
+            n = len(numpy.atleast_2d(rate))
+        if rate.ndim == 1:
+            rmax = rate.max()*numpy.ones(n)
+        else:
+            rmax = rate.max(axis=1)
+        times, rows = self._renewal_population(self._exponential_isi(rmax), rmax, t[0], t_stop)
+        # thin the spikes
+        rn  = self.rng.uniform(0, 1, len(times))
+        idx = numpy.searchsorted(t, times)-1
+        if rate.ndim == 1:
+            spike_rate = rate[idx]
+        else:
+            spike_rate = rate[rows, idx]
+        keep = rn < spike_rate/rmax[rows]
+        return self._population(times[keep], rows[keep], n, t[0], t_stop)
+
+
+    def _thinning_population(self, rmax, t, t_stop, n, probability, fire):
+        """
+        Engine of the history dependent processes generated by thinning, for n 
+        independent processes at once. Returns the kept spikes as (times, rows) 
+        arrays sorted by row, then by time.
+
+        The candidate spikes of homogeneous Poisson processes at the rates rmax (Hz)
+        and their uniform random numbers are all drawn at once. They are then thinned 
+        in lock-step: at step k, the k-th candidates of all the processes are considered
+        together, so that the python overhead of a step is shared by the whole population,
+        and the states of the processes are held in numpy arrays of length n.
+
+        Inputs:
+            rmax        - the maximal rate (Hz) of each process
+            t           - the time bins (in ms) of the parameters of the processes
+            t_stop      - the end of the processes (in ms)
+            n           - the number of processes
+            probability - probability(rows, times, isi, idx) is called with the 
+                          candidates of the processes rows, their times, the intervals 
+                          since the previous candidates and their indices in t. It must 
+                          evolve the states of the processes and return the probabilities
+                          to keep the candidates.
+            fire        - fire(rows, times) must update the states of the processes 
+                          whose candidate was kept.
+        """
+        times, rows = self._renewal_population(self._exponential_isi(rmax), rmax, t[0], t_stop)
+        rn     = self.rng.uniform(0, 1, len(times))
+        idx    = numpy.searchsorted(t, times, 'right')-1
+        counts = numpy.bincount(rows, minlength=n)
+        starts = numpy.cumsum(counts)-counts
+        # position of each candidate in its process, and interval since the previous
+        # candidate (assuming a spike at 0.0 before the first one)
+        k      = numpy.arange(len(times)) - starts[rows]
+        isi    = numpy.diff(numpy.concatenate(([0.0], times)))
+        first  = starts[counts > 0]
+        isi[first] = times[first]
+
+        order  = numpy.argsort(k, kind='mergesort')
+        bounds = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(k))))
+        keep   = numpy.zeros(len(times), bool)
+        for step in xrange(len(bounds)-1):
+            cand = order[bounds[step]:bounds[step+1]]
+            r    = rows[cand]
+            kept = rn[cand] < probability(r, times[cand], isi[cand], idx[cand])
+            fire(r[kept], times[cand[kept]])
+            keep[cand[kept]] = True
+        return times[keep], rows[keep]
+
+    def _inh_gamma_spikes(self, a, b, t, t_stop, n):
+        a, b = numpy.asarray(a, float), numpy.asarray(b, float)
+        rmax   = _process_max(1.0/b, n)
+        t_last = numpy.zeros(n)
+
+        def probability(rows, times, isi, idx):
+            hazard = _gamma_hazard_array((times-t_last[rows])/1000.0, _process_values(a, rows, idx),
+                                         _process_values(b, rows, idx))
+            return hazard/rmax[rows]
+
+        def fire(rows, times):
+            t_last[rows] = times
+
+        return self._thinning_population(rmax, t, t_stop, n, probability, fire)
+
+    def _inh_adaptingmarkov_spikes(self, a, bq, tau, t, t_stop, n):
+        a, bq = numpy.asarray(a, float), numpy.asarray(bq, float)
+        rmax = _process_max(a, n)
+        # initial adaptation state is unadapted, i.e. large t_s
+        t_s  = 1000*tau*numpy.ones(n)
+
+        def probability(rows, times, isi, idx):
+            # evolve adaptation state
+            t_s[rows] += isi
+            return _process_values(a, rows, idx)*numpy.exp(-_process_values(bq, rows, idx)*numpy.exp(-t_s[rows]/tau))/rmax[rows]
+
+        def fire(rows, times):
+            # remap t_s state
+            t_s[rows] = -tau*numpy.log(numpy.exp(-t_s[rows]/tau)+1)
+
+        return self._thinning_population(rmax, t, t_stop, n, probability, fire)
+
+    def _inh_2Dadaptingmarkov_spikes(self, a, bq, tau_s, tau_r, qrqs, t, t_stop, n):
+        a, bq = numpy.asarray(a, float), numpy.asarray(bq, float)
+        rmax = _process_max(a, n)
+        # initial adaptation state is unadapted, i.e. large t_s
+        t_s  = 1000*tau_s*numpy.ones(n)
+        t_r  = 1000*tau_s*numpy.ones(n)
+
+        def probability(rows, times, isi, idx):
+            # evolve adaptation state
+            t_s[rows] += isi
+            t_r[rows] += isi
+            return _process_values(a, rows, idx)*numpy.exp(-_process_values(bq, rows, idx)*(numpy.exp(-t_s[rows]/tau_s)+qrqs*numpy.exp(-t_r[rows]/tau_r)))/rmax[rows]
 
+        def fire(rows, times):
+            # remap t_s state
+            t_s[rows] = -tau_s*numpy.log(numpy.exp(-t_s[rows]/tau_s)+1)
+            t_r[rows] = -tau_r*numpy.log(numpy.exp(-t_r[rows]/tau_r)+1)
 
+        return self._thinning_population(rmax, t, t_stop, n, probability, fire)
 
     def _inh_gamma_generator_python(self, a, b, t, t_stop, array=False):
         """
@@ -398,6 +745,9 @@ class StGen:
         (dynamic rate). The implementation uses the thinning method, as presented in the 
         references.
 
+        The candidate spikes are thinned by the vectorized engine of the population
+        generators, with a single process: no compiled code nor RPy is needed.
+
         Inputs:
             a,b    - arrays of the parameters of the gamma PDF where a[i] and b[i] 
             will be active on interval [t[i],t[i+1]]
@@ -425,7 +775,7 @@ class StGen:
             See source:trunk/examples/stgen/inh_gamma_psth.py
 
         See also:
-            inh_poisson_generator, gamma_hazard
+            inh_poisson_generator, inh_gamma_population, gamma_hazard
         """
 
         from numpy import shape
@@ -433,62 +783,22 @@ class StGen:
         if shape(t)!=shape(a) or shape(a)!=shape(b):
             raise ValueError('shape mismatch: t,a,b must be of the same shape')
 
-        # get max rate and generate poisson process to be thinned
-        rmax = numpy.max(1.0/b)
-        ps = self.poisson_generator(rmax, t_start=t[0], t_stop=t_stop, array=True)
-
-        # return empty if no spikes
-        if len(ps) == 0:
-            if array:
-                return numpy.array([])
-            else:
-                return SpikeTrain(numpy.array([]), t_start=t[0],t_stop=t_stop)
-
-
-        # gen uniform rand on 0,1 for each spike
-        rn = numpy.array(self.rng.uniform(0, 1, len(ps)))
-
-        # instantaneous a,b for each spike
-
-        idx=numpy.searchsorted(t,ps)-1
-        spike_a = a[idx]
-        spike_b = b[idx]
-
-        keep = numpy.zeros(shape(ps),bool)
-
-        # thin spikes
-
-        i = 0
-        t_last = 0.0
-        t_i = 0
-
-        while(i<len(ps)):
-            # find index in "t" time
-            t_i = numpy.searchsorted(t[t_i:],ps[i],'right')-1+t_i
-            if rn[i]<gamma_hazard((ps[i]-t_last)/1000.0,a[t_i],b[t_i])/rmax:
-                # keep spike
-                t_last = ps[i]
-                keep[i] = True
-            i+=1
-
-
-        spike_train = ps[keep]
+        spike_train, rows = self._inh_gamma_spikes(a, b, t, t_stop, 1)
 
         if array:
             return spike_train
 
-        return SpikeTrain(spike_train, t_start=t[0],t_stop=t_stop)
-
+        return SpikeTrain.from_sorted(spike_train, t_start=t[0],t_stop=t_stop)
 
-    # use slow python implementation for the time being
-    # TODO: provide optimized C/weave implementation if possible
-      
     def inh_gamma_generator(self, a, b, t, t_stop, array=False):
         """
         Returns a SpikeList whose spikes are a realization of an inhomogeneous gamma process 
         (dynamic rate). The implementation uses the thinning method, as presented in the 
         references.
 
+        The candidate spikes are thinned by the vectorized engine of the population
+        generators, with a single process: no compiled code nor RPy is needed.
+
         Inputs:
             a,b    - arrays of the parameters of the gamma PDF where a[i] and b[i] 
             will be active on interval [t[i],t[i+1]]
@@ -516,18 +826,36 @@ class StGen:
             See source:trunk/examples/stgen/inh_gamma_psth.py
 
         See also:
-            inh_poisson_generator, gamma_hazard
+            inh_poisson_generator, inh_gamma_population, gamma_hazard
         """
 
-        if not self.rpy_checked:
-            self.have_rpy = check_dependency('rpy') or check_dependency('rpy2')
-            self.rpy_checked = True
-        if self.have_rpy:
-            return self._inh_gamma_generator_python(a, b, t, t_stop, array)
-        else:
-            raise Exception("inh_gamma_generator is disabled as dependency RPy|RPy2 was not found.")
+        return self._inh_gamma_generator_python(a, b, t, t_stop, array)
+
+    def inh_gamma_population(self, a, b, t, t_stop, n=None):
+        """
+        Returns a CompactSpikeList of n independent realizations of inhomogeneous gamma 
+        processes (dynamic rate), with ids 0..n-1. The processes are thinned together,
+        in lock-step (see inh_gamma_generator).
 
+        Inputs:
+            a,b    - arrays of the parameters of the gamma PDF where a[i] and b[i] 
+                     will be active on interval [t[i],t[i+1]], shared by all the 
+                     processes, or 2D arrays with the parameters of each process in
+                     their rows
+            t      - an array specifying the time bins (in milliseconds) at which to 
+                     specify the rate
+            t_stop - length of time to simulate process (in ms)
+            n      - the number of processes. If None, the number of rows of a,b
+
+        Examples:
+            >> gen.inh_gamma_population(a, b, t, 1000.0, 10000)
 
+        See also:
+            inh_gamma_generator, inh_poisson_population
+        """
+        n = _population_size(t, n, a, b)
+        times, rows = self._inh_gamma_spikes(a, b, t, t_stop, n)
+        return self._population(times, rows, n, t[0], t_stop)
 
     def _inh_adaptingmarkov_generator_python(self, a, bq, tau, t, t_stop, array=False):
 
@@ -541,6 +869,9 @@ class StGen:
         For the 2d implementation with relative refractoriness, 
         see the inh_2dadaptingmarkov_generator.
 
+        The candidate spikes are thinned by the vectorized engine of the population
+        generators, with a single process: no compiled code nor RPy is needed.
+
         Inputs:
             a,bq    - arrays of the parameters of the hazard function where a[i] and bq[i] 
             will be active on interval [t[i],t[i+1]]
@@ -576,7 +907,8 @@ class StGen:
 
         
         See also:
-            inh_poisson_generator, inh_gamma_generator, inh_2dadaptingmarkov_generator
+            inh_poisson_generator, inh_gamma_generator, inh_2dadaptingmarkov_generator,
+            inh_adaptingmarkov_population
 
         """
 
@@ -585,67 +917,41 @@ class StGen:
         if shape(t)!=shape(a) or shape(a)!=shape(bq):
             raise ValueError('shape mismatch: t,a,b must be of the same shape')
 
-        # get max rate and generate poisson process to be thinned
-        rmax = numpy.max(a)
-        ps = self.poisson_generator(rmax, t_start=t[0], t_stop=t_stop, array=True)
-
-        isi = numpy.zeros_like(ps)
-        isi[1:] = ps[1:]-ps[:-1]
-        isi[0] = ps[0] #-0.0 # assume spike at 0.0
-
-        # return empty if no spikes
-        if len(ps) == 0:
-            return SpikeTrain(numpy.array([]), t_start=t[0],t_stop=t_stop)
-
-
-        # gen uniform rand on 0,1 for each spike
-        rn = numpy.array(self.rng.uniform(0, 1, len(ps)))
-
-        # instantaneous a,bq for each spike
-
-        idx=numpy.searchsorted(t,ps)-1
-        spike_a = a[idx]
-        spike_bq = bq[idx]
-
-        keep = numpy.zeros(shape(ps),bool)
-
-        # thin spikes
-
-        i = 0
-        t_last = 0.0
-        t_i = 0
-        # initial adaptation state is unadapted, i.e. large t_s
-        t_s = 1000*tau
-
-        while(i<len(ps)):
-            # find index in "t" time, without searching whole array each time
-            t_i = numpy.searchsorted(t[t_i:],ps[i],'right')-1+t_i
-
-            # evolve adaptation state
-            t_s+=isi[i]
-
-            if rn[i]<a[t_i]*numpy.exp(-bq[t_i]*numpy.exp(-t_s/tau))/rmax:
-                # keep spike
-                keep[i] = True
-                # remap t_s state
-                t_s = -tau*numpy.log(numpy.exp(-t_s/tau)+1)
-            i+=1
-
-
-        spike_train = ps[keep]
+        spike_train, rows = self._inh_adaptingmarkov_spikes(a, bq, tau, t, t_stop, 1)
 
         if array:
             return spike_train
 
-        return SpikeTrain(spike_train, t_start=t[0],t_stop=t_stop)
+        return SpikeTrain.from_sorted(spike_train, t_start=t[0],t_stop=t_stop)
 
+    inh_adaptingmarkov_generator = _inh_adaptingmarkov_generator_python
 
-    # use slow python implementation for the time being
-    # TODO: provide optimized C/weave implementation if possible
+    def inh_adaptingmarkov_population(self, a, bq, tau, t, t_stop, n=None):
+        """
+        Returns a CompactSpikeList of n independent inhomogeneous realizations of the 
+        adapting markov process, with ids 0..n-1. The processes are thinned together,
+        in lock-step (see inh_adaptingmarkov_generator).
 
-        
-    inh_adaptingmarkov_generator = _inh_adaptingmarkov_generator_python
+        Inputs:
+            a,bq   - arrays of the parameters of the hazard function where a[i] and bq[i] 
+                     will be active on interval [t[i],t[i+1]], shared by all the 
+                     processes, or 2D arrays with the parameters of each process in 
+                     their rows
+            tau    - the time constant of adaptation (in milliseconds).
+            t      - an array specifying the time bins (in milliseconds) at which to 
+                     specify the rate
+            t_stop - length of time to simulate process (in ms)
+            n      - the number of processes. If None, the number of rows of a,bq
+
+        Examples:
+            >> gen.inh_adaptingmarkov_population(a, bq, 110.0, t, 10000.0, 1000)
 
+        See also:
+            inh_adaptingmarkov_generator, inh_2Dadaptingmarkov_population
+        """
+        n = _population_size(t, n, a, bq)
+        times, rows = self._inh_adaptingmarkov_spikes(a, bq, tau, t, t_stop, n)
+        return self._population(times, rows, n, t[0], t_stop)
 
     def _inh_2Dadaptingmarkov_generator_python(self, a, bq, tau_s, tau_r, qrqs, t, t_stop, array=False):
 
@@ -660,6 +966,9 @@ class StGen:
         For the 1d implementation, with no relative refractoriness,
         see the inh_adaptingmarkov_generator.
 
+        The candidate spikes are thinned by the vectorized engine of the population
+        generators, with a single process: no compiled code nor RPy is needed.
+
         Inputs:
             a,bq    - arrays of the parameters of the hazard function where a[i] and bq[i] 
             will be active on interval [t[i],t[i+1]]
@@ -701,7 +1010,8 @@ class StGen:
             See source:trunk/examples/stgen/inh_2Dmarkov_psth.py
         
         See also:
-            inh_poisson_generator, inh_gamma_generator, inh_adaptingmarkov_generator
+            inh_poisson_generator, inh_gamma_generator, inh_adaptingmarkov_generator,
+            inh_2Dadaptingmarkov_population
 
         """
 
@@ -710,74 +1020,109 @@ class StGen:
         if shape(t)!=shape(a) or shape(a)!=shape(bq):
             raise ValueError('shape mismatch: t,a,b must be of the same shape')
 
-        # get max rate and generate poisson process to be thinned
-        rmax = numpy.max(a)
-        ps = self.poisson_generator(rmax, t_start=t[0], t_stop=t_stop, array=True)
-
-        isi = numpy.zeros_like(ps)
-        isi[1:] = ps[1:]-ps[:-1]
-        isi[0] = ps[0] #-0.0 # assume spike at 0.0
-
-        # return empty if no spikes
-        if len(ps) == 0:
-            return SpikeTrain(numpy.array([]), t_start=t[0],t_stop=t_stop)
-
-
-        # gen uniform rand on 0,1 for each spike
-        rn = numpy.array(self.rng.uniform(0, 1, len(ps)))
-
-        # instantaneous a,bq for each spike
-
-        idx=numpy.searchsorted(t,ps)-1
-        spike_a = a[idx]
-        spike_bq = bq[idx]
-
-        keep = numpy.zeros(shape(ps),bool)
+        spike_train, rows = self._inh_2Dadaptingmarkov_spikes(a, bq, tau_s, tau_r, qrqs, t, t_stop, 1)
 
-        # thin spikes
-
-        i = 0
-        t_last = 0.0
-        t_i = 0
-        # initial adaptation state is unadapted, i.e. large t_s
-        t_s = 1000*tau_s
-        t_r = 1000*tau_s
-
-        while(i<len(ps)):
-            # find index in "t" time, without searching whole array each time
-            t_i = numpy.searchsorted(t[t_i:],ps[i],'right')-1+t_i
-
-            # evolve adaptation state
-            t_s+=isi[i]
-            t_r+=isi[i]
+        if array:
+            return spike_train
 
-            if rn[i]<a[t_i]*numpy.exp(-bq[t_i]*(numpy.exp(-t_s/tau_s)+qrqs*numpy.exp(-t_r/tau_r)))/rmax:
-                # keep spike
-                keep[i] = True
-                # remap t_s state
-                t_s = -tau_s*numpy.log(numpy.exp(-t_s/tau_s)+1)
-                t_r = -tau_r*numpy.log(numpy.exp(-t_r/tau_r)+1)
-            i+=1
+        return SpikeTrain.from_sorted(spike_train, t_start=t[0],t_stop=t_stop)
 
+    inh_2Dadaptingmarkov_generator = _inh_2Dadaptingmarkov_generator_python
 
-        spike_train = ps[keep]
+    def inh_2Dadaptingmarkov_population(self, a, bq, tau_s, tau_r, qrqs, t, t_stop, n=None):
+        """
+        Returns a CompactSpikeList of n independent inhomogeneous realizations of the 
+        2D adapting markov process, with ids 0..n-1. The processes are thinned together,
+        in lock-step (see inh_2Dadaptingmarkov_generator).
 
-        if array:
-            return spike_train
+        Inputs:
+            a,bq   - arrays of the parameters of the hazard function where a[i] and bq[i] 
+                     will be active on interval [t[i],t[i+1]], shared by all the 
+                     processes, or 2D arrays with the parameters of each process in 
+                     their rows
+            tau_s  - the time constant of adaptation (in milliseconds).
+            tau_r  - the time constant of refractoriness (in milliseconds).
+            qrqs   - the ratio of refractoriness conductance to adaptation conductance.
+            t      - an array specifying the time bins (in milliseconds) at which to 
+                     specify the rate
+            t_stop - length of time to simulate process (in ms)
+            n      - the number of processes. If None, the number of rows of a,bq
 
-        return SpikeTrain(spike_train, t_start=t[0],t_stop=t_stop)
+        Examples:
+            >> gen.inh_2Dadaptingmarkov_population(a, bq, 110.0, 1.97, 221.96, t, 20000.0, 1000)
 
+        See also:
+            inh_2Dadaptingmarkov_generator, inh_adaptingmarkov_population
+        """
+        n = _population_size(t, n, a, bq)
+        times, rows = self._inh_2Dadaptingmarkov_spikes(a, bq, tau_s, tau_r, qrqs, t, t_stop, n)
+        return self._population(times, rows, n, t[0], t_stop)
 
-    # use slow python implementation for the time being
-    # TODO: provide optimized C/weave implementation if possible
 
-        
-    inh_2Dadaptingmarkov_generator = _inh_2Dadaptingmarkov_generator_python
+    def parallel_population(self, generator, n, block_size=1000, processes=1, seed=None, split=(), **params):
+        """
+        Returns a CompactSpikeList of n independent processes, with ids 0..n-1, generated
+        by blocks of block_size processes, possibly in parallel by a pool of worker processes.
 
+        Each block is generated with its own random number generator, seeded with the 
+        pair (seed, index of the block): the streams of the blocks are independent, and 
+        derived deterministically from the seed only. The result is thus bit-identical 
+        whatever the number of processes used.
 
+        Inputs:
+            generator  - the name of a population method of StGen, for example 
+                         'poisson_population' or 'inh_gamma_population'
+            n          - the number of processes
+            block_size - the number of processes of a block
+            processes  - the number of worker processes. If None, the number of CPUs
+            seed       - the seed from which the streams of the blocks are derived.
+                         If None, it is drawn from the rng of the StGen object.
+            split      - the names of the parameters given for each process, i.e. whose
+                         first axis has length n, which are sliced for each block
+            params     - the parameters of the generator, other than n
 
+        Examples:
+            >> gen.parallel_population('poisson_population', 50000, processes=4, seed=42, 
+                                       rates=numpy.random.uniform(5, 20, 50000), 
+                                       t_stop=10000.0, split=['rates'])
+            >> gen.parallel_population('inh_adaptingmarkov_population', 10000, processes=4, 
+                                       seed=1, a=a, bq=bq, tau=110.0, t=t, t_stop=10000.0)
 
+        See also:
+            poisson_population, gamma_population, inh_poisson_population, 
+            inh_gamma_population, inh_adaptingmarkov_population, 
+            inh_2Dadaptingmarkov_population
+        """
+        if seed is None:
+            seed = self.rng.randint(2**31)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        tasks = []
+        for block, start in enumerate(xrange(0, n, block_size)):
+            stop   = min(start+block_size, n)
+            kwargs = dict(params, n=stop-start)
+            for name in split:
+                kwargs[name] = numpy.asarray(params[name])[start:stop]
+            tasks.append((generator, seed, block, kwargs))
+        if processes > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_population_block, tasks)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            results = map(_population_block, tasks)
 
+        if len(results) == 0:
+            return getattr(self, generator)(**dict(params, n=0))
+        times   = numpy.concatenate([r[0] for r in results])
+        counts  = numpy.concatenate([numpy.diff(r[1]) for r in results])
+        offsets = numpy.concatenate(([0], numpy.cumsum(counts)))
+        return CompactSpikeList._from_arrays(times, numpy.arange(n), offsets, results[0][2], results[0][3])
 
 
     def _OU_generator_python(self, dt, tau, sigma, y0, t_start=0.0, t_stop=1000.0, array=False,time_it=False):
@@ -884,17 +1229,14 @@ class StGen:
         result = AnalogSignal(y, dt, t_start, t_stop)
         return result
         
-    # use slow python implementation for the time being
-    # TODO: provide optimized C/weave implementation if possible
-
-
-    def OU_generator_weave1(self, dt,tau,sigma,y0,t_start=0.0,t_stop=1000.0,time_it=False):
+    def _OU_generator_lfilter(self, dt, tau, sigma, y0, t_start=0.0, t_stop=1000.0, array=False,time_it=False):
         """ 
         Generates an Orstein Ulbeck process using the forward euler method. The function returns
         an AnalogSignal object.
 
-        OU_generator_weave1, as opposed to OU_generator, uses scipy.weave
-        and is thus much faster.
+        The recursion y[i] = y[i-1]*(1-dt/tau) + noise[i-1] is an AR(1) filter, applied
+        to the gaussian noise with scipy.signal.lfilter: the result is the same as the one 
+        of the python loop of _OU_generator_python2, without any per-sample python code.
         
         Inputs:
             dt      - the time resolution in milliseconds of th signal
@@ -908,62 +1250,106 @@ class StGen:
             and are both numpy arrays.
         
         Examples:
-            >> stgen.OU_generator_weave1(0.1, 2, 3, 0, 0, 10000)
+            >> stgen.OU_generator(0.1, 2, 3, 0, 0, 10000)
 
         See also:
-            OU_generator
+            OU_population
         """
-        import scipy.weave
-        
+
         import time
 
         if time_it:
             t1 = time.time()
 
-
-        t = numpy.arange(t_start,t_stop,dt)
-        N = len(t)
-        y = numpy.zeros(N,float)
-        y[0] = y0
-        fac = dt/tau
+        t     = numpy.arange(t_start,t_stop,dt)
+        N     = len(t)
+        fac   = dt/tau
         gauss = fac*y0+numpy.sqrt(2*fac)*sigma*self.rng.standard_normal(N-1)
-        
-        
-        # python loop... bad+slow!
-        #for i in xrange(1,len(t)):
-        #    y[i] = y[i-1]+dt/tau*(y0-y[i-1])+numpy.sqrt(2*dt/tau)*sigma*numpy.random.normal()
+        y     = _ou_filter(gauss, y0, 1-fac)
 
-        # use weave instead
+        if time_it:
+            print time.time()-t1
 
-        code = """
+        if array:
+            return (y,t)
 
-        double f = 1.0-fac;
+        result = AnalogSignal(y, dt, t_start, t_stop)
+        return result
+
+    def OU_population(self, dt, tau, sigma, y0, n, t_start=0.0, t_stop=1000.0, array=False):
+        """ 
+        Generates n independent Orstein Ulbeck processes, using the forward euler method,
+        as OU_generator does for a single one. All the processes are advanced at once, by
+        filtering their gaussian noises with scipy.signal.lfilter. Returns an 
+        AnalogSignalList with ids 0..n-1.
+        
+        Inputs:
+            dt      - the time resolution in milliseconds of th signals
+            tau     - the correlation time in milliseconds
+            sigma   - std dev of the processes, a single value or one per process
+            y0      - initial value of the processes, at t_start, a single value or 
+                      one per process
+            n       - the number of processes
+            t_start - start time in milliseconds
+            t_stop  - end time in milliseconds
+            array   - if True, the functions returns the tuple (y,t) 
+            where y is a 2D array with the OU signals in its rows and t the 
+            time bins.
+        
+        Examples:
+            >> stgen.OU_population(0.1, 2, 3, 0, 1000, 0, 10000)
 
-        for(int i=1;i<Ny[0];i++) {
-          y(i) = y(i-1)*f + gauss(i-1);
-        }
+        See also:
+            OU_generator
         """
+        t     = numpy.arange(t_start,t_stop,dt)
+        N     = len(t)
+        fac   = dt/tau
+        y0    = numpy.ones(n)*y0
+        sigma = numpy.ones(n)*sigma
+        gauss = (fac*y0)[:,None]+(numpy.sqrt(2*fac)*sigma)[:,None]*self.rng.standard_normal((n,N-1))
+        y     = _ou_filter(gauss, y0, 1-fac)
 
-        scipy.weave.inline(code,['y', 'gauss', 'fac'],
-                     type_converters=scipy.weave.converters.blitz)
+        if array:
+            return (y,t)
 
+        return AnalogSignalList._from_array(y, numpy.arange(n), dt, t_start, t_stop)
 
-        if time_it:
-            print 'Elapsed ',time.time()-t1,' seconds.'
+    def OU_generator_weave1(self, dt,tau,sigma,y0,t_start=0.0,t_stop=1000.0,time_it=False):
+        """ 
+        Generates an Orstein Ulbeck process using the forward euler method. The function returns
+        an AnalogSignal object.
 
-        if array:
-            return (y,t)
+        Kept for compatibility: scipy.weave does not exist anymore, and the process is now 
+        generated without any compiled code by OU_generator.
+        
+        Examples:
+            >> stgen.OU_generator_weave1(0.1, 2, 3, 0, 0, 10000)
 
-        result = AnalogSignal(y,dt,t_start,t_stop)
-        return result
+        See also:
+            OU_generator
+        """
+        return self._OU_generator_lfilter(dt, tau, sigma, y0, t_start, t_stop, time_it=time_it)
 
 
 
-    OU_generator = _OU_generator_python2
+    OU_generator = _OU_generator_lfilter
 
     # TODO: optimized inhomogeneous OU generator
 
 
+# Worker of StGen.parallel_population, at module level to be sent to a pool
+def _population_block(args):
+    """
+    Generate one block of processes for StGen.parallel_population, with the rng 
+    seeded by (seed, block), and return its flat arrays and time parameters
+    """
+    generator, seed, block, kwargs = args
+    gen    = StGen(rng=numpy.random.RandomState([seed, block]))
+    result = getattr(gen, generator)(**kwargs)
+    return result._times, result._offsets, result.t_start, result.t_stop
+
+
 # TODO: have a array generator with spatio-temporal correlations
 
 # TODO fix shotnoise stuff below  ... and write tests
@@ -971,6 +1357,16 @@ class StGen:
 # Operations on spike trains
 
 
+def _shotnoise_filter(counts, q, tau, dt):
+    """
+    Exact shot noise of the spike counts sampled at dt (along the last axis), 
+    computed with the recursive exponential filter 
+    g[k] = g[k-1]*exp(-dt/tau) + q*counts[k], in a time linear in the length
+    of the counts and for all the rows at once.
+    """
+    return q*scipy.signal.lfilter([1.0], [1.0, -numpy.exp(-dt/tau)], counts, axis=-1)
+
+
 def shotnoise_fromspikes(spike_train,q,tau,dt=0.1,t_start=None, t_stop=None,array=False, eps = 1.0e-8):
     """ 
     Convolves the provided spike train with shot decaying exponentials
@@ -987,11 +1383,12 @@ def shotnoise_fromspikes(spike_train,q,tau,dt=0.1,t_start=None, t_stop=None,arra
       t_stop  - stop time of the resulting AnalogSignal
       If unspecified, t_stop of spike_train is used
       array - if True, returns (shotnoise,t) as numpy arrays, otherwise an AnalogSignal.
-      eps - a numerical parameter indicating at what value of 
-      the shot kernal the tail is cut.  The default is usually fine.
+      eps - not used anymore, kept for compatibility: the exponentials are no longer
+      truncated, since the shot noise is computed with an exact recursive filter.
 
    Note:
       Spikes in spike_train before t_start are taken into account in the convolution.
+      Spikes falling in the same time bin add up.
 
    Examples:
       >> stg = stgen.StGen()
@@ -1000,7 +1397,7 @@ def shotnoise_fromspikes(spike_train,q,tau,dt=0.1,t_start=None, t_stop=None,arra
 
 
    See also:
-      poisson_generator, inh_gamma_generator, inh_adaptingmarkov_generator, OU_generator ...
+      shotnoise_fromspikelist, poisson_generator, inh_gamma_generator, inh_adaptingmarkov_generator, OU_generator ...
    """
 
     st = spike_train
@@ -1008,10 +1405,6 @@ def shotnoise_fromspikes(spike_train,q,tau,dt=0.1,t_start=None, t_stop=None,arra
     if t_start is not None and t_stop is not None:
         assert t_stop>t_start
 
-    # time of vanishing significance
-    vs_t = -tau*numpy.log(eps/q)
-
-
     if t_stop == None:
         t_stop = st.t_stop
 
@@ -1030,20 +1423,14 @@ def shotnoise_fromspikes(spike_train,q,tau,dt=0.1,t_start=None, t_stop=None,arra
 
     t = numpy.arange(t_start,t_stop,dt)
 
+    spikes = st.spike_times[st.spike_times<t_stop]
+    idx = numpy.clip(numpy.searchsorted(t,spikes,'right')-1,0,len(t)-1)
 
-    kern = q*numpy.exp(-numpy.arange(0.0,vs_t,dt)/tau)
-
-    idx = numpy.clip(numpy.searchsorted(t,st.spike_times,'right')-1,0,len(t)-1)
-
-    a = numpy.zeros(numpy.shape(t),float)
-
-    a[idx] = 1.0
-
-    y = numpy.convolve(a,kern)[0:len(t)]
+    y = _shotnoise_filter(numpy.bincount(idx, minlength=len(t)), q, tau, dt)
 
     if array:
        signal_t = numpy.arange(window_start,t_stop,dt)
-       signal_y = y[-len(t):]
+       signal_y = y[len(t)-len(signal_t):]
        return (signal_y,signal_t)
 
 
@@ -1054,35 +1441,83 @@ def shotnoise_fromspikes(spike_train,q,tau,dt=0.1,t_start=None, t_stop=None,arra
     return result
 
 
+def shotnoise_fromspikelist(spike_list,q,tau,dt=0.1,t_start=None,t_stop=None,array=False):
+    """
+    Convolves all the spike trains of a SpikeList with shot decaying exponentials,
+    as shotnoise_fromspikes does for a single SpikeTrain, e.g. to generate the
+    conductances of many synapses. The spikes of all the trains are counted in one
+    pass, and the recursive exponential filter is applied to all the trains at once.
+    Returns a ConductanceList with the ids of the SpikeList if array=False, otherwise
+    (shotnoise,t) as numpy arrays, shotnoise having one row per id of the SpikeList.
 
+   Inputs:
+      spike_list - a SpikeList object
+      q - the shot jump for each spike, either a single value or one value per id
+      tau - the shot decay time constant in milliseconds
+      dt - the resolution of the resulting shotnoise in milliseconds
+      t_start - start time of the resulting signals
+      If unspecified, t_start of spike_list is used
+      t_stop  - stop time of the resulting signals
+      If unspecified, t_stop of spike_list is used
+      array - if True, returns (shotnoise,t) as numpy arrays, otherwise a ConductanceList.
 
+   Note:
+      Spikes in spike_list before t_start are taken into account in the convolution.
 
-def _gen_g_add(spikes,q,tau,t,eps = 1.0e-8):
-    """
+   Examples:
+      >> stg = stgen.StGen()
+      >> spikes = stg.poisson_population(10.0, 1000, 0.0, 1000.0)
+      >> g_e = shotnoise_fromspikelist(spikes, 2.0, 10.0, dt=0.1)
 
-    spikes is a SpikeTrain object
+   See also:
+      shotnoise_fromspikes, poisson_population
+   """
 
-    """
+    if t_start is not None and t_stop is not None:
+        assert t_stop>t_start
 
-    #spikes = poisson_generator(rate,t[-1])
+    if t_stop == None:
+        t_stop = spike_list.t_stop
 
-    gd_s = numpy.zeros(t.shape,float)
+    if t_start == None:
+        t_start = spike_list.t_start
+        window_start = spike_list.t_start
+    else:
+        window_start = t_start
+        if t_start>spike_list.t_start:
+            t_start = spike_list.t_start
 
-    dt = t[1]-t[0]
+    t = numpy.arange(t_start,t_stop,dt)
+    id_list = spike_list.id_list
 
-    # time of vanishing significance
-    vs_t = -tau*numpy.log(eps/q)
-    kern = q*numpy.exp(-numpy.arange(0.0,vs_t,dt)/tau)
+    times, rows = spike_list._flat_rows()
+    times, rows = times[times<t_stop], rows[times<t_stop]
+    idx = numpy.clip(numpy.searchsorted(t,times,'right')-1,0,len(t)-1)
+    counts = numpy.bincount(rows*len(t)+idx, minlength=len(id_list)*len(t))
 
-    vs_idx = len(kern)
+    q = numpy.asarray(q, float)
+    if q.ndim == 1:
+        q = q[:,None]
+    y = _shotnoise_filter(counts.reshape(len(id_list),len(t)), q, tau, dt)
 
-    idx = numpy.clip(numpy.searchsorted(t,spikes.spike_times),0,len(t)-1)
-    idx2 = numpy.clip(idx+vs_idx,0,len(gd_s))
-    idx3 = idx2-idx
+    signal_t = numpy.arange(window_start,t_stop,dt)
+    y = y[:,len(t)-len(signal_t):]
+    if array:
+        return (y,signal_t)
 
-    for i in xrange(len(idx)):
+    order = numpy.argsort(id_list)
+    return ConductanceList._from_array(y[order], id_list[order], dt, window_start, t_stop)
 
-        gd_s[idx[i]:idx2[i]] += kern[0:idx3[i]]
 
-    return gd_s
+def _gen_g_add(spikes,q,tau,t,eps = 1.0e-8):
+    """
+
+    spikes is a SpikeTrain object
+
+    """
+
+    dt = t[1]-t[0]
+
+    idx = numpy.clip(numpy.searchsorted(t,spikes.spike_times),0,len(t)-1)
 
+    return _shotnoise_filter(numpy.bincount(idx, minlength=len(t)), q, tau, dt)
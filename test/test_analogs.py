@@ -89,6 +89,43 @@ class AnalogSignal(unittest.TestCase):
         assert len(res3)==1
         assert res3[0].duration() == 950.0
 
+    def testEventWindows(self):
+        sig = analogs.AnalogSignal(np.sin(np.arange(10000.)), 0.1)
+        res = sig.event_windows([0, 50, 100, 999], t_min=0, t_max=50)
+        assert res.shape == (3, 500)
+        for window, event in zip(res, [0, 50, 100]):
+            assert np.all(window == sig.time_slice(event, event+50).signal)
+        assert sig.event_windows([], t_min=5, t_max=5).shape == (0, 100)
+        sig = analogs.AnalogSignal(np.arange(1000.), 0.1)
+        res = sig.event_windows([20.05, 50.04], t_min=1, t_max=2)
+        for window, slice in zip(res, sig.slice_by_events([20.05, 50.04], t_min=1, t_max=2).values()):
+            assert np.all(window == slice.signal)
+
+    def testEventMask(self):
+        sig = analogs.AnalogSignal(np.sin(np.arange(10000.)), 0.1)
+        for events in [[500.], [0.], [250., 750.], [1000.], [240., 250., 300.], [240.002, 499.996]]:
+            mask   = sig.event_mask(events, t_min=50., t_max=50.)
+            pieces = [s.signal for s in sig.slice_exclude_events(events, t_min=50., t_max=50.)]
+            assert np.all(sig.signal[~mask] == np.concatenate(pieces))
+        sig  = analogs.AnalogSignal(np.arange(1000.), 0.1)
+        mask = sig.event_mask([20.05], t_min=1, t_max=2)
+        assert np.all(sig.signal[mask] == sig.event_windows([20.05], t_min=1, t_max=2)[0])
+
+    def testEventTriggeredAverage(self):
+        sig    = analogs.AnalogSignal(np.random.rand(10000), 0.1, 10)
+        events = [5, 15.3, 500, 503.1, 1005]
+        ref    = [sig.signal[int(np.floor(ev/0.1)) - 100 - 50:int(np.floor(ev/0.1)) - 100 + 100] for ev in [15.3, 500, 503.1]]
+        waves  = sig.event_triggered_average(events, average=False, t_min=5, t_max=10)
+        assert waves.shape == (3, 150)
+        assert np.all(waves == np.array(ref))
+        avg, time_axis = sig.event_triggered_average(events, t_min=5, t_max=10, with_time=True)
+        np.testing.assert_array_almost_equal(avg, np.mean(ref, axis=0))
+        assert len(time_axis) == 150 and time_axis[50] == 0
+        mean, var, count = sig.event_triggered_moments(events, t_min=5, t_max=10, block_size=2)
+        assert count == 3
+        np.testing.assert_array_almost_equal(mean, np.mean(ref, axis=0))
+        np.testing.assert_array_almost_equal(var, np.var(ref, axis=0))
+
     def testCovariance(self):
         a1 = analogs.AnalogSignal(np.random.normal(size=10000),dt=0.1)
         a2 = analogs.AnalogSignal(np.random.normal(size=10000),dt=0.1)
@@ -103,6 +140,16 @@ class AnalogSignal(unittest.TestCase):
         sig = analogs.AnalogSignal(sig, 0.1)
         res = sig.threshold_detection(0.1)
         assert len(res) == 10
+
+    def testThresholdDetectionRefractoryAndInterpolation(self):
+        sig = analogs.AnalogSignal(np.array([0., 1, 0, 1, 0, 0, 0, 1, 3]), 1.)
+        assert np.all(sig.threshold_detection(0.5, 'raw') == [1, 3, 7])
+        assert np.all(sig.threshold_detection(0.5, 'raw', refractory=3) == [1, 7])
+        burst = analogs.AnalogSignal(np.arange(2000) % 2, 0.3)
+        np.testing.assert_array_almost_equal(burst.threshold_detection(0.5, 'raw', refractory=1), 
+                                             np.arange(0.3, 600, 1.2))
+        np.testing.assert_array_almost_equal(sig.threshold_detection(2, 'raw', interpolate=True), [7.5])
+        assert np.all(sig.threshold_detection(0.5, 'raw', sign='below') == [0, 2, 4])
         
         
         
@@ -165,6 +212,43 @@ class AnalogSignalList(unittest.TestCase):
         analog2 = analogs.load_vmlist(file, t_start=0, t_stop=100)
         assert analog2.t_stop == 100
     
+    def testSaveAndLoadBinary(self):
+        file = io.StandardBinaryFile("tmp.bin")
+        self.analog.save(file)
+        analog2 = analogs.load_vmlist(file)
+        assert len(analog2) == len(self.analog) and np.all(analog2[3].signal == self.analog[3].signal)
+        analog2 = analogs.load_vmlist(file, id_list=range(5), t_start=10, t_stop=50)
+        assert len(analog2) == 5 and (analog2.t_start, analog2.t_stop) == (10, 50)
+        assert np.all(analog2[4].signal == self.analog[4].time_slice(10, 50).signal)
+        os.remove("tmp.bin")
+
+    def testSaveAndLoadMemmap(self):
+        self.analog[4].signal[:] = np.random.rand(1000)
+        file = io.StandardBinaryFile("tmp_mmap.bin")
+        self.analog.save(file)
+        analog2 = analogs.load_vmlist(file, t_start=10, t_stop=50, mmap=True)
+        analog2.block_size = 1000
+        assert isinstance(analog2._signals, np.memmap) and analog2.signal_length == 400
+        ref = self.analog.time_slice(10, 50)
+        np.testing.assert_array_almost_equal(analog2.mean(), ref.mean())
+        np.testing.assert_array_almost_equal(analog2.std(), ref.std())
+        np.testing.assert_array_almost_equal(ref.mean(), np.mean(ref._signals, axis=0))
+        sub = analog2.id_slice([3, 4, 5]).time_slice(20, 30)
+        assert isinstance(sub._signals, np.memmap)
+        assert np.all(sub[4].signal == self.analog[4].time_slice(20, 30).signal)
+        del analog2, sub
+        os.remove("tmp_mmap.bin")
+
+    def testSaveAndLoadHDF5(self):
+        if not io.HAVE_TABLES:
+            return
+        file = io.HDF5File("tmp.h5")
+        self.analog.save(file)
+        analog2 = analogs.load_vmlist(file, id_list=[0,1,2,5], t_start=10, t_stop=50)
+        assert len(analog2) == 4 and (analog2.t_start, analog2.t_stop) == (10, 50)
+        assert np.all(analog2[5].signal == self.analog[5].time_slice(10, 50).signal)
+        os.remove("tmp.h5")
+
     # def testSaveAndLoadPickleIdsPart(self):
     #     file = io.StandardPickleFile("tmp.pickle")
     #     self.analog.save(file)
@@ -181,10 +265,76 @@ class AnalogSignalList(unittest.TestCase):
     def testStd(self):
         assert len(self.analog.std()) == len(self.analog[0])
 
+    def testDenseStorage(self):
+        values = np.array([(id, 10*id + t) for t in xrange(50) for id in [3, 1, 2]])
+        np.random.shuffle(values[:,0])
+        analog = analogs.AnalogSignalList(values, [1, 2, 3, 7], 0.1)
+        assert np.all(analog.id_list() == [1, 2, 3]) and analog.signal_length == 50
+        for id in analog.id_list():
+            assert np.all(analog[id].signal == values[values[:,0] == id, 1])
+        data = analog.raw_data()
+        assert np.all(data[data[:,1] == 2, 0] == analog[2].signal)
+        signals = np.array([analog[id].signal for id in analog.id_list()])
+        np.testing.assert_array_almost_equal(analog.mean(), signals.mean(axis=0))
+        np.testing.assert_array_almost_equal(analog.std(), signals.std(axis=0))
+        sub = analog.time_slice(1, 3)
+        assert sub.signal_length == 20 and np.all(sub[3].signal == analog[3].signal[10:30])
+        self.assertRaises(Exception, analogs.AnalogSignalList, values[1:], [1, 2, 3], 0.1)
+
+    def testEventTriggeredAverageAll(self):
+        events  = {0 : [10, 20.5, 55], 3 : [30]}
+        results = self.analog.event_triggered_average(events, t_min=5, t_max=10, mode='all')
+        for id in self.analog.id_list():
+            np.testing.assert_array_almost_equal(results[0][id], 
+                self.analog[id].event_triggered_average(events[0], t_min=5, t_max=10))
+        waves   = self.analog.event_triggered_average(events, average=False, t_min=5, t_max=10, mode='all')
+        assert waves[3][4].shape == (1, 150)
+
+    def testThresholdDetection(self):
+        spikes = self.analog.threshold_detection(0.5, refractory=1, interpolate=True)
+        assert isinstance(spikes, analogs.SpikeList) and np.all(spikes.id_list == self.analog.id_list())
+        for id in self.analog.id_list():
+            np.testing.assert_array_almost_equal(spikes[id].spike_times, self.analog[id].threshold_detection(
+                0.5, 'raw', refractory=1, interpolate=True), 4)
+        spikes = self.analog.threshold_detection(np.arange(10)/10., sign='below')
+        assert np.all(spikes[7].spike_times == self.analog[7].threshold_detection(0.7, sign='below').spike_times)
+
     def testSelectIds(self):
         assert type(self.analog.select_ids("cell.mean() > 0")) == list
 
 
+class SignalStatistics(unittest.TestCase):
+
+    def testChunks(self):
+        data  = np.random.randn(57, 300)*10 + 5
+        stats = analogs.SignalStatistics(300)
+        for start in xrange(0, 57, 10):
+            stats.update(data[start:start+10])
+        stats.update(np.zeros((0, 300)))
+        np.testing.assert_array_almost_equal(stats.mean(), data.mean(axis=0))
+        np.testing.assert_array_almost_equal(stats.std(), data.std(axis=0))
+        np.testing.assert_array_almost_equal(stats.var(ddof=1), data.var(axis=0, ddof=1))
+        assert np.all(stats.min() == data.min(axis=0)) and np.all(stats.max() == data.max(axis=0))
+
+    def testTimeChunksAndMerge(self):
+        data  = np.random.rand(20, 300)
+        first = analogs.SignalStatistics(300).update(data[:, :100])
+        last  = analogs.SignalStatistics(200).update(data[:5, 100:]).update(data[5:, 100:])
+        stats = analogs.SignalStatistics(300).merge(first).merge(last, offset=100)
+        assert np.all(stats.count == 20)
+        np.testing.assert_array_almost_equal(stats.var(), data.var(axis=0))
+        assert np.all(np.isnan(analogs.SignalStatistics(10).update(data[:, :5]).mean()[5:]))
+
+    def testAnalogSignalList(self):
+        values = [(id, v) for id in xrange(7) for v in np.random.rand(100)]
+        analog = analogs.AnalogSignalList(values, range(7), 0.1)
+        analog.block_size = 200
+        stats  = analog.statistics()
+        assert np.all(stats.count == 7)
+        np.testing.assert_array_almost_equal(stats.mean(), analog.mean())
+        np.testing.assert_array_almost_equal(stats.std(), analog.std())
+
+
 class VmListGraphicTest(unittest.TestCase):
     
     def setUp(self):
@@ -64,6 +64,32 @@ class AnalysisTest(unittest.TestCase):
         z = analysis.ccf(a,a)
         assert z[len(z) / 2] == 1
 
+    def testPairwiseCCF(self):
+        x = numpy.random.poisson(2, (5, 300)).astype(float)
+        y = numpy.random.poisson(1, (3, 200)).astype(float)
+        pairs = [(0, 1), (2, 2), (4, 0), (1, 1)]
+        engine = analysis.PairwiseCCF(x, block_size=3)
+        cc = engine.correlate(pairs)
+        for idx, (i, j) in enumerate(pairs):
+            numpy.testing.assert_array_almost_equal(cc[idx], analysis.ccf(x[i], x[j]), 12)
+        numpy.testing.assert_array_almost_equal(engine.correlate(pairs, average=True), cc.mean(axis=0), 12)
+        engine = analysis.PairwiseCCF(x, y)
+        cc = engine.correlate([(3, 1)])
+        assert cc.shape == (1, 500)
+        numpy.testing.assert_array_almost_equal(cc[0], analysis.ccf(x[3], y[1]), 12)
+        assert engine.memory_budget() > engine.Fx.nbytes + engine.Fy.nbytes
+
+    def testBootstrapPsth(self):
+        counts = numpy.random.poisson(3, (4, 50, 20))
+        mean, lower, upper = analysis.bootstrap_psth(counts, n_boot=200, rng=numpy.random.RandomState(0))
+        assert mean.shape == lower.shape == upper.shape == (4, 20)
+        numpy.testing.assert_array_almost_equal(mean, counts.mean(axis=1))
+        assert numpy.all(lower <= mean) and numpy.all(mean <= upper)
+        mean, lower, upper = analysis.bootstrap_psth(numpy.ones((10, 5)), n_boot=50)
+        assert mean.shape == (5,)
+        numpy.testing.assert_array_almost_equal(lower, numpy.ones(5))
+        numpy.testing.assert_array_almost_equal(upper, numpy.ones(5))
+
     def testMakeKernelBox(self):
         true_kernel = self.box['kernel'].ravel()
         true_norm = self.box['norm'].ravel()[0]
@@ -189,5 +215,14 @@ class AnalysisTest(unittest.TestCase):
         matlab_int = numpy.loadtxt(self.p + '/analysis/crosscorrelate/out_matlab_int_lag_500')
         numpy.testing.assert_array_almost_equal(int, matlab_int, decimal = 3)
 
+    def testCrosscorrelateWindow(self):
+        sua1 = numpy.random.uniform(0, 1000, 50)
+        sua2 = numpy.sort(numpy.random.uniform(0, 1000, 80))
+        int, int_, norm = analysis.crosscorrelate(sua1, sua2, lag=40.0)
+        expected = numpy.concatenate([t - sua2[(sua2 > t - 40.0) & (sua2 < t + 40.0)] for t in sua1])
+        numpy.testing.assert_array_equal(int, expected)
+        int, int_, norm = analysis.crosscorrelate(sua1, sua2, lag=40.0, n_pred=5, predictor='shuffle')
+        assert len(int_) > 0 and numpy.all(numpy.abs(int_) < 40.0)
+
 if __name__ == "__main__":
     unittest.main()
@@ -5,12 +5,13 @@ Unit tests for the neurotools.signals module
 import matplotlib
 matplotlib.use('Agg')
 
-from neurotools import io
+from neurotools import io, analysis
 import neurotools.signals.spikes as spikes
 import neurotools.signals.analogs as analogs
 from neurotools.signals.pairs import *
 
 import numpy, unittest, os
+import scipy.signal
 from neurotools.__init__ import check_numpy_version, check_dependency
 newnum = check_numpy_version()
 
@@ -108,6 +109,44 @@ class SpikeTrainTest(unittest.TestCase):
                                        spk2.time_slice(0.11,0.4).spike_times) ) # should not include 0.1
         self.assert_( arrays_are_equal(spikes.SpikeTrain([0.1, 0.15, 0.3]).spike_times,
                                        spk2.time_slice(0.10,0.4).spike_times) ) # should include 0.1
+
+    
+    def testFromSorted(self):
+        times = numpy.arange(0,100,10).astype(numpy.float32)
+        spk   = spikes.SpikeTrain.from_sorted(times, 0, 100)
+        assert spk.spike_times is times and spk.is_equal(spikes.SpikeTrain(times, 0, 100))
+        spk   = spikes.SpikeTrain.from_sorted(times, copy=True)
+        assert (spk.t_start == 0) and (spk.t_stop == 90) and spk.spike_times is not times
+        spk   = spikes.SpikeTrain.from_sorted([])
+        assert (len(spk) == 0) and (spk.t_start == 0) and (spk.t_stop == 0.1)
+    
+    def testPsth(self):
+        spk    = spikes.SpikeTrain(numpy.arange(0, 1000, 7.), 0, 1000)
+        events = [100, 500, 800]
+        psth   = spk.psth(events, time_bin=5, t_min=20, t_max=30, average=False)
+        assert psth.shape == (3, 10)
+        for row, ev in enumerate(events):
+            ref = numpy.histogram(spk.spike_times - ev, numpy.arange(-20, 35, 5))[0]
+            numpy.testing.assert_array_almost_equal(psth[row], ref*1000./5)
+        average = spk.psth(events, time_bin=5, t_min=20, t_max=30)
+        assert average.shape == (10,)
+        numpy.testing.assert_array_almost_equal(average, psth.mean(axis=0))
+
+    def testTime_SliceWrongTimes(self):
+        spk = spikes.SpikeTrain([1., 2, 7])
+        self.assertRaises(ValueError, spk.time_slice, 6, 3)
+        self.assertRaises(Exception, spikes.SpikeList([(0, 1.), (0, 7.)], [0]).time_slice, 6, 3)
+        self.assertRaises(ValueError, spikes.CompactSpikeList([(0, 1.), (0, 7.)], [0]).time_slice, 6, 3)
+
+    def testTime_SliceView(self):
+        spk  = spikes.SpikeTrain(numpy.arange(0,1010,10))
+        view = spk.time_slice(250, 750)
+        assert numpy.may_share_memory(view.spike_times, spk.spike_times)
+        assert (view.t_start == 250) and (view.t_stop == 750) and len(view) == 51
+        view.time_offset(50)
+        assert numpy.all(spk.spike_times == numpy.arange(0,1010,10))
+        assert numpy.all(view.spike_times == numpy.arange(300,810,10))
+        assert not numpy.may_share_memory(spk.time_slice(250, 750).copy().spike_times, spk.spike_times)
         
     def testIsi(self):
         spk = spikes.SpikeTrain(numpy.arange(0,200,10))
@@ -187,6 +226,14 @@ class SpikeTrainTest(unittest.TestCase):
         assert (spk.distance_victorpurpura(spk2,0.1) < spk.distance_victorpurpura(spk3,0.1)) \
                 and (spk.distance_victorpurpura(spk, 0.1) == 0)
     
+    def testVictorPurpuraDistanceValues(self):
+        spk  = spikes.SpikeTrain([10., 20., 30.])
+        spk2 = spikes.SpikeTrain([10., 25.])
+        assert abs(spk.distance_victorpurpura(spk2, 0.1) - 1.5) < 1e-9
+        assert abs(spk2.distance_victorpurpura(spk, 0.1) - 1.5) < 1e-9
+        assert spk.distance_victorpurpura(spk2, 1.) == 3
+        assert spk.distance_victorpurpura(spikes.SpikeTrain([], 0, 100), 0.1) == 3
+
     def testKreuzDistance(self):
         poisson_param = 1./40
         isi           = numpy.random.exponential(poisson_param, 20)
@@ -204,6 +251,24 @@ class SpikeTrainTest(unittest.TestCase):
         
         assert (spk.distance_kreuz(spk2) < spk.distance_kreuz(spk3)) and (spk.distance_kreuz(spk) == 0)
 
+    def testIsiAndSpikeDistances(self):
+        spk  = spikes.SpikeTrain([50.], 0, 100)
+        spk2 = spikes.SpikeTrain([], 0, 100)
+        assert abs(spk.distance_isi(spk2) - 0.5) < 1e-9
+        assert spk.distance_isi(spk) == 0 and spk.distance_spike(spk) == 0
+        spk3 = spikes.SpikeTrain([20., 51., 80.], 0, 100)
+        assert spk.distance_spike(spk3) == spk3.distance_spike(spk) > 0
+
+    def testInstantaneousRate(self):
+        kernel = numpy.exp(-numpy.arange(-50, 51)**2/200.)
+        for times in [[10., 10.05, 400.], numpy.arange(0., 1000., 1.)]:
+            spk = spikes.SpikeTrain(times, 0, 1000)
+            vector = numpy.zeros(10001)
+            vector[(spk.spike_times.astype(float)/0.1).astype(int)] = 1
+            expected = 2*scipy.signal.fftconvolve(vector, kernel, 'full')[50:-51]
+            t_axis, rate = spk.instantaneous_rate(0.1, kernel, 2.)
+            assert len(t_axis) == len(rate) == 10000 and numpy.allclose(rate, expected)
+
     def testFanoFactorIsi(self):
         spk = spikes.SpikeTrain(numpy.arange(0,1010,10))
         assert spk.fano_factor_isi() == 0.
@@ -230,6 +295,13 @@ class SpikeListTest(unittest.TestCase):
         assert len(self.spk) == 10
         assert numpy.all(self.spk.id_list == numpy.arange(10))
 
+    def testCreateSpikeListNegativeSpikeTime(self):
+        self.assertRaises(ValueError, spikes.SpikeList, [(0, -1.), (0, 5.)], [0])
+        self.assertRaises(ValueError, spikes.SpikeList, [(0, 1.), (0, 5.)], [0], -1, 10)
+
+    def testCreateSpikeListWrongTimes(self):
+        self.assertRaises(Exception, spikes.SpikeList, [(0, 1.), (0, 5.)], [0], 10, 5)
+
     def testGetItem(self):
         assert isinstance(self.spk[0], spikes.SpikeTrain)
 
@@ -277,6 +349,31 @@ class SpikeListTest(unittest.TestCase):
         spk2.time_offset(100)
         assert (spk2.t_start == 100) and (spk2.t_stop == 1100)
 
+    def testPsthCounts(self):
+        events = numpy.array([20., 500., 980., 1500.])
+        counts, kept = self.spk.psth_counts(events, time_bin=5, t_min=20, t_max=30)
+        assert numpy.all(kept == events[events - 20 >= self.spk.t_start])
+        assert counts.shape == (10, len(kept), 10)
+        for row, id in enumerate(self.spk.id_list):
+            times = self.spk[id].spike_times
+            for trial, ev in enumerate(kept):
+                ref = numpy.histogram(times - ev, numpy.arange(-20, 35, 5))[0]
+                ref[-1] -= numpy.sum(times - ev == 30)
+                assert numpy.all(counts[row, trial] == ref)
+        psth = self.spk.psth(events, time_bin=5, t_min=20, t_max=30, average=False)
+        numpy.testing.assert_array_almost_equal(psth, counts.mean(axis=1))
+        assert self.spk.psth(events, time_bin=5, t_min=20, t_max=30).shape == (10, 10)
+
+    def testSlicesAreViews(self):
+        before = self.spk[0].spike_times.copy()
+        sub    = self.spk.time_slice(0, 1000).id_slice([0, 1])
+        assert numpy.may_share_memory(sub[0].spike_times, self.spk[0].spike_times)
+        assert sub[0] is not self.spk[0]
+        sub.time_offset(100)
+        assert numpy.all(self.spk[0].spike_times == before)
+        spk2 = self.spk.copy()
+        assert not numpy.may_share_memory(spk2[0].spike_times, self.spk[0].spike_times)
+
     def testFirstSpikeTime(self):
         assert self.spk.first_spike_time() >= self.spk.t_start
 
@@ -308,6 +405,21 @@ class SpikeListTest(unittest.TestCase):
     def testCVLocal(self):
         assert 0.8 < self.spk.cv_local() < 1.2
 
+    def testCVLocalTimeCourse(self):
+        self.spk.id_offset(100)
+        cv, t_axis, cv_windows = self.spk.cv_local(0, 4000, length=4, step=2, time_course=True)
+        assert len(t_axis) == len(cv_windows) == 6 and t_axis[1] == 500
+        # The first window [0, 1000] averages the terms of the spike triplets it contains
+        terms = []
+        for spktrain in self.spk:
+            st = spktrain.spike_times
+            for j in xrange(2, len(st)):
+                if st[j-2] > 0 and st[j] <= 1000:
+                    d1, d0 = st[j]-st[j-1], st[j-1]-st[j-2]
+                    terms.append(2*abs(d1-d0)/(d1+d0))
+        assert abs(cv_windows[0] - numpy.mean(terms)) < 1e-5
+        assert cv == cv_windows[-1]
+
     def testMeanRate(self):
         assert 5 < self.spk.mean_rate() < 15
 
@@ -322,6 +434,15 @@ class SpikeListTest(unittest.TestCase):
     def testMeanRateStd(self):
         assert self.spk.mean_rate_std() >= 0
 
+    def testSpikeHistogram(self):
+        hist = self.spk.spike_histogram(5.)
+        bins = self.spk.time_axis(5.)
+        for idx, id in enumerate(self.spk.id_list):
+            assert numpy.all(hist[idx] == numpy.histogram(self.spk[id].spike_times, bins)[0])
+        sparse_hist = self.spk.spike_histogram(5., normalized=True, sparse=True)
+        assert numpy.allclose(sparse_hist.toarray(), hist*200.)
+        assert numpy.allclose(self.spk.firing_rate(5., average=True, sparse=True), numpy.mean(hist*200., axis=0))
+
     def testMeanRateVarianceAndCovariance(self):
         assert (abs(self.spk.mean_rate_variance(10) - self.spk.mean_rate_covariance(self.spk, 10)) < 0.01)
 
@@ -361,6 +482,28 @@ class SpikeListTest(unittest.TestCase):
         spk2 = spikes.load_spikelist(file, t_start = 0, t_stop= 50)
         assert (spk2.t_start == 0) and (spk2.t_stop == 50)
 
+    def testSaveAndLoadBinary(self):
+        file = io.StandardBinaryFile("tmp.bin")
+        self.spk.save(file)
+        spk2 = spikes.load_spikelist(file)
+        assert len(spk2) == len(self.spk) and spk2[3].is_equal(self.spk[3])
+        spk2 = spikes.load_spikelist(file, id_list=[1,2,3,20], t_start=100, t_stop=500)
+        assert numpy.all(spk2.id_list == [1,2,3,20]) and (spk2.time_parameters() == (100, 500))
+        assert spk2[2].is_equal(self.spk[2].time_slice(100, 500)) and len(spk2[20]) == 0
+        os.remove("tmp.bin")
+
+    def testSaveAndLoadHDF5(self):
+        if not io.HAVE_TABLES:
+            return
+        file = io.HDF5File("tmp.h5")
+        self.spk.save(file)
+        spk2 = spikes.load_spikelist(file)
+        assert len(spk2) == len(self.spk) and spk2[3].is_equal(self.spk[3])
+        spk2 = spikes.load_spikelist(file, id_list=[1,2,5,20], t_start=100, t_stop=500)
+        assert numpy.all(spk2.id_list == [1,2,5,20]) and (spk2.time_parameters() == (100, 500))
+        assert spk2[5].is_equal(self.spk[5].time_slice(100, 500)) and len(spk2[20]) == 0
+        os.remove("tmp.h5")
+
     # def testSaveAndLoadPickleIdsPart(self):
     #     file = io.StandardPickleFile("tmp.pickle")
     #     self.spk.save(file)
@@ -377,6 +520,18 @@ class SpikeListTest(unittest.TestCase):
         x1,y1 = self.spk.pairwise_pearson_corrcoeff(10, time_bin=1.)
         assert x1 < y1
 
+    def testPairwiseCC(self):
+        pairs = [(1, 3), (3, 1), (2, 2), (5, 0)]
+        cc = self.spk.pairwise_cc(4, CustomPairs(self.spk, self.spk, pairs), time_bin=10., average=False)
+        for idx, (i, j) in enumerate(pairs):
+            expected = analysis.ccf(self.spk[i].time_histogram(10.), self.spk[j].time_histogram(10.))
+            assert numpy.allclose(cc[idx], expected)
+        cc_mean = self.spk.pairwise_cc(4, CustomPairs(self.spk, self.spk, pairs), time_bin=10.)
+        assert numpy.allclose(cc_mean, cc.mean(axis=0))
+        other = self.spk.id_slice([0, 1, 2])
+        cc = self.spk.pairwise_cc(2, CustomPairs(self.spk, other, [(4, 2), (7, 0)]), time_bin=10., average=False)
+        assert numpy.allclose(cc[1], analysis.ccf(self.spk[7].time_histogram(10.), other[0].time_histogram(10.)))
+
     def testRawData(self):
         data = self.spk.raw_data()
         assert (data.shape[0] > 0) and (data.shape[1] == 2)
@@ -402,11 +557,102 @@ class SpikeListTest(unittest.TestCase):
     #     # TODO: failing
     #     assert 0.9 < self.spk.fano_factor(5) < 1.1
 
+    def testAveragedInstantaneousRate(self):
+        kernel = numpy.ones(21)/21.
+        t_axis, rate = self.spk.averaged_instantaneous_rate(1., kernel, 1000., t_start=0, t_stop=2000)
+        counts = numpy.zeros(2001)
+        for spktrain in self.spk:
+            times = spktrain.spike_times[spktrain.spike_times <= 2000].astype(float)
+            numpy.add.at(counts, times.astype(int), 1)
+        expected = 1000*scipy.signal.fftconvolve(counts/10., kernel, 'full')[10:-11]
+        assert numpy.allclose(rate, expected)
+
+    def testDistanceMatrix(self):
+        matrix = self.spk.distance_matrix('victorpurpura', id_list=range(5), cost=0.5)
+        assert matrix.shape == (5, 5) and numpy.all(numpy.diag(matrix) == 0)
+        assert numpy.all(matrix == matrix.T)
+        assert abs(matrix[1,3] - self.spk[1].distance_victorpurpura(self.spk[3], 0.5)) < 1e-9
+        assert numpy.allclose(matrix, self.spk.distance_matrix(id_list=range(5), processes=2, cost=0.5))
+        matrix = self.spk.distance_matrix('spike', id_list=[2, 4, 6])
+        assert abs(matrix[0,2] - self.spk[2].distance_spike(self.spk[6])) < 1e-9
+
     def testIdOffset(self):
         self.spk.id_offset(100)
         assert numpy.all(self.spk.id_list == numpy.arange(100,110))
 
 
+class CompactSpikeListTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spikes = []
+        for idx in xrange(10):
+            isi = numpy.random.exponential(0.1, 100)
+            pspikes = numpy.cumsum(isi) * 1000.  # convert to ms
+            for spike in pspikes:
+                self.spikes.append((idx, spike))
+        numpy.random.shuffle(self.spikes)
+        self.spk = spikes.SpikeList(self.spikes, range(11))
+        self.cspk = spikes.CompactSpikeList(self.spikes, range(11))
+
+    def testCreateCompactSpikeList(self):
+        assert len(self.cspk) == 11
+        assert numpy.all(self.cspk.id_list == numpy.arange(11))
+        assert self.cspk.time_parameters() == self.spk.time_parameters()
+
+    def testGetItem(self):
+        for id in xrange(11):
+            assert self.cspk[id].is_equal(self.spk[id])
+        self.assertRaises(Exception, self.cspk.__getitem__, 20)
+
+    def testSetItemAndAppend(self):
+        self.cspk[20] = spikes.SpikeTrain(numpy.arange(10))
+        self.cspk[0] = spikes.SpikeTrain(numpy.arange(5))
+        assert len(self.cspk) == 12 and len(self.cspk[0]) == 5
+        assert arrays_are_equal(self.cspk[20].spike_times, numpy.arange(10))
+        assert self.cspk[1].is_equal(self.spk[1])
+        self.assertRaises(Exception, self.cspk.append, 0, spikes.SpikeTrain(numpy.arange(10)))
+
+    def testMeanRates(self):
+        assert numpy.allclose(self.cspk.mean_rates(), self.spk.mean_rates())
+        assert numpy.allclose(self.cspk.mean_rates(100, 500), self.spk.mean_rates(100, 500))
+        assert numpy.allclose(self.cspk.mean_rates(t_start=100), self.spk.mean_rates(t_start=100))
+        assert numpy.allclose(self.cspk.mean_rates(t_stop=500), self.spk.mean_rates(t_stop=500))
+
+    def testSpikeHistogram(self):
+        assert numpy.all(self.cspk.spike_histogram(5) == self.spk.spike_histogram(5))
+        assert numpy.all(self.cspk.spike_histogram(5, binary=True) == self.spk.spike_histogram(5, binary=True))
+
+    def testIsis(self):
+        isis = self.cspk.isi()
+        for id in xrange(11):
+            assert numpy.allclose(isis[id], self.spk[id].isi())
+
+    def testSlices(self):
+        sub = self.cspk.id_slice([2, 5, 10])
+        assert numpy.all(sub.id_list == [2, 5, 10]) and sub[5].is_equal(self.spk[5])
+        sub = self.cspk.time_slice(100, 500)
+        assert sub.time_parameters() == (100, 500)
+        assert sub[3].is_equal(self.spk[3].time_slice(100, 500))
+
+    def testConvert(self):
+        times, ids = self.cspk.convert("[times, ids]")
+        assert len(times) == len(self.spikes) and numpy.all(numpy.diff(ids) >= 0)
+        assert self.cspk.raw_data().shape == (len(self.spikes), 2)
+
+    def testOffsets(self):
+        view   = self.cspk[3]
+        before = view.spike_times.copy()
+        self.cspk.id_offset(100)
+        self.cspk.time_offset(50)
+        assert numpy.all(view.spike_times == before)
+        assert numpy.all(self.cspk.id_list == numpy.arange(100, 111))
+        assert numpy.allclose(self.cspk[103].spike_times, self.spk[3].spike_times + 50)
+
+    def testMerge(self):
+        self.cspk.merge(spikes.SpikeList(self.spikes, range(5, 15)))
+        assert len(self.cspk) == 15 and len(self.cspk[5]) == 2*len(self.spk[5])
+
+
 class LoadSpikeListTest(unittest.TestCase):
     
     def setUp(self):
@@ -438,6 +684,28 @@ class LoadSpikeListTest(unittest.TestCase):
         spk = spikes.load("tmp2.txt",'s')
         assert (len(spk) == 50) and (spk.mean_rate() > 0)
 
+    def testLoadSpikeListChunked(self):
+        spk  = spikes.load_spikelist("tmp2.txt", id_list=range(10,40), t_start=0, t_stop=2000)
+        cspk = spikes.load_spikelist("tmp2.txt", id_list=range(10,40), t_start=0, t_stop=2000, chunksize=100)
+        assert isinstance(cspk, spikes.CompactSpikeList) and (len(cspk) == 30)
+        assert numpy.allclose(cspk.mean_rates(), spk.mean_rates())
+
+    def testLoadNestFileChunked(self):
+        data = numpy.array(self.spikes)
+        data = numpy.concatenate((data, [[50, 3500.]]))
+        data[:,0] += 1
+        numpy.savetxt("tmp_nest.gdf", data, fmt='%g', delimiter='\t')
+        spk  = spikes.load_spikelist(io.NestFile("tmp_nest.gdf", padding=1), t_start=0, t_stop=2000, dims=51)
+        cspk = spikes.load_spikelist(io.NestFile("tmp_nest.gdf", padding=1), t_start=0, t_stop=2000, dims=51, chunksize=100)
+        os.remove("tmp_nest.gdf")
+        assert numpy.all(cspk.id_list == spk.id_list) and (len(cspk) == 51)
+        assert numpy.allclose(cspk.mean_rates(), spk.mean_rates())
+
+    def testIterSpikes(self):
+        chunks = list(io.StandardTextFile("tmp2.txt").iter_spikes(1000))
+        assert all(0 < len(ids) <= 1000 and len(ids) == len(times) for ids, times in chunks)
+        assert sum(len(ids) for ids, times in chunks) == len(self.spk.raw_data())
+
 
 # TODO: Evaluate if pyNN should be integrated, and how
 # class PyNNInterface(unittest.TestCase):
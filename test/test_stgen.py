@@ -249,6 +249,27 @@ Re-run the test to see if the error persists."""
 
         (ou,t) = stg.OU_generator(0.1,10.0,2.0,10.0,500.0,1500.0,array=True)
 
+    def testOUFilter(self):
+
+        stg = stgen.StGen(seed=4)
+        (ou_loop,t) = stg._OU_generator_python2(0.1,10.0,2.0,10.0,500.0,1500.0,array=True)
+        stg.seed(4)
+        (ou,t) = stg.OU_generator(0.1,10.0,2.0,10.0,500.0,1500.0,array=True)
+        assert ou[0] == 10.0 and numpy.allclose(ou, ou_loop)
+
+    def testOUPopulation(self):
+
+        # this is a statistical test with non-zero chance of failure
+
+        stg = stgen.StGen(seed=8)
+        ou = stg.OU_population(0.1, 10.0, numpy.array([1.0, 4.0]), 3.0, 2, 0.0, 20000.0)
+        assert isinstance(ou, signals.AnalogSignalList) and len(ou) == 2
+        assert ou.t_start == 0.0 and ou.t_stop == 20000.0 and ou.signal_length == 200000
+        for id, sigma in [(0, 1.0), (1, 4.0)]:
+            assert ou[id].signal[0] == 3.0
+            assert abs(ou[id].signal.mean() - 3.0) < 0.5*sigma
+            assert abs(ou[id].signal.std() - sigma) < 0.1*sigma
+
 
 
     def testInhAdaptingMarkov(self):
@@ -318,6 +339,82 @@ Re-run the test to see if the error persists."""
         assert numpy.clip(spikes2,80,140)==spikes2
 
 
+    def testPoissonPopulation(self):
+
+        # this is a statistical test with non-zero chance of failure
+
+        stg = stgen.StGen(seed=12)
+        rates = numpy.array([0.0, 5.0, 20.0, 400.0])
+        spk = stg.poisson_population(numpy.repeat(rates, 250), t_start=500.0, t_stop=2500.0)
+        assert isinstance(spk, signals.CompactSpikeList)
+        assert len(spk) == 1000 and spk.t_start == 500.0 and spk.t_stop == 2500.0
+        assert len(spk[10]) == 0
+        assert spk.first_spike_time() >= 500.0 and spk.last_spike_time() < 2500.0
+        assert numpy.all(numpy.concatenate(spk.isi()) >= 0)
+        mean_rates = spk.mean_rates().reshape(4, 250).mean(axis=1)
+        assert numpy.all(numpy.abs(mean_rates - rates) <= 0.05*rates + 0.5)
+
+        spk = stg.gamma_population(4.0, 1/40., 500, 0.0, 4000.0)
+        assert abs(spk.mean_rate() - 10.0) < 0.5
+        assert abs(numpy.mean(spk.cv_isi()) - 0.5) < 0.05
+
+    def testInhPoissonPopulation(self):
+
+        # this is a statistical test with non-zero chance of failure
+
+        stg = stgen.StGen(seed=7)
+        t = numpy.array([0.0, 1000.0])
+        rate = numpy.array([[10.0, 50.0], [0.0, 0.0], [50.0, 10.0]])
+        spk = stg.inh_poisson_population(numpy.repeat(rate, 200, axis=0), t, 2000.0)
+        assert len(spk) == 600 and spk.t_start == 0.0
+        first = spk.time_slice(0, 1000).mean_rates().reshape(3, 200).mean(axis=1)
+        assert numpy.all(numpy.abs(first - rate[:,0]) <= 0.1*rate[:,0])
+        spk = stg.inh_poisson_population(rate[0], t, 2000.0, 300)
+        assert len(spk) == 300 and abs(spk.mean_rate() - 30.0) < 1.5
+
+    def testInhThinningPopulations(self):
+
+        # this is a statistical test with non-zero chance of failure
+
+        stg = stgen.StGen(seed=3)
+
+        t = numpy.array([0.0, 10000.0])
+        a = numpy.array([23.18, 47.24])
+        bq = numpy.array([0.10912, 0.09794])*14.48
+
+        spk = stg.inh_2Dadaptingmarkov_population(a, bq, 110.0, 1.97, 221.96, t, 20000.0, 200)
+        assert isinstance(spk, signals.CompactSpikeList) and len(spk) == 200
+        assert spk.first_spike_time() > 0.0 and spk.last_spike_time() < 20000.0
+        # expected mean firing rates are 7.60 and 10.66 Hz
+        assert abs(spk.time_slice(0, 10000).mean_rate() - 7.60) < 0.5
+        assert abs(spk.time_slice(10000, 20000).mean_rate() - 10.66) < 0.5
+
+        spk = stg.inh_adaptingmarkov_population(numpy.vstack((a, 0*a)), bq, 110.0, t, 10000.0)
+        assert len(spk) == 2 and len(spk[1]) == 0 and len(spk[0]) > 0
+
+        spk = stg.inh_gamma_population(numpy.array([3.0, 3.0]), numpy.array([1.0/100.0/3.0, 1.0/200.0/3.0]),
+                                       numpy.array([500.0, 1500.0]), 2500.0, 100)
+        assert spk.t_start == 500.0 and len(spk) == 100
+        assert abs(spk.time_slice(500, 1500).mean_rate() - 100.0) < 5.0
+        assert abs(spk.time_slice(1500, 2500).mean_rate() - 200.0) < 10.0
+        self.assertRaises(ValueError, stg.inh_gamma_population, a, numpy.ones((3, 2)), t, 1000.0, 2)
+
+    def testParallelPopulation(self):
+
+        stg = stgen.StGen()
+        rates = numpy.linspace(1.0, 50.0, 250)
+        spk1 = stg.parallel_population('poisson_population', 250, block_size=60, seed=5,
+                                       rates=rates, t_stop=2000.0, split=['rates'])
+        spk2 = stg.parallel_population('poisson_population', 250, block_size=60, processes=3, seed=5,
+                                       rates=rates, t_stop=2000.0, split=['rates'])
+        assert isinstance(spk1, signals.CompactSpikeList) and len(spk1) == 250
+        assert spk1.t_start == 0.0 and spk1.t_stop == 2000.0
+        assert numpy.all(spk1.raw_data() == spk2.raw_data())
+        assert numpy.corrcoef(spk1.mean_rates(), rates)[0,1] > 0.9
+        spk3 = stg.parallel_population('poisson_population', 250, block_size=60, seed=6,
+                                       rates=rates, t_stop=2000.0, split=['rates'])
+        assert len(spk3.raw_data()) != len(spk1.raw_data()) or numpy.any(spk3.raw_data() != spk1.raw_data())
+
     def testShotNoiseFromSpikes(self):
 
 
@@ -338,6 +435,21 @@ Re-run the test to see if the error persists."""
         assert ge.t_start==500.0
         assert ge.t_stop==1500.0
 
+    def testShotNoiseFromSpikeList(self):
+
+        spk = signals.SpikeList([(0, 10.0), (0, 10.05), (1, 30.0), (2, 5.0), (2, 250.0)], [0, 1, 2], 0.0, 200.0)
+        q = numpy.array([1.0, 2.0, 3.0])
+        gl = stgen.shotnoise_fromspikelist(spk, q, 10.0, dt=0.1, t_start=20.0)
+        assert isinstance(gl, signals.ConductanceList) and len(gl) == 3
+        assert gl.t_start == 20.0 and gl.t_stop == 200.0 and gl.signal_length == 1800
+        t = numpy.arange(20.0, 200.0, 0.1)
+        # the exact exponentials, spikes before t_start included, after t_stop ignored
+        expected = [2*numpy.exp(-(t-10.0)/10.0), 2*numpy.exp(-(t-30.0)/10.0)*(t >= 30.0), 3*numpy.exp(-(t-5.0)/10.0)]
+        for id in xrange(3):
+            assert numpy.allclose(gl[id].signal, expected[id], atol=0.2)
+            single = stgen.shotnoise_fromspikes(spk[id], q[id], 10.0, dt=0.1, t_start=20.0)
+            assert numpy.allclose(gl[id].signal, single.signal)
+
         
 
 